@@ -21,8 +21,8 @@ short_description: Manage IBM Installation Manager packages
 description: Install, Update and Uninstall Installation Manager packages using remote or local repositories
 options:
   id:
-		required: true
-		description: Name of the package which is to be installed
+		required: false
+		description: Name of the package which is to be installed. May also be a list of packages, which are then installed or uninstalled with a single imcl call. Either id or offerings is required
   ibmim:
 		required: false
 		default: '/opt/IBM/InstallationManager'
@@ -38,12 +38,12 @@ options:
 		description: Comma separated list of repositories to use. May be a path, URL or both.
 	properties:
 		required: false
-		description: Comma separated list of properties needed for package installation. In the format key1=value,key2=value
+		description: Comma separated list of properties needed for package installation. In the format key1=value,key2=value. With offerings they are written as data of every profile of the response file
   state:
 		required: false
 		choices: [ present, absent, update ]
 		default: present
-		description: Install a package with 'present'. Uninstall a package with 'absent'. Update all packages with 'update'.
+		description: Install a package with 'present'. Uninstall a package with 'absent'. Update all packages (or the packages in id) with 'update'. Only packages with a newer version in the repositories are updated, and nothing is run when all packages are up to date.
 	install_fixes:
 		required: false
 		choices: [ none, recommended, all ]
@@ -53,6 +53,32 @@ options:
 		required: false
 		default: false
 		description: Append the PassportAdvantage repository to the repository list
+	offerings:
+		required: false
+		description: List of offerings to install from a generated response file with a single "imcl input" call. Each offering is a dict with the keys id, version, profile, features and install_fixes
+	profiles:
+		required: false
+		description: List of package groups used by the offerings. Each profile is a dict with the keys id, install_location and data. Defaults to the package group already installed at dest
+	preferences:
+		required: false
+		description: Dict of Installation Manager preferences
+	cache_dir:
+		required: false
+		default: /var/cache/ansible-websphere
+		description: Directory where generated response files and their digests are kept. An identical response file that has been applied before is not run again
+	repository_cache_ttl:
+		required: false
+		default: 300
+		description: Seconds a cached listing of a remote repository is used by state=update without contacting the server. After that the listing is revalidated with conditional GETs of repository.config and repository.xml (ETag/Last-Modified) and only listed again if the repository changed
+	repository_selection:
+		required: false
+		choices: [ none, order, fastest ]
+		default: none
+		description: Probe every repository with a small metadata fetch before imcl is called. 'order' passes all reachable repositories to imcl, fastest first. 'fastest' only passes the fastest one. The order and timings are returned in module_facts
+	logdir:
+		required: false
+		default: /var/log/ansible-websphere
+		description: Directory of the rotating output log (ibmim.log) and the progress file (ibmim.progress.json) of imcl. The progress file holds the percent complete and the current phase and can be read while the task runs asynchronously
 requirements:
   - IBM Installation Manager
   - Installation files on remote server or local directory
@@ -65,6 +91,29 @@ EXAMPLES = """
     id: com.ibm.websphere.liberty.BASE.v85
     repositories: /var/data/was
 
+- name: Install WebSphere Application Server ND v8.5 and IBM Java 8
+  ibmim:
+    id:
+      - com.ibm.websphere.ND.v85
+      - com.ibm.websphere.IBMJAVA.v80
+    dest: /opt/IBM/WebSphere/AppServer
+    repositories: /var/data/was,/var/data/java
+
+- name: Install WebSphere Application Server ND v8.5 with selected features from a response file
+  ibmim:
+    dest: /opt/IBM/WebSphere/AppServer
+    im_shared: /opt/IBM/IMShared
+    repositories: /var/data/was,/var/data/java
+    offerings:
+      - id: com.ibm.websphere.ND.v85
+        features: core.feature,ejbdeploy,thinclient,embeddablecontainer
+      - id: com.ibm.websphere.IBMJAVA.v80
+    profiles:
+      - id: IBM WebSphere Application Server V8.5
+        install_location: /opt/IBM/WebSphere/AppServer
+        data:
+          cic.selector.nl: en
+
 - name: Uninstall WebSphere Application Server Liberty v8.5
 	ibmim:
 		id: com.ibm.websphere.liberty.BASE.v85
@@ -94,7 +143,16 @@ class InstallationManager():
 		path = None,
 		name = None,
 		check_stdout = None,
-		check_stderr = None
+		check_stderr = None,
+		registry = None,
+		packages = [],
+		response_file = None,
+		response_digest = None,
+		updates = [],
+		repositories = None,
+		repository_probes = None,
+		log_file = None,
+		progress_file = None
 	)
 
 	def __init__(self):
@@ -108,8 +166,8 @@ class InstallationManager():
 				# /opt/IBM/InstallationManager
 				ibmim     									= dict(default='/opt/IBM/InstallationManager'),
 
-				# Package ID
-				id  												= dict(required=True),
+				# Package ID or list of package IDs
+				id  												= dict(required=False, type='list'),
 				
 				# -installationDirectory
 				dest      									= dict(required=False),
@@ -127,9 +185,31 @@ class InstallationManager():
 				connect_passport_advantage 	= dict(default=False, type='bool'),
 				
 				# -installFixes
-				install_fixes 							= dict(default='none', choices=['none', 'recommended', 'all'])
+				install_fixes 							= dict(default='none', choices=['none', 'recommended', 'all']),
+
+				# <offering> elements of a response file
+				offerings 									= dict(required=False, type='list'),
+
+				# <profile> elements of a response file
+				profiles 										= dict(required=False, type='list'),
+
+				# -preferences or <preference> elements of a response file
+				preferences 								= dict(required=False, type='dict'),
+
+				# Generated response files, their digests and repository listings
+				cache_dir 									= dict(default=DEFAULT_CACHE_DIR),
+
+				# Seconds a cached listing of a remote repository is used without asking the server
+				repository_cache_ttl 				= dict(default=300, type='int'),
+
+				# Probe the repositories and order them by speed before calling imcl
+				repository_selection 				= dict(default='none', choices=['none', 'order', 'fastest']),
+
+				# Output log and progress file of imcl
+				logdir 											= dict(default=DEFAULT_LOG_DIR)
 
 			),
+			required_one_of = [['id', 'offerings']],
 			supports_check_mode = True
 		)
 
@@ -140,20 +220,41 @@ class InstallationManager():
 		return self.module_facts[key]
 
 
-	def isProvisioned(self, dest, pacakgeId):
+	def isProvisioned(self, dest, packageIds):
 		"""
-		Checks if package is already installed at dest
+		Checks if packages are already installed at dest
 		:param dest: Destination installation directory of the product
-		:return: True if already provisioned. False if not provisioned
+		:param packageIds: list of package IDs
+		:return: True if all packages are provisioned. False if not provisioned
 		"""
-		# If destination dir does not exists then its safe to assume that IM is not installed
+		return len(self.getMissingPackages(dest, packageIds)) == 0
+
+
+	def getMissingPackages(self, dest, packageIds):
+		"""
+		Returns the packages which are not yet installed at dest
+		:param dest: Destination installation directory of the product
+		:param packageIds: list of package IDs
+		:return: list of package IDs
+		"""
+		# If destination dir does not exists then its safe to assume that the packages are not installed
 		if dest:
 			if not os.path.exists(dest):
-				return False
-		return self.getVersion(pacakgeId)["installed"]
+				return list(packageIds)
+		self.getVersions(packageIds)
+		return [package["package"] for package in self.module_facts["packages"] if not package["installed"]]
 
 
-	def getVersion(self, pacakgeId):
+	def listInstalledPackages(self):
+		"""
+		Returns all installed packages. Reads the install registry of Installation Manager
+		and only falls back to imcl listInstalledPackages if the registry can not be found
+		:return: list of dicts with the keys id, version, name and path
+		"""
+		registry = findInstallRegistry(self.module.params['ibmim'])
+		if registry:
+			self.module_facts["registry"] = registry
+			return readInstalledPackages(registry)
 
 		child = subprocess.Popen(
 			["{0}/eclipse/tools/imcl "
@@ -161,7 +262,8 @@ class InstallationManager():
 			 " -long".format(self.module.params['ibmim'])],
 			shell=True,
 			stdout=subprocess.PIPE,
-			stderr=subprocess.PIPE
+			stderr=subprocess.PIPE,
+			universal_newlines=True
 		)
 
 		stdout_value, stderr_value = child.communicate()
@@ -172,25 +274,292 @@ class InstallationManager():
 
 		if child.returncode != 0:
 			self.module.fail_json(
-				msg="Error getting installed version of package '{0}'".format(pacakgeId),
+				msg="Error getting installed packages",
 				stdout=stdout_value,
 				stderr=stderr_value,
 
 			)		
 
-		for line in stdout_value.split(os.linesep):
-			if pacakgeId in line:
-				linesplit = line.split(" : ")
-				self.module_facts["installed"] = True
-				self.module_facts["path"] = linesplit[0]
-				self.module_facts["id"] = linesplit[1]
-				self.module_facts["name"] = linesplit[2]
-				self.module_facts["version"] = linesplit[3]
-				break
+		# /opt/IBM/WebSphere/AppServer : com.ibm.websphere.ND.v85_8.5.5010.20160721_0036 : IBM WebSphere Application Server Network Deployment : 8.5.5.10
+		packages = []
+		for line in stdout_value.splitlines():
+			linesplit = line.split(" : ")
+			if len(linesplit) < 4:
+				continue
+			packageId, version = (linesplit[1].split("_", 1) + [None])[:2]
+			packages.append(dict(
+				id = packageId,
+				version = version,
+				name = linesplit[2],
+				path = linesplit[0]
+			))
+
+		return packages
+
+
+	def getVersions(self, packageIds):
+		"""
+		Looks up the installed versions of packages with a single read of the installed
+		packages and stores them in module_facts. The top level facts describe the first package
+		:param packageIds: list of package IDs
+		:return: dict
+		"""
+		installed = self.listInstalledPackages()
+
+		self.module_facts["packages"] = []
+		for packageId in packageIds:
+			facts = dict(
+				package = packageId,
+				installed = False,
+				version = None,
+				id = None,
+				path = None,
+				name = None
+			)
+			package = findPackage(installed, packageId)
+			if package:
+				facts["installed"] = True
+				facts["path"] = package["path"]
+				facts["id"] = "{0}_{1}".format(package["id"], package["version"])
+				facts["name"] = package["name"]
+				facts["version"] = package["version"]
+			self.module_facts["packages"].append(facts)
+
+		if self.module_facts["packages"]:
+			for key in ["installed", "version", "id", "path", "name"]:
+				self.module_facts[key] = self.module_facts["packages"][0][key]
 
 		return self.module_facts
 
 
+	def getVersion(self, pacakgeId):
+		"""
+		Looks up the installed version of a package and stores it in module_facts
+		:param pacakgeId: ID of the package
+		:return: dict
+		"""
+		return self.getVersions([pacakgeId])
+
+
+	def getResponseProfiles(self, offerings, profiles, dest):
+		"""
+		Resolves the package groups of a response file. Without explicit profiles the
+		package group already installed at dest is used
+		:param offerings: list of offering dicts
+		:param profiles: list of profile dicts or None
+		:param dest: Destination installation directory of the product
+		:return: list of profile dicts
+		"""
+		if not profiles and dest:
+			for package in self.listInstalledPackages():
+				if package.get("profile") and package["path"] and os.path.realpath(package["path"]) == os.path.realpath(dest):
+					profiles = [dict(id=package["profile"], install_location=dest)]
+					break
+
+		if not profiles:
+			self.module.fail_json(
+				msg="Param profiles is required when installing offerings into a new package group",
+				module_facts=self.module_facts
+			)
+
+		for profile in profiles:
+			if not profile.get("id") or not profile.get("install_location"):
+				self.module.fail_json(
+					msg="Every profile requires an id and an install_location",
+					module_facts=self.module_facts
+				)
+
+		for offering in offerings:
+			if not offering.get("id"):
+				self.module.fail_json(
+					msg="Every offering requires an id",
+					module_facts=self.module_facts
+				)
+			if not offering.get("profile"):
+				if len(profiles) > 1:
+					self.module.fail_json(
+						msg="Offering '{0}' must set a profile when several profiles are given".format(offering["id"]),
+						module_facts=self.module_facts
+					)
+				offering["profile"] = profiles[0]["id"]
+
+		return profiles
+
+
+	def installResponseFile(self, offerings, profiles):
+		"""
+		Installs offerings from a generated response file with a single imcl input call.
+		Exits without running imcl if the same response file has been applied before
+		and all offerings are still installed
+		:param offerings: list of offering dicts
+		:param profiles: list of profile dicts or None
+		"""
+		ibmim = self.module.params['ibmim']
+		dest = self.module.params['dest']
+		repositories = self.module.params['repositories']
+		cacheDir = self.module.params['cache_dir']
+
+		if not repositories:
+			self.module.fail_json(
+				changed=False,
+				msg="Param repositories is required when installing packages",
+				module_facts=self.module_facts
+			)
+
+		# The same properties as imcl install -properties, they go into the data of the profiles
+		try:
+			properties = parseProperties(self.module.params['properties'])
+		except ValueError as e:
+			self.module.fail_json(changed=False, msg=str(e), module_facts=self.module_facts)
+
+		profiles = self.getResponseProfiles(offerings, profiles, dest)
+		content = buildResponseFile(
+			offerings,
+			repositories,
+			profiles,
+			preferences=self.module.params['preferences'],
+			imShared=self.module.params['im_shared'],
+			installFixes=self.module.params['install_fixes'],
+			properties=properties
+		)
+		digest = getDigest(content)
+		self.module_facts["response_digest"] = digest
+
+		offeringIds = [offering["id"] if not offering.get("version") else "{0}_{1}".format(offering["id"], offering["version"]) for offering in offerings]
+		missingIds = self.getMissingPackages(dest, offeringIds)
+
+		if not missingIds and isApplied(cacheDir, digest):
+			self.module.exit_json(
+				changed=False,
+				msg="Response file {0} has already been applied".format(digest),
+				module_facts=self.module_facts
+			)
+
+		if self.module.check_mode:
+			self.module.exit_json(
+				changed=True,
+				msg="Response file {0} is to be applied".format(digest),
+				module_facts=self.module_facts
+			)
+
+		# The digest identifies the request, so it is taken before the repositories are reordered
+		if self.getRepositories() != repositories:
+			content = buildResponseFile(
+				offerings,
+				self.getRepositories(),
+				profiles,
+				preferences=self.module.params['preferences'],
+				imShared=self.module.params['im_shared'],
+				installFixes=self.module.params['install_fixes'],
+				properties=properties
+			)
+
+		responseFile = writeResponseFile(cacheDir, content)
+		self.module_facts["response_file"] = responseFile
+
+		cmd = ("{0}/eclipse/tools/imcl input {1} "
+					 "-acceptLicense "
+					 "-showProgress "
+					 "-stopBlockingProcesses ").format(ibmim, responseFile)
+		if self.module.params['connect_passport_advantage']:
+			cmd = "{0} -connectPassportAdvantage ".format(cmd)
+
+		returncode, stdout_value, stderr_value = self.run(cmd)
+		if returncode != 0:
+			self.module.fail_json(
+				changed=False,
+				msg="Failed applying response file {0}".format(responseFile),
+				stdout=stdout_value,
+				stderr=stderr_value,
+				module_facts=self.module_facts
+			)
+
+		recordApplied(cacheDir, digest, responseFile)
+
+		# After install, get versionInfo so that we can show it to the user
+		self.getVersions(offeringIds)
+		self.module.exit_json(
+			changed=True,
+			msg="Response file {0} applied successfully".format(responseFile),
+			stdout=stdout_value,
+			stderr=stderr_value,
+			module_facts=self.module_facts
+		)
+
+
+	def run(self, cmd):
+		"""
+		Runs imcl and streams its output to a log file and a progress file in logdir.
+		Only the last lines of the output are kept in memory
+		:param cmd: imcl command line
+		:return: tuple of returncode, stdout and stderr
+		"""
+		logFile, progressFile = getLogFiles(self.module.params['logdir'], "ibmim")
+		self.module_facts["log_file"] = logFile
+		self.module_facts["progress_file"] = progressFile
+		return runCommand(cmd, logFile, progressFile)
+
+
+	def getRepositories(self):
+		"""
+		Returns the repositories which are passed to imcl. With repository_selection the
+		repositories are probed once and ordered (or pruned) by their speed
+		:return: Comma separated list of repositories
+		"""
+		repositories = self.module.params['repositories']
+		mode = self.module.params['repository_selection']
+		if mode == 'none' or not repositories:
+			return repositories
+
+		if self.module_facts["repository_probes"] is None:
+			selected, probes = selectRepositories(repositories, mode)
+			self.module_facts["repositories"] = selected
+			self.module_facts["repository_probes"] = probes
+		return ",".join(self.module_facts["repositories"])
+
+
+	def getUpdates(self, packageIds, repositories):
+		"""
+		Compares the installed packages with the newest versions available in the
+		repositories and stores the outcome in module_facts
+		:param packageIds: list of package IDs to consider. All installed packages if empty
+		:param repositories: Comma separated list of repositories
+		:return: list of dicts with the keys id, path, before and after
+		"""
+		listings = listAvailablePackages(
+			self.module.params['ibmim'],
+			repositories,
+			self.module.params['cache_dir'],
+			ttl=self.module.params['repository_cache_ttl']
+		)
+		# A repository that could not be read must not look like one without updates
+		unreadable = [repository for repository in splitRepositories(repositories) if listings.get(repository) is None]
+		if unreadable:
+			self.module.fail_json(
+				changed=False,
+				msg="Failed to list the packages of repository {0}".format(", ".join(unreadable)),
+				module_facts=self.module_facts
+			)
+		latest = getLatestVersions(listings)
+
+		updates = []
+		for package in self.listInstalledPackages():
+			if packageIds and not [packageId for packageId in packageIds if findPackage([package], packageId)]:
+				continue
+			version = latest.get(package["id"])
+			if version and compareVersions(version, package["version"]) > 0:
+				updates.append(dict(
+					id = package["id"],
+					# Installation Manager updates itself in place
+					path = package["path"] if package["id"] != "com.ibm.cic.agent" else None,
+					before = package["version"],
+					after = version
+				))
+
+		self.module_facts["updates"] = updates
+		return updates
+
+
 	def main(self):
 
 		state = self.module.params['state']
@@ -198,7 +567,11 @@ class InstallationManager():
 		dest = self.module.params['dest']
 		im_shared = self.module.params['im_shared']
 		repositories = self.module.params['repositories']
-		pacakgeId = self.module.params['id']
+		offerings = self.module.params['offerings']
+		profiles = self.module.params['profiles']
+		preferences = self.module.params['preferences']
+		packageIds = self.module.params['id'] or [offering["id"] for offering in offerings or []]
+		packageList = ", ".join(packageIds or [])
 		properties = self.module.params['properties']
 		installFixes = self.module.params['install_fixes']
 		connectPassportAdvantage = self.module.params['connect_passport_advantage']
@@ -212,16 +585,21 @@ class InstallationManager():
 		
 		# Install
 		if state == 'present':
+
+			# Install from a generated response file
+			if offerings:
+				self.installResponseFile(offerings, profiles)
 			
 			if self.module.check_mode:
 				self.module.exit_json(
 					changed=False, 
-					msg="Package '{0}' is to be installed".format(pacakgeId),
+					msg="Package '{0}' is to be installed".format(packageList),
 					module_facts=self.module_facts
 				)
 
-			# Check wether pacakge is already installed
-			if not self.isProvisioned(dest, pacakgeId):
+			# Check which packages are not installed yet. All of them are installed with one imcl call
+			missingIds = self.getMissingPackages(dest, packageIds)
+			if missingIds:
 
 				if not repositories:
 					self.module.fail_json(
@@ -233,7 +611,8 @@ class InstallationManager():
 				cmd = ("{0}/eclipse/tools/imcl install {1} "
 							 "-repositories {2} "
 							 "-acceptLicense "
-							 "-stopBlockingProcesses ").format(ibmim, pacakgeId, repositories)
+							 "-showProgress "
+							 "-stopBlockingProcesses ").format(ibmim, " ".join(missingIds), self.getRepositories())
 
 				if dest:
 					cmd = "{0} -installationDirectory {1} ".format(cmd, dest)
@@ -246,27 +625,21 @@ class InstallationManager():
 				if connectPassportAdvantage:
 					cmd = "{0} -connectPassportAdvantage ".format(cmd)
 
-				child = subprocess.Popen(
-					[cmd], 
-					shell=True, 
-					stdout=subprocess.PIPE, 
-					stderr=subprocess.PIPE
-				)
-				stdout_value, stderr_value = child.communicate()
-				if child.returncode != 0:
+				returncode, stdout_value, stderr_value = self.run(cmd)
+				if returncode != 0:
 					self.module.fail_json(
 						changed=False, 
-						msg="Failed installing package '{0}'".format(pacakgeId), 
+						msg="Failed installing package '{0}'".format(", ".join(missingIds)), 
 						stdout=stdout_value, 
 						stderr=stderr_value,
 						module_facts=self.module_facts
 					)
 
 				# After install, get versionInfo so that we can show it to the user
-				self.getVersion(pacakgeId)
+				self.getVersions(packageIds)
 				self.module.exit_json(
 					changed=True, 
-					msg="Package '{0}' installed successfully".format(pacakgeId), 
+					msg="Package '{0}' installed successfully".format(", ".join(missingIds)), 
 					stdout=stdout_value, 
 					stderr=stderr_value,
 					module_facts=self.module_facts
@@ -276,7 +649,7 @@ class InstallationManager():
 
 				self.module.exit_json(
 					changed=False, 
-					msg="Package '{0}' is already installed".format(pacakgeId), 
+					msg="Package '{0}' is already installed".format(packageList), 
 					stdout=self.getItem("check_stdout"),
 					stderr=self.getItem("check_stderr"),
 					module_facts=self.module_facts
@@ -290,42 +663,39 @@ class InstallationManager():
 			if self.module.check_mode:
 				self.module.exit_json(
 					changed=False,
-					msg="Package '{0}' is to be uninstalled".format(pacakgeId),
+					msg="Package '{0}' is to be uninstalled".format(packageList),
 					module_facts=self.module_facts
 				)
 
-			# Check wether was is installed
-			if self.isProvisioned(dest, pacakgeId):
+			# Check which packages are installed. All of them are uninstalled with one imcl call
+			missingIds = self.getMissingPackages(dest, packageIds)
+			installedIds = [packageId for packageId in packageIds if packageId not in missingIds]
+			if installedIds:
 
-				cmd = "{0}/eclipse/tools/imcl uninstall {1} ".format(ibmim, pacakgeId)
+				cmd = "{0}/eclipse/tools/imcl uninstall {1} ".format(ibmim, " ".join(installedIds))
 
 				if dest:
 					cmd = "{0} -installationDirectory {1} ".format(cmd, dest)
 				if properties:
 					cmd = "{0} -properties {1} ".format(cmd, properties)
 				if preferences:
-					cmd = "{0} -preferences {1} ".format(cmd, preferences)
+					cmd = "{0} -preferences {1} ".format(cmd, ",".join(["{0}={1}".format(k, v) for k, v in preferences.items()]))
 
-				child = subprocess.Popen(
-					[cmd], 
-					shell=True, 
-					stdout=subprocess.PIPE, 
-					stderr=subprocess.PIPE
-				)
-				stdout_value, stderr_value = child.communicate()
-				if child.returncode != 0:
+				returncode, stdout_value, stderr_value = self.run(cmd)
+				if returncode != 0:
 					self.module.fail_json(
-						msg="Failed uninstalling package '{0}'".format(pacakgeId), 
+						msg="Failed uninstalling package '{0}'".format(", ".join(installedIds)), 
 						stdout=stdout_value, 
 						stderr=stderr_value,
 						module_facts=self.module_facts
 					)
 
 				# Remove AppServer dir forcefully so that it doesn't prevents us from reinstalling.
-				shutil.rmtree(dest, ignore_errors=False, onerror=None)
+				if dest:
+					shutil.rmtree(dest, ignore_errors=False, onerror=None)
 				self.module.exit_json(
 					changed=True,
-					msg="Package '{0}' uninstalled successfully".format(pacakgeId), 
+					msg="Package '{0}' uninstalled successfully".format(", ".join(installedIds)), 
 					stdout=stdout_value, 
 					stderr=stderr_value,
 					module_facts=self.module_facts
@@ -334,18 +704,11 @@ class InstallationManager():
 			else:
 				self.module.exit_json(
 					changed=False, 
-					msg="Package '{0}' is not installed".format(pacakgeId),
+					msg="Package '{0}' is not installed".format(packageList),
 					module_facts=self.module_facts
 				)
 		if state == 'update':
 
-			if self.module.check_mode:
-				self.module.exit_json(
-					changed=False, 
-					msg="All installed packages are to be updated".format(pacakgeId),
-					module_facts=self.module_facts
-				)
-
 			if not repositories:
 				self.module.fail_json(
 					changed=False,
@@ -353,35 +716,66 @@ class InstallationManager():
 					module_facts=self.module_facts
 				)
 
-			cmd = ("{0}/eclipse/tools/imcl updateAll "
-						 "-repositories {1}").format(ibmim, repositories)
+			# Only packages with a newer version in the repositories are updated
+			updates = self.getUpdates(packageIds, repositories)
+			if not updates:
+				self.module.exit_json(
+					changed=False,
+					msg="All packages are up to date",
+					module_facts=self.module_facts
+				)
 
-			if properties:
-				cmd = "{0} -properties {1} ".format(cmd, properties)
-			if connectPassportAdvantage:
-				cmd = "{0} -connectPassportAdvantage ".format(cmd)
-			if installFixes:
-				cmd = "{0} -installFixes {1} ".format(cmd, installFixes)
+			if self.module.check_mode:
+				self.module.exit_json(
+					changed=True,
+					msg="Packages '{0}' are to be updated".format(", ".join([update["id"] for update in updates])),
+					module_facts=self.module_facts
+				)
 
+			# Installing a newer version of an installed package updates it. One imcl call per installation directory
+			paths = []
+			for update in updates:
+				if update["path"] not in paths:
+					paths.append(update["path"])
 
-			child = subprocess.Popen(
-				[cmd], 
-				shell=True, 
-				stdout=subprocess.PIPE, 
-				stderr=subprocess.PIPE
-			)
-			stdout_value, stderr_value = child.communicate()
-			if child.returncode != 0:
-				self.module.fail_json(
-					msg="Failed updating packages", 
-					stdout=stdout_value, 
-					stderr=stderr_value,
-					module_facts=self.module_facts
-				)		
+			stdout_value = ""
+			stderr_value = ""
+			for path in paths:
+				cmd = ("{0}/eclipse/tools/imcl install {1} "
+							 "-repositories {2} "
+							 "-acceptLicense "
+							 "-showProgress "
+							 "-stopBlockingProcesses ").format(ibmim, " ".join(["{0}_{1}".format(update["id"], update["after"]) for update in updates if update["path"] == path]), self.getRepositories())
+
+				if path:
+					cmd = "{0} -installationDirectory {1} ".format(cmd, path)
+				if properties:
+					cmd = "{0} -properties {1} ".format(cmd, properties)
+				if connectPassportAdvantage:
+					cmd = "{0} -connectPassportAdvantage ".format(cmd)
+				if installFixes:
+					cmd = "{0} -installFixes {1} ".format(cmd, installFixes)
+
+				returncode, stdout_part, stderr_part = self.run(cmd)
+				stdout_value += stdout_part
+				stderr_value += stderr_part
+				if returncode != 0:
+					self.module.fail_json(
+						msg="Failed updating packages", 
+						stdout=stdout_value, 
+						stderr=stderr_value,
+						module_facts=self.module_facts
+					)		
+
+			# After the update, read the installed versions again so that we can show them to the user
+			installed = self.listInstalledPackages()
+			for update in updates:
+				package = findPackage(installed, update["id"])
+				update["after"] = package["version"] if package else None
 
 			self.module.exit_json(
 				changed=True,
-				msg="All packages updated",
+				msg="Packages '{0}' updated".format(", ".join([update["id"] for update in updates])),
 				stdout=stdout_value,
 				stderr=stderr_value,
 				module_facts=self.module_facts
@@ -389,6 +783,11 @@ class InstallationManager():
 
 # import module snippets
 from ansible.module_utils.basic import *
+from ansible.module_utils.ibmim_registry import findInstallRegistry, readInstalledPackages, findPackage
+from ansible.module_utils.ibmim_repository import listAvailablePackages, getLatestVersions, compareVersions, selectRepositories, splitRepositories
+from ansible.module_utils.ibmim_response import buildResponseFile, getDigest, parseProperties, writeResponseFile, isApplied, recordApplied
+from ansible.module_utils.websphere_cache import DEFAULT_CACHE_DIR
+from ansible.module_utils.websphere_command import DEFAULT_LOG_DIR, getLogFiles, runCommand
 if __name__ == '__main__':
 	im = InstallationManager()
 	im.main()
@@ -15,7 +15,18 @@ description:
 options:
   src:
     required: false
-    description: Path to installation files for Installation Manager
+    description: Path to installation files for Installation Manager. Can also be the path or URL of the installer zip, which is then extracted into cache_dir
+  checksum:
+    required: false
+    description: Checksum of the installer zip as <algorithm>:<checksum>, e.g. sha256:9f3c... A checksum without algorithm is a SHA-256
+  parallel:
+    required: false
+    default: 4
+    description: Number of threads extracting the installer zip
+  validate_certs:
+    required: false
+    default: true
+    description: Validate SSL certificates when src is an HTTPS URL
   dest:
     required: false
     default: "/opt/IBM/InstallationManager"
@@ -23,12 +34,16 @@ options:
   logdir:
     required: false
     default: "/tmp/"
-    description: Path and file name of installation log file
+    description: Directory of the installation log file. The output of the installer is streamed to ibmim_installer.log in this directory, and its progress to ibmim_installer.progress.json
   state:
     required: false
     choices: [ present, absent ]
     default: "present"
     description: Whether Installation Manager should be installed or removed
+  cache_dir:
+    required: false
+    default: "/var/cache/ansible-websphere"
+    description: Directory where the version read from the metadata of Installation Manager and the extracted installer zips are cached
 author: "Amir Mofasser (@amofasser)"
 """
 
@@ -39,6 +54,12 @@ EXAMPLES = """
 		src: /some/dir/install/
 		logdir: /tmp/im_install.log
 
+- name: Install from the installer zip
+	ibmim_installer: 
+		state: present 
+		src: http://myserver.domain.com/~ibmrepo/im/linux/agent.installer.linux.x86_64-latest.zip
+		checksum: sha256:9f3c5e1a...
+
 - name: Uninstall
 	ibmim: 
 		state: absent
@@ -46,6 +67,7 @@ EXAMPLES = """
 """
 
 import os
+import re
 import subprocess
 import platform
 import datetime
@@ -58,7 +80,10 @@ class InstallationManagerInstaller():
 		im_version = None,
 		im_internal_version = None,
 		im_arch = None,
-		im_header = None
+		im_header = None,
+		installer_dir = None,
+		installer_digest = None,
+		installer_reused = None
 	)
 
 	def __init__(self):
@@ -68,7 +93,11 @@ class InstallationManagerInstaller():
 	          state   = dict(default='present', choices=['present', 'absent']),
 	          src     = dict(required=False),
 	          dest    = dict(default="/opt/IBM/InstallationManager/"),
-	          logdir  = dict(default="/tmp/")
+	          logdir  = dict(default="/tmp/"),
+	          cache_dir = dict(default=DEFAULT_CACHE_DIR),
+	          checksum = dict(required=False),
+	          parallel = dict(default=4, type='int'),
+	          validate_certs = dict(default=True, type='bool')
 	      ),
 		supports_check_mode=True
 	  )
@@ -87,11 +116,96 @@ class InstallationManagerInstaller():
 		if not os.path.exists(dest):
 			return False
 		else:
-			if "installed" in self.getVersion(dest)["im_header"]:
+			if "installed" in (self.getVersion(dest)["im_header"] or ""):
 				return True
 			return False
 
 	def getVersion(self, dest):
+		"""
+		Reads the version of Installation Manager from its metadata and stores it in a dict.
+		The result is cached until one of the metadata files changes. Runs imcl with the
+		version parameter only if the metadata can not be read
+		:param dest: Installation directory of Installation Manager
+		:return: dict 
+		"""
+		registry = findInstallRegistry(dest)
+		launcher = os.path.join(dest, "eclipse", "tools", "imcl")
+		plugins = os.path.join(dest, "eclipse", "plugins")
+		swtags = os.path.join(dest, "properties", "version")
+		mtimes = getMtimes([path for path in [registry, launcher, plugins, swtags] if path])
+
+		cacheFile = os.path.join(getCacheDir(self.module.params['cache_dir'], "ibmim_installer"), "version.json")
+		cache = loadJson(cacheFile, {})
+		key = os.path.realpath(dest)
+		if key in cache and cache[key]["mtimes"] == mtimes:
+			self.module_facts.update(cache[key]["facts"])
+			return self.module_facts
+
+		facts = self.readMetadata(dest, registry, launcher, plugins, swtags)
+		if facts is None:
+			return self.runVersion(dest)
+
+		self.module_facts.update(facts)
+		cache[key] = dict(mtimes=mtimes, facts=facts)
+		saveJson(cacheFile, cache)
+		return self.module_facts
+
+	def readMetadata(self, dest, registry, launcher, plugins, swtags):
+		"""
+		Reads version, internal version and architecture of Installation Manager
+		from its install registry, its plugins, its swidtag and its launcher
+		:return: dict or None if Installation Manager is not installed at dest
+		"""
+		if not os.path.isfile(launcher):
+			return None
+
+		# The install registry records IM itself as the offering com.ibm.cic.agent
+		internalVersion = None
+		if registry:
+			for package in readInstalledPackages(registry):
+				if package["id"] == "com.ibm.cic.agent" and package["path"] and os.path.realpath(package["path"]) == os.path.realpath(dest):
+					internalVersion = package["version"]
+		if internalVersion is None and os.path.isdir(plugins):
+			for entry in os.listdir(plugins):
+				match = re.match("^com\\.ibm\\.cic\\.agent\\.core_([0-9][\\w.]*?)(\\.jar)?$", entry)
+				if match and (internalVersion is None or compareVersions(match.group(1), internalVersion) > 0):
+					internalVersion = match.group(1)
+		if internalVersion is None:
+			return None
+
+		# 1.8.5000.20160506_1125 is shown as 1.8.5, 1.8.4001.20151125_0201 as 1.8.4.1
+		version = None
+		if os.path.isdir(swtags):
+			for entry in sorted(os.listdir(swtags)):
+				if entry.endswith(".swtag"):
+					match = re.search("<ProductVersion>\\s*([^<\\s]+)\\s*</ProductVersion>", open(os.path.join(swtags, entry)).read())
+					if match:
+						version = match.group(1)
+						break
+		if version is None:
+			parts = internalVersion.split(".")
+			version = ".".join(parts[:2])
+			if len(parts) > 2 and parts[2].isdigit():
+				micro = int(parts[2])
+				version = "{0}.{1}".format(version, micro // 1000)
+				if micro % 1000:
+					version = "{0}.{1}".format(version, micro % 1000)
+
+		# The ELF class of the launcher tells 32-bit from 64-bit
+		arch = None
+		with open(launcher, "rb") as f:
+			header = f.read(5)
+		if header[:4] == b"\x7fELF":
+			arch = {1: "32-bit", 2: "64-bit"}.get(bytearray(header)[4])
+
+		return dict(
+			im_version = version,
+			im_internal_version = internalVersion,
+			im_arch = arch,
+			im_header = "Installation Manager (installed)"
+		)
+
+	def runVersion(self, dest):
 		"""
 		Runs imcl with the version parameter and stores the output in a dict
 		:param dest: Installation directory of Installation Manager
@@ -101,7 +215,8 @@ class InstallationManagerInstaller():
 			["{0}/eclipse/tools/imcl version".format(dest)],
 			shell=True,
 			stdout=subprocess.PIPE,
-			stderr=subprocess.PIPE
+			stderr=subprocess.PIPE,
+			universal_newlines=True
 		)
 		stdout_value, stderr_value = child.communicate()
 
@@ -115,6 +230,34 @@ class InstallationManagerInstaller():
 
 		return self.module_facts
 
+	def getInstaller(self, src):
+		"""
+		Extracts the installer zip into the cache, unless it has been extracted before
+		:param src: Path or URL of the installer zip
+		:return: Directory with the extracted installer
+		"""
+		try:
+			archive = unpackArchive(
+				src,
+				self.module.params['cache_dir'],
+				checksum=self.module.params['checksum'],
+				parallel=max(1, self.module.params['parallel']),
+				validateCerts=self.module.params['validate_certs']
+			)
+		except (ArchiveError, IOError, OSError) as e:
+			self.module.fail_json(msg="Failed extracting {0}: {1}".format(src, e), module_facts=self.module_facts)
+
+		# Some zips wrap the installer in a top level directory
+		installer = archive["path"]
+		entries = [entry for entry in os.listdir(installer) if not entry.startswith(".")]
+		if not os.path.exists(os.path.join(installer, "install")) and len(entries) == 1 and os.path.isdir(os.path.join(installer, entries[0])):
+			installer = os.path.join(installer, entries[0])
+
+		self.module_facts["installer_dir"] = installer
+		self.module_facts["installer_digest"] = archive["digest"]
+		self.module_facts["installer_reused"] = archive["reused"]
+		return installer
+
 	def main(self):
 
 		state = self.module.params['state']
@@ -130,27 +273,27 @@ class InstallationManagerInstaller():
 			# Check if IM is already installed
 			if not self.isProvisioned(dest):	
 
+				if isArchive(src):
+					src = self.getInstaller(src)
+
 				# Check if paths are valid
-				if not os.path.exists(src+"/install"):
-					self.module.fail_json(msg=src+"/install not found")
+				if src is None or not os.path.exists(src+"/install"):
+					self.module.fail_json(msg="{0}/install not found".format(src))
 
 				if not os.path.exists(logdir):
-					if not os.listdir(logdir):
-						os.makedirs(logdir)
+					os.makedirs(logdir)
 
 				logfile = "{0}_ibmim_{1}.xml".format(platform.node(), datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
-				child = subprocess.Popen(
-					["{0}/install "
-					 "-acceptLicense "
-					 "--launcher.ini {0}/silent-install.ini "
-					 "-log {1}/{2} "
-					 "-installationDirectory {3}".format(src, logdir, logfile, dest)], 
-					shell=True, 
-					stdout=subprocess.PIPE, 
-					stderr=subprocess.PIPE
+				returncode, stdout_value, stderr_value = runCommand(
+					"{0}/install "
+					"-acceptLicense "
+					"-showProgress "
+					"--launcher.ini {0}/silent-install.ini "
+					"-log {1}/{2} "
+					"-installationDirectory {3}".format(src, logdir, logfile, dest),
+					*getLogFiles(logdir, "ibmim_installer")
 				)
-				stdout_value, stderr_value = child.communicate()
-				if child.returncode != 0:
+				if returncode != 0:
 					self.module.fail_json(
 						msg="IBM IM installation failed", 
 						stderr=stderr_value, 
@@ -188,14 +331,8 @@ class InstallationManagerInstaller():
 				uninstall_dir = "/var/ibm/InstallationManager/uninstall/uninstallc"
 				if not os.path.exists("/var/ibm/InstallationManager/uninstall/uninstallc"):
 					self.module.fail_json(msg=uninstall_dir + " does not exist")
-				child = subprocess.Popen(
-					[uninstall_dir],
-					shell=True, 
-					stdout=subprocess.PIPE,
-					stderr=subprocess.PIPE
-				)
-				stdout_value, stderr_value = child.communicate()
-				if child.returncode != 0:
+				returncode, stdout_value, stderr_value = runCommand(uninstall_dir, *getLogFiles(logdir, "ibmim_installer"))
+				if returncode != 0:
 					self.module.fail_json(
 						msg="IBM IM uninstall failed", 
 						stderr=stderr_value, 
@@ -219,6 +356,11 @@ class InstallationManagerInstaller():
 
 # import module snippets
 from ansible.module_utils.basic import *
+from ansible.module_utils.ibmim_registry import findInstallRegistry, readInstalledPackages
+from ansible.module_utils.ibmim_repository import compareVersions
+from ansible.module_utils.websphere_archive import ArchiveError, isArchive, unpackArchive
+from ansible.module_utils.websphere_cache import DEFAULT_CACHE_DIR, getCacheDir, getMtimes, loadJson, saveJson
+from ansible.module_utils.websphere_command import getLogFiles, runCommand
 if __name__ == '__main__':
 		imi = InstallationManagerInstaller()
 		imi.main()
@@ -0,0 +1,452 @@
+#!/usr/bin/python
+
+#
+# This is an Ansible module. Copies the content of an IBM Installation Manager
+# repository to a local mirror, so that a later install or update can run
+# from local disk.
+#
+
+DOCUMENTATION = """
+module: ibmim_prefetch
+version_added: "1.9.4"
+short_description: Pre-stage an Installation Manager repository on the host
+description:
+  - Copies an Installation Manager repository (a local path or an HTTP URL) to a local mirror directory.
+  - Offerings and fixes that are not listed in id are left out. All other repository content is copied.
+  - Files are transferred in parallel. Interrupted transfers are resumed, and every file is checked before it is added to the mirror. Local files are compared by SHA-256, remote files by the length the server reports, archives also by the CRCs of their members.
+  - A transfer is only resumed if the file on the server did not change since (ETag/Last-Modified). The mirror's manifest is saved after every file, so an interrupted run does not transfer completed files again.
+  - repository.config is written last, so Installation Manager never sees a half-copied mirror.
+options:
+  src:
+    required: true
+    description: Path or HTTP URL of the source repository. HTTP repositories must serve directory listings
+  dest:
+    required: true
+    description: Path to the local mirror directory
+  id:
+    required: false
+    description: List of package IDs, optionally with version (com.ibm.websphere.ND.v85_8.5.5011.20161206_1434). Without a version the newest version is prefetched. All offerings are prefetched if not set
+  parallel:
+    required: false
+    default: 4
+    description: Number of files transferred at the same time
+  retries:
+    required: false
+    default: 3
+    description: Number of attempts per file
+  timeout:
+    required: false
+    default: 60
+    description: Timeout in seconds of a single HTTP request
+  validate_certs:
+    required: false
+    default: true
+    description: Validate SSL certificates of HTTPS repositories
+author: "Amir Mofasser (@amofasser)"
+"""
+
+EXAMPLES = """
+- name: Prefetch the WAS 8.5.5.11 fixpack ahead of the maintenance window
+  ibmim_prefetch:
+    src: http://myserver.domain.com/~ibmrepo/was/8.5.5.11
+    dest: /var/data/mirror/was
+    id:
+      - com.ibm.websphere.ND.v85_8.5.5011.20161206_1434
+
+- name: Update from the local mirror during the maintenance window
+  ibmim:
+    id: com.ibm.websphere.ND.v85
+    state: update
+    repositories: /var/data/mirror/was
+"""
+
+import os
+import re
+import threading
+import time
+import hashlib
+import zipfile
+
+# Offerings and fixes, one jar per version
+OFFERINGS_DIRS = ["Offerings", "Fixes"]
+
+# Written after all other files
+REPOSITORY_CONFIG = "repository.config"
+
+MANIFEST = ".prefetch.json"
+
+# Next to a partial file, holds the ETag or Last-Modified of the source it was started from
+VALIDATOR = ".part.json"
+
+CHUNK_SIZE = 1024 * 1024
+
+class PrefetchError(Exception):
+	pass
+
+class InstallationManagerPrefetch():
+
+	module = None
+	module_facts = dict(
+		mirror = None,
+		files = 0,
+		transferred = [],
+		skipped = 0,
+		bytes = 0,
+		elapsed = None
+	)
+
+	def __init__(self):
+		# Read arguments
+		self.module = AnsibleModule(
+			argument_spec = dict(
+				src 						= dict(required=True),
+				dest 						= dict(required=True),
+				id 							= dict(required=False, type='list'),
+				parallel 				= dict(default=4, type='int'),
+				retries 				= dict(default=3, type='int'),
+				timeout 				= dict(default=60, type='int'),
+				validate_certs 	= dict(default=True, type='bool')
+			),
+			supports_check_mode = True
+		)
+		self.lock = threading.Lock()
+
+
+	def open(self, url, offset=0, validator=None):
+		"""
+		Opens an URL, asking the server to start at offset
+		:param validator: ETag or Last-Modified the partial file was started from. The server sends the whole file if it changed since
+		:return: response
+		"""
+		headers = {}
+		if offset:
+			headers["Range"] = "bytes={0}-".format(offset)
+			if validator:
+				headers["If-Range"] = validator
+		return open_url(
+			url,
+			headers=headers,
+			timeout=self.module.params['timeout'],
+			validate_certs=self.module.params['validate_certs']
+		)
+
+
+	def listFiles(self, src):
+		"""
+		Lists all files of the source repository
+		:param src: Path or URL of the repository
+		:return: list of paths relative to src
+		"""
+		files = []
+		if not isRemote(src):
+			for root, dirs, names in os.walk(src):
+				dirs.sort()
+				for name in sorted(names):
+					files.append(os.path.relpath(os.path.join(root, name), src))
+			return files
+
+		# Crawl the directory listings served by the HTTP server
+		pending = [""]
+		while pending:
+			directory = pending.pop(0)
+			html = self.open("{0}/{1}".format(src.rstrip("/"), directory)).read().decode("utf-8", "replace")
+			for href in sorted(set(re.findall("href=\"([^\"?#]+)\"", html))):
+				if "://" in href or href.startswith("/") or href.startswith("."):
+					continue
+				href = unquote(href)
+				if href.endswith("/"):
+					pending.append(directory + href)
+				else:
+					files.append(directory + href)
+		return files
+
+
+	def selectFiles(self, files, packageIds):
+		"""
+		Leaves out the offerings and fixes which are not requested
+		:param files: list of relative paths
+		:param packageIds: list of package IDs, optionally with version. None selects everything
+		:return: list of relative paths, repository.config last
+		"""
+		if packageIds:
+			# Versions available for every offering
+			offerings = {}
+			for path in files:
+				parts = path.split("/")
+				base, extension = os.path.splitext(parts[-1])
+				if len(parts) == 2 and parts[0] in OFFERINGS_DIRS and extension in (".jar", ".zip") and "_" in base:
+					packageId, version = splitPackageId(base)
+					offerings.setdefault(packageId, []).append(version)
+
+			wanted = set()
+			for requested in packageIds:
+				packageId, version = splitPackageId(requested)
+				versions = offerings.get(packageId)
+				if not versions:
+					raise PrefetchError("Package '{0}' was not found in the repository".format(requested))
+				if version is None:
+					version = versions[0]
+					for candidate in versions:
+						if compareVersions(candidate, version) > 0:
+							version = candidate
+				elif version not in versions:
+					raise PrefetchError("Package '{0}' was not found in the repository".format(requested))
+				wanted.add((packageId, version))
+
+			selected = []
+			for path in files:
+				parts = path.split("/")
+				base, extension = os.path.splitext(parts[-1])
+				if len(parts) == 2 and parts[0] in OFFERINGS_DIRS and extension in (".jar", ".zip") and "_" in base:
+					if splitPackageId(base) not in wanted:
+						continue
+				selected.append(path)
+			files = selected
+
+		return [path for path in files if path != REPOSITORY_CONFIG] + [path for path in files if path == REPOSITORY_CONFIG]
+
+
+	def verify(self, path, name):
+		"""
+		Checks the CRCs of all members of jar and zip files
+		:param path: Path of the file to check
+		:param name: Name of the file in the repository, tells its type
+		"""
+		if os.path.splitext(name)[1] in (".jar", ".zip"):
+			try:
+				archive = zipfile.ZipFile(path)
+				try:
+					broken = archive.testzip()
+				finally:
+					archive.close()
+			except zipfile.BadZipfile:
+				raise PrefetchError("{0} is not a valid archive".format(name))
+			if broken:
+				raise PrefetchError("{0} is corrupt, CRC of {1} does not match".format(name, broken))
+
+
+	def transfer(self, src, dest, path):
+		"""
+		Copies one file to the mirror. An existing partial file is resumed
+		:return: tuple of sha256 and number of bytes transferred
+		"""
+		target = os.path.join(dest, path)
+		part = target + ".part"
+		validatorFile = target + VALIDATOR
+		if not os.path.isdir(os.path.dirname(target)):
+			try:
+				os.makedirs(os.path.dirname(target))
+			except OSError:
+				if not os.path.isdir(os.path.dirname(target)):
+					raise
+
+		digest = hashlib.sha256()
+		offset = 0
+		if os.path.exists(part):
+			with open(part, "rb") as f:
+				for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+					digest.update(chunk)
+					offset += len(chunk)
+
+		length = None
+		if isRemote(src):
+			validator = None
+			if offset:
+				validator = loadJson(validatorFile, {}).get("validator")
+				if not validator:
+					# Without a validator the partial file may be of an older version, start over
+					digest = hashlib.sha256()
+					offset = 0
+			response = self.open("{0}/{1}".format(src.rstrip("/"), quote(path)), offset, validator)
+			info = response.info()
+			expected = info.get("Content-Length")
+			if offset and response.getcode() != 206:
+				# The server does not support ranges or the file changed, start over
+				digest = hashlib.sha256()
+				offset = 0
+			length = getTotalLength(info, offset)
+			if not offset:
+				saveJson(validatorFile, dict(validator=info.get("ETag") or info.get("Last-Modified")))
+			source = response
+		else:
+			expected = os.path.getsize(os.path.join(src, path)) - offset
+			source = open(os.path.join(src, path), "rb")
+			source.seek(offset)
+
+		transferred = 0
+		try:
+			with open(part, "ab" if offset else "wb") as f:
+				for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+					digest.update(chunk)
+					f.write(chunk)
+					transferred += len(chunk)
+		finally:
+			source.close()
+
+		if expected is not None and int(expected) != transferred:
+			raise PrefetchError("{0} is incomplete, got {1} of {2} bytes".format(path, transferred, expected))
+
+		size = os.path.getsize(part)
+		if length is not None and size != length:
+			os.remove(part)
+			raise PrefetchError("{0} has {1} bytes, the source has {2}".format(path, size, length))
+
+		try:
+			self.verify(part, path)
+		except PrefetchError:
+			os.remove(part)
+			raise
+		if not isRemote(src):
+			source = hashlib.sha256()
+			with open(os.path.join(src, path), "rb") as f:
+				for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+					source.update(chunk)
+			if source.hexdigest() != digest.hexdigest():
+				os.remove(part)
+				raise PrefetchError("{0} does not match the checksum of the source".format(path))
+
+		os.rename(part, target)
+		if os.path.exists(validatorFile):
+			os.remove(validatorFile)
+		return digest.hexdigest(), transferred
+
+
+	def worker(self, src, dest, queue, manifest, errors):
+		"""
+		Transfers files from the queue until it is empty
+		"""
+		while True:
+			with self.lock:
+				if not queue or errors:
+					return
+				path = queue.pop(0)
+
+			for attempt in range(max(1, self.module.params['retries'])):
+				try:
+					checksum, transferred = self.transfer(src, dest, path)
+					break
+				except (PrefetchError, IOError, OSError) as e:
+					error = "{0}: {1}".format(path, e)
+					time.sleep(attempt)
+			else:
+				with self.lock:
+					errors.append(error)
+				return
+
+			with self.lock:
+				manifest[path] = dict(sha256=checksum, size=os.path.getsize(os.path.join(dest, path)))
+				saveJson(os.path.join(dest, MANIFEST), manifest)
+				self.module_facts["transferred"].append(path)
+				self.module_facts["bytes"] += transferred
+
+
+	def main(self):
+
+		src = self.module.params['src']
+		dest = self.module.params['dest']
+		packageIds = self.module.params['id']
+		parallel = max(1, self.module.params['parallel'])
+
+		if not isRemote(src) and not os.path.isfile(os.path.join(src, REPOSITORY_CONFIG)):
+			self.module.fail_json(
+				msg="{0} is not an Installation Manager repository".format(src),
+				module_facts=self.module_facts
+			)
+
+		started = time.time()
+		self.module_facts["mirror"] = dest
+
+		try:
+			files = self.selectFiles(self.listFiles(src), packageIds)
+		except (PrefetchError, IOError, OSError) as e:
+			self.module.fail_json(
+				msg="Failed listing repository {0}: {1}".format(src, e),
+				module_facts=self.module_facts
+			)
+		self.module_facts["files"] = len(files)
+
+		# Files in the manifest have been transferred and checked before
+		manifest = loadJson(os.path.join(dest, MANIFEST), {})
+		pending = []
+		for path in files:
+			target = os.path.join(dest, path)
+			if path in manifest and os.path.isfile(target) and os.path.getsize(target) == manifest[path]["size"]:
+				continue
+			pending.append(path)
+		self.module_facts["skipped"] = len(files) - len(pending)
+
+		if not pending:
+			self.module_facts["elapsed"] = time.time() - started
+			self.module.exit_json(
+				changed=False,
+				msg="Mirror {0} is up to date".format(dest),
+				module_facts=self.module_facts
+			)
+
+		if self.module.check_mode:
+			self.module.exit_json(
+				changed=True,
+				msg="{0} files are to be copied to {1}".format(len(pending), dest),
+				module_facts=self.module_facts
+			)
+
+		if not os.path.isdir(dest):
+			os.makedirs(dest)
+
+		# repository.config is copied after everything else succeeded
+		config = [path for path in pending if path == REPOSITORY_CONFIG]
+		queue = [path for path in pending if path != REPOSITORY_CONFIG]
+		errors = []
+
+		threads = []
+		for i in range(min(parallel, len(queue))):
+			thread = threading.Thread(target=self.worker, args=(src, dest, queue, manifest, errors))
+			thread.daemon = True
+			thread.start()
+			threads.append(thread)
+		for thread in threads:
+			thread.join()
+
+		if not errors and config:
+			self.worker(src, dest, config, manifest, errors)
+
+		self.module_facts["elapsed"] = time.time() - started
+
+		if errors:
+			self.module.fail_json(
+				msg="Failed prefetching repository {0}".format(src),
+				errors=errors,
+				module_facts=self.module_facts
+			)
+
+		self.module.exit_json(
+			changed=True,
+			msg="{0} files copied to {1}".format(len(self.module_facts["transferred"]), dest),
+			module_facts=self.module_facts
+		)
+
+def getTotalLength(info, offset):
+	"""
+	Returns the size of the whole file on the server
+	:param info: headers of the response
+	:param offset: offset the response starts at, 0 if it holds the whole file
+	:return: number of bytes, None if the server did not tell
+	"""
+	if offset:
+		match = re.match("bytes\\s+\\d+-\\d+/(\\d+)", info.get("Content-Range") or "")
+		if match:
+			return int(match.group(1))
+		return None
+	if info.get("Content-Length") is not None:
+		return int(info.get("Content-Length"))
+	return None
+
+# import module snippets
+from ansible.module_utils.basic import *
+from ansible.module_utils.urls import open_url
+from ansible.module_utils.six.moves.urllib.parse import quote, unquote
+from ansible.module_utils.ibmim_repository import isRemote, splitPackageId, compareVersions
+from ansible.module_utils.websphere_cache import loadJson, saveJson
+if __name__ == '__main__':
+	imp = InstallationManagerPrefetch()
+	imp.main()
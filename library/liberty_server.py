@@ -21,31 +21,31 @@ def main():
         argument_spec = dict(
             state   = dict(default='started', choices=['started', 'stopped']),
             name    = dict(required=True),
-            libertydir  = dict(required=True)
+            libertydir  = dict(required=True),
+            logdir = dict(default=DEFAULT_LOG_DIR)
         )
     )
 
     state = module.params['state']
     name = module.params['name']
     libertydir = module.params['libertydir']
+    logdir = module.params['logdir']
 
     # Check if paths are valid
     if not os.path.exists(libertydir):
         module.fail_json(msg=libertydir+" does not exists")
 
     if state == 'stopped':
-        child = subprocess.Popen([libertydir+"/bin/server stop " + name], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout_value, stderr_value = child.communicate()
-        if child.returncode != 0:
+        returncode, stdout_value, stderr_value = runCommand(libertydir+"/bin/server stop " + name, *getLogFiles(logdir, "liberty_server." + name))
+        if returncode != 0:
             if not stderr_value.find("is not running") < 0:
                 module.fail_json(msg=name + " stop failed", stdout=stdout_value, stderr=stderr_value)
 
         module.exit_json(changed=True, msg=name + " stopped successfully", stdout=stdout_value)
 
     if state == 'started':
-        child = subprocess.Popen([libertydir+"/bin/server start " + name], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout_value, stderr_value = child.communicate()
-        if child.returncode != 0:
+        returncode, stdout_value, stderr_value = runCommand(libertydir+"/bin/server start " + name, *getLogFiles(logdir, "liberty_server." + name))
+        if returncode != 0:
             if not stderr_value.find("is running with process") < 0:
                 module.fail_json(msg=name + " start failed", stdout=stdout_value, stderr=stderr_value)
 
@@ -54,5 +54,6 @@ def main():
 
 # import module snippets
 from ansible.module_utils.basic import *
+from ansible.module_utils.websphere_command import DEFAULT_LOG_DIR, getLogFiles, runCommand
 if __name__ == '__main__':
     main()
@@ -47,6 +47,29 @@ options:
     required: false
     description:
       - Deployment manager username
+  logdir:
+    required: false
+    default: "/var/log/ansible-websphere"
+    description:
+      - Directory of the output log (profile_dmgr.<name>.log) and the progress file (profile_dmgr.<name>.progress.json) of manageprofiles.sh
+  cache_dir:
+    required: false
+    default: "/var/cache/ansible-websphere"
+    description:
+      - Directory of the parsed profile registry (properties/profileRegistry.xml) and of the cached profile images
+  from_image:
+    required: false
+    description:
+      - Path or URL of a profile image to restore instead of creating the profile from the management template. Either a zip written by manageprofiles.sh -backupProfile of a profile with the same name, or a tarball of the profile directory. The host, node and cell name of the image are changed to host_name, node_name and cell_name afterwards
+  image_checksum:
+    required: false
+    description:
+      - Expected checksum of the image, as <algorithm>:<hex>. A checksum without algorithm is a SHA-256
+  lock_timeout:
+    required: false
+    default: 3600
+    description:
+      - Seconds to wait for other tasks running manageprofiles.sh in the same wasdir. The wait is returned in lock
   state:
     required: false
     choices: [ present, absent ]
@@ -59,37 +82,30 @@ author: "Amir Mofasser (@amofasser)"
 EXAMPLES = """
 # Install:
 profile_dmgr: state=present wasdir=/usr/local/WebSphere name=dmgr cell_name=mycell host_name=dmgr.domain.com node_name=mycell-dmgr username=wasadmin password=waspass
+# Install from a profile image:
+profile_dmgr: state=present wasdir=/usr/local/WebSphere name=dmgr cell_name=mycell host_name=dmgr.domain.com node_name=mycell-dmgr from_image=/mnt/images/dmgr-9.0.5.7.zip
 # Uninstall
 profile_dmgr: state=absent wasdir=/usr/local/WebSphere name=dmgr
 """
 
+import atexit
 import os
 import subprocess
 import platform
 import datetime
 import shutil
 
-def isProvisioned(dest, profileName): 
+def isProvisioned(dest, profileName, cacheDir=None):
     """
-    Runs manageprofiles.sh -listProfiles command nd stores the output in a dict
+    Looks the profile up in the profile registry of the installation (properties/profileRegistry.xml)
     :param dest: WAS installation dir
     :param profilesName: Profile Name
+    :param cacheDir: Root cache directory of the parsed registry
     :return: boolean
     """
     if not os.path.exists(dest):
         return False
-    else:
-        child = subprocess.Popen(
-            ["{0}/bin/manageprofiles.sh -listProfiles".format(dest)],
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        stdout_value, stderr_value = child.communicate()
-        
-        if profileName in stdout_value: 
-            return True
-    return False
+    return profileName in getProfiles(dest, cacheDir)
 
 
 def main():
@@ -104,7 +120,12 @@ def main():
             host_name = dict(required=False),
             node_name = dict(required=False),
             username = dict(required=False),
-            password = dict(required=False)
+            password = dict(required=False),
+            logdir = dict(default=DEFAULT_LOG_DIR),
+            cache_dir = dict(default=DEFAULT_CACHE_DIR),
+            from_image = dict(required=False),
+            image_checksum = dict(required=False),
+            lock_timeout = dict(default=DEFAULT_LOCK_TIMEOUT, type='int')
         )
     )
 
@@ -116,54 +137,100 @@ def main():
     node_name = module.params['node_name']
     username = module.params['username']
     password = module.params['password']
+    logdir = module.params['logdir']
+    from_image = module.params['from_image']
 
     # Check if paths are valid
     if not os.path.exists(wasdir):
         module.fail_json(msg=wasdir+" does not exists")
 
+    try:
+        provisioned = isProvisioned(wasdir, name, module.params['cache_dir'])
+    except ProfileRegistryError as e:
+        module.fail_json(msg=str(e))
+
+    # manageprofiles.sh must not run at the same time in one installation, tasks queue up for it
+    lock = InstallationLock(wasdir, module.params['cache_dir'], module.params['lock_timeout'], "profile_dmgr {0}".format(name))
+    # A dry run changes nothing, so it does not queue up behind the tasks that do
+    if provisioned != (state == 'present') and not module.check_mode:
+        atexit.register(lock.release)
+        try:
+            lock.acquire()
+            # Another task may have created or removed the profile while this one waited
+            provisioned = isProvisioned(wasdir, name, module.params['cache_dir'])
+        except (LockTimeout, ProfileRegistryError) as e:
+            module.fail_json(msg=str(e), lock=lock.stats())
+        except (IOError, OSError) as e:
+            module.fail_json(msg="Failed to lock {0}: {1}".format(wasdir, e), lock=lock.stats())
+
     # Create a profile
     if state == 'present':
         
         if module.check_mode:
             module.exit_json(
                 changed=False, 
-                msg="Profile {0} is to be created".format(name)
+                msg="Profile {0} is to be created".format(name),
+                lock=lock.stats()
             )
 
-        if not isProvisioned(wasdir, name):
-            child = subprocess.Popen(
-                ["{0}/bin/manageprofiles.sh -create "
-                "-profileName {1} "
-                "-profilePath {0}/profiles/{1} "
-                "-templatePath {0}/profileTemplates/management "
-                "-cellName {2} "
-                "-hostName {3} "
-                "-nodeName {4} "
-                "-enableAdminSecurity true "
-                "-adminUserName {5} "
-                "-adminPassword {6} ".format(wasdir, name, cell_name, host_name, node_name, username, password)], 
-                shell=True, 
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.PIPE
-            )
-            stdout_value, stderr_value = child.communicate()
-            if child.returncode != 0:
-                module.fail_json(
-                    msg="Dmgr profile creation failed", 
-                    stdout=stdout_value, 
-                    stderr=stderr_value
+        if not provisioned:
+            image = None
+            if from_image:
+                try:
+                    image = provisionFromImage(
+                        wasdir, name, "management", from_image,
+                        cell=cell_name,
+                        node=node_name,
+                        host=host_name,
+                        checksum=module.params['image_checksum'],
+                        cacheDir=module.params['cache_dir'],
+                        logName="profile_dmgr.{0}".format(name),
+                        logDir=logdir
+                    )
+                except (ImageError, ProfileRegistryError) as e:
+                    module.fail_json(
+                        msg="Dmgr profile creation from {0} failed: {1}".format(from_image, e),
+                        stdout=getattr(e, 'stdout', ''),
+                        stderr=getattr(e, 'stderr', ''),
+                        lock=lock.stats()
+                    )
+                stdout_value = image.pop('stdout')
+                stderr_value = image.pop('stderr')
+            else:
+                returncode, stdout_value, stderr_value = runCommand(
+                    "{0}/bin/manageprofiles.sh -create "
+                    "-profileName {1} "
+                    "-profilePath {0}/profiles/{1} "
+                    "-templatePath {0}/profileTemplates/management "
+                    "-cellName {2} "
+                    "-hostName {3} "
+                    "-nodeName {4} "
+                    "-enableAdminSecurity true "
+                    "-adminUserName {5} "
+                    "-adminPassword {6} ".format(wasdir, name, cell_name, host_name, node_name, username, password),
+                    *getLogFiles(logdir, "profile_dmgr.{0}".format(name))
                 )
+                if returncode != 0:
+                    module.fail_json(
+                        msg="Dmgr profile creation failed", 
+                        stdout=stdout_value, 
+                        stderr=stderr_value,
+                        lock=lock.stats()
+                    )
 
             module.exit_json(
                 changed=True, 
                 msg="profile {0} created successfully".format(name), 
                 stdout=stdout_value,
-                stderr=stderr_value
+                stderr=stderr_value,
+                image=image,
+                lock=lock.stats()
             )
         else:
             module.exit_json(
                 changed=False,
-                msg="profile {0} already exists".format(name)
+                msg="profile {0} already exists".format(name),
+                lock=lock.stats()
             )
 
     # Remove a profile
@@ -172,20 +239,18 @@ def main():
         if module.check_mode:
             module.exit_json(
                 changed=False, 
-                msg="Profile {0} is to be removed".format(name)
+                msg="Profile {0} is to be removed".format(name),
+                lock=lock.stats()
         )
 
-        if isProvisioned(wasdir, name):
+        if provisioned:
 
-            child = subprocess.Popen(
-                ["{0}/bin/manageprofiles.sh -delete "
-                 "-profileName {1}".format(wasdir, name)],
-                 shell=True, 
-                 stdout=subprocess.PIPE, 
-                 stderr=subprocess.PIPE
+            returncode, stdout_value, stderr_value = runCommand(
+                "{0}/bin/manageprofiles.sh -delete "
+                "-profileName {1}".format(wasdir, name),
+                *getLogFiles(logdir, "profile_dmgr.{0}".format(name))
             )
-            stdout_value, stderr_value = child.communicate()
-            if child.returncode != 0:
+            if returncode != 0:
                 # manageprofiles.sh -delete will fail if the profile does not exist.
                 # But creation of a profile with the same name will also fail if
                 # the directory is not empty. So we better remove the dir forcefully.
@@ -195,23 +260,31 @@ def main():
                     module.fail_json(
                         msg="Profile {0} removal failed".format(name), 
                         stdout=stdout_value, 
-                        stderr=stderr_value
+                        stderr=stderr_value,
+                        lock=lock.stats()
                     )
 
             module.exit_json(
                 changed=True, 
                 msg="Profile {0} removed successfully".format(name), 
                 stdout=stdout_value, 
-                stderr=stderr_value
+                stderr=stderr_value,
+                lock=lock.stats()
             )
         else:
             module.exit_json(
                 changed=False,
-                msg="Profile {0} does not exist".format(name)
+                msg="Profile {0} does not exist".format(name),
+                lock=lock.stats()
             )
 
 
 # import module snippets
 from ansible.module_utils.basic import *
+from ansible.module_utils.websphere_cache import DEFAULT_CACHE_DIR
+from ansible.module_utils.websphere_command import DEFAULT_LOG_DIR, getLogFiles, runCommand
+from ansible.module_utils.websphere_lock import DEFAULT_LOCK_TIMEOUT, InstallationLock, LockTimeout
+from ansible.module_utils.was_profiles import ProfileRegistryError, getProfiles
+from ansible.module_utils.was_images import ImageError, provisionFromImage
 if __name__ == '__main__':
     main()
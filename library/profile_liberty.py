@@ -8,6 +8,7 @@
 # server create server_name
 #
 
+import atexit
 import os
 import subprocess
 
@@ -19,37 +20,52 @@ def main():
             state   = dict(default='present', choices=['present', 'abcent']),
             libertydir  = dict(required=True),
             name    = dict(required=True),
+            logdir = dict(default=DEFAULT_LOG_DIR),
+            cache_dir = dict(default=DEFAULT_CACHE_DIR),
+            lock_timeout = dict(default=DEFAULT_LOCK_TIMEOUT, type='int')
         )
     )
 
     state = module.params['state']
     libertydir = module.params['libertydir']
     name = module.params['name']
+    logdir = module.params['logdir']
 
     # Check if paths are valid
     if not os.path.exists(libertydir):
         module.fail_json(msg=libertydir+" does not exists")
 
+    # server create must not run at the same time in one installation, tasks queue up for it
+    lock = InstallationLock(libertydir, module.params['cache_dir'], module.params['lock_timeout'], "profile_liberty {0}".format(name))
+    atexit.register(lock.release)
+    try:
+        lock.acquire()
+    except LockTimeout as e:
+        module.fail_json(msg=str(e), lock=lock.stats())
+    except (IOError, OSError) as e:
+        module.fail_json(msg="Failed to lock {0}: {1}".format(libertydir, e), lock=lock.stats())
+
     # Create a profile
     if state == 'present':
-        child = subprocess.Popen([libertydir+"/bin/server create " + name], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout_value, stderr_value = child.communicate()
-        if child.returncode != 0:
-            module.fail_json(msg="Failed to create liberty server " + name, stdout=stdout_value, stderr=stderr_value)
+        returncode, stdout_value, stderr_value = runCommand(libertydir+"/bin/server create " + name, *getLogFiles(logdir, "profile_liberty." + name))
+        if returncode != 0:
+            module.fail_json(msg="Failed to create liberty server " + name, stdout=stdout_value, stderr=stderr_value, lock=lock.stats())
 
-        module.exit_json(changed=True, msg=name + " server created successfully", stdout=stdout_value)
+        module.exit_json(changed=True, msg=name + " server created successfully", stdout=stdout_value, lock=lock.stats())
 
     # Remove a profile
     if state == 'abcent':
-        child = subprocess.Popen(["rm -rf " + libertydir+"/usr/servers/" + name], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout_value, stderr_value = child.communicate()
-        if child.returncode != 0:
-                module.fail_json(msg="Dmgr profile removal failed", stdout=stdout_value, stderr=stderr_value)
+        returncode, stdout_value, stderr_value = runCommand("rm -rf " + libertydir+"/usr/servers/" + name)
+        if returncode != 0:
+                module.fail_json(msg="Dmgr profile removal failed", stdout=stdout_value, stderr=stderr_value, lock=lock.stats())
 
-        module.exit_json(changed=True, msg=name + " server removed successfully", stdout=stdout_value, stderr=stderr_value)
+        module.exit_json(changed=True, msg=name + " server removed successfully", stdout=stdout_value, stderr=stderr_value, lock=lock.stats())
 
 
 # import module snippets
 from ansible.module_utils.basic import *
+from ansible.module_utils.websphere_cache import DEFAULT_CACHE_DIR
+from ansible.module_utils.websphere_command import DEFAULT_LOG_DIR, getLogFiles, runCommand
+from ansible.module_utils.websphere_lock import DEFAULT_LOCK_TIMEOUT, InstallationLock, LockTimeout
 if __name__ == '__main__':
     main()
@@ -57,6 +57,53 @@ options:
     choices: true, false
     description:
       - Wether to federate this node agent profile to a cell
+  logdir:
+    required: false
+    default: "/var/log/ansible-websphere"
+    description:
+      - Directory of the output log (profile_nodeagent.<name>.log) and the progress file (profile_nodeagent.<name>.progress.json) of manageprofiles.sh and addNode.sh
+  cache_dir:
+    required: false
+    default: "/var/cache/ansible-websphere"
+    description:
+      - Directory of the parsed profile registry (properties/profileRegistry.xml) and of the cached profile images
+  from_image:
+    required: false
+    description:
+      - Path or URL of a profile image to restore instead of creating the profile from the managed template. Either a zip written by manageprofiles.sh -backupProfile of a profile with the same name, or a tarball of the profile directory. The host, node and cell name of the image are changed to host_name, node_name and cell_name afterwards
+  image_checksum:
+    required: false
+    description:
+      - Expected checksum of the image, as <algorithm>:<hex>. A checksum without algorithm is a SHA-256
+  lock_timeout:
+    required: false
+    default: 3600
+    description:
+      - Seconds to wait for other tasks running manageprofiles.sh and addNode.sh in the same wasdir. The wait is returned in lock. The lock is held until addNode.sh succeeded or ran out of retries, including the backoff between them
+  federation_slots:
+    required: false
+    default: 0
+    description:
+      - Number of nodes that may federate into the same deployment manager at the same time. 0 does not limit them
+  federation_lock_dir:
+    required: false
+    description:
+      - Directory of the federation slots. Share it between the hosts (NFS with locking) to limit the federations of all of them. Default is <cache_dir>/federation, which only limits the node agents of this host
+  federation_retries:
+    required: false
+    default: 0
+    description:
+      - Number of times a failed addNode.sh is run again. The federation slot is given up while waiting for the retry
+  federation_backoff:
+    required: false
+    default: 5
+    description:
+      - Seconds to wait before the first retry of addNode.sh and between the first rounds over the federation slots. Doubled every time, up to 60 seconds
+  federation_timeout:
+    required: false
+    default: 3600
+    description:
+      - Seconds to wait for a federation slot before every run of addNode.sh. The wait is returned in federation
   state:
     required: false
     choices: [ present, absent ]
@@ -69,37 +116,32 @@ author: "Amir Mofasser (@amofasser)"
 EXAMPLES = """
 # Install:
 profile_nodeagent: state=present wasdir=/usr/local/WebSphere name=nodeagent cell_name=myNodeCell host_name=node.domain.com node_name=mycell-node1 username=wasadmin password=waspass dmgr_host=dmgr.domain.com dmgr_port=8879 federate=true
+# Install from a profile image:
+profile_nodeagent: state=present wasdir=/usr/local/WebSphere name=nodeagent cell_name=myNodeCell host_name=node.domain.com node_name=mycell-node1 username=wasadmin password=waspass dmgr_host=dmgr.domain.com dmgr_port=8879 federate=true from_image=/mnt/images/managed-9.0.5.7.tar.gz
 # Uninstall
 profile_nodeagent: state=absent wasdir=/usr/local/WebSphere name=nodeagent
 """
 
+import atexit
 import os
+import random
 import subprocess
 import platform
 import datetime
 import shutil
+import time
 
-def isProvisioned(dest, profileName): 
+def isProvisioned(dest, profileName, cacheDir=None):
     """
-    Runs manageprofiles.sh -listProfiles command nd stores the output in a dict
+    Looks the profile up in the profile registry of the installation (properties/profileRegistry.xml)
     :param dest: WAS installation dir
     :param profilesName: Profile Name
+    :param cacheDir: Root cache directory of the parsed registry
     :return: boolean
     """
     if not os.path.exists(dest):
         return False
-    else:
-        child = subprocess.Popen(
-            ["{0}/bin/manageprofiles.sh -listProfiles".format(dest)],
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        stdout_value, stderr_value = child.communicate()
-        
-        if profileName in stdout_value: 
-            return True
-    return False
+    return profileName in getProfiles(dest, cacheDir)
 
 def main():
 
@@ -116,7 +158,17 @@ def main():
             password = dict(required=False),
             dmgr_host = dict(required=False),
             dmgr_port = dict(required=False, default='8879'),
-            federate = dict(required=False, choices=BOOLEANS)
+            federate = dict(required=False, choices=BOOLEANS),
+            logdir = dict(default=DEFAULT_LOG_DIR),
+            cache_dir = dict(default=DEFAULT_CACHE_DIR),
+            from_image = dict(required=False),
+            image_checksum = dict(required=False),
+            lock_timeout = dict(default=DEFAULT_LOCK_TIMEOUT, type='int'),
+            federation_slots = dict(default=0, type='int'),
+            federation_lock_dir = dict(required=False),
+            federation_retries = dict(default=0, type='int'),
+            federation_backoff = dict(default=DEFAULT_BACKOFF, type='int'),
+            federation_timeout = dict(default=DEFAULT_LOCK_TIMEOUT, type='int')
         )
     )
 
@@ -131,76 +183,164 @@ def main():
     dmgr_host = module.params['dmgr_host']
     dmgr_port = module.params['dmgr_port']
     federate = module.params['federate']
+    logdir = module.params['logdir']
+    from_image = module.params['from_image']
 
     # Check if paths are valid
     if not os.path.exists(wasdir):
         module.fail_json(msg=wasdir+" does not exists")
 
+    try:
+        provisioned = isProvisioned(wasdir, name, module.params['cache_dir'])
+    except ProfileRegistryError as e:
+        module.fail_json(msg=str(e))
+
+    # manageprofiles.sh and addNode.sh must not run at the same time in one installation, tasks queue up for it
+    lock = InstallationLock(wasdir, module.params['cache_dir'], module.params['lock_timeout'], "profile_nodeagent {0}".format(name))
+    # A dry run changes nothing, so it does not queue up behind the tasks that do
+    if provisioned != (state == 'present') and not module.check_mode:
+        atexit.register(lock.release)
+        try:
+            lock.acquire()
+            # Another task may have created or removed the profile while this one waited
+            provisioned = isProvisioned(wasdir, name, module.params['cache_dir'])
+        except (LockTimeout, ProfileRegistryError) as e:
+            module.fail_json(msg=str(e), lock=lock.stats())
+        except (IOError, OSError) as e:
+            module.fail_json(msg="Failed to lock {0}: {1}".format(wasdir, e), lock=lock.stats())
+
     # Create a profile
     if state == 'present':
         if module.check_mode:
             module.exit_json(
                 changed=False, 
-                msg="Profile {0} is to be created".format(name)
+                msg="Profile {0} is to be created".format(name),
+                lock=lock.stats()
             )
 
-        if not isProvisioned(wasdir, name):
-            child = subprocess.Popen([
-                "{0}/bin/manageprofiles.sh -create "
-                "-profileName {1} "
-                "-profilePath {0}/profiles/{1} "
-                "-templatePath {0}/profileTemplates/managed "
-                "-cellName {2} "
-                "-hostName {3} "
-                "-nodeName {4} "
-                "-enableAdminSecurity true "
-                "-adminUserName {5} "
-                "-adminPassword {6} ".format(wasdir, name, cell_name, host_name, node_name, username, password)],
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-            stdout_value, stderr_value = child.communicate()
-            if child.returncode != 0:
-                # Remove profile dir if creation fails so that it doesnt prevents us from retrying
-                shutil.rmtree("{0}/profiles/{1}".format(wasdir, name), ignore_errors=False, onerror=None)
-
-                module.fail_json(
-                    msg="Profile {0} creation failed".format(name), 
-                    stdout=stdout_value, 
-                    stderr=stderr_value
+        if not provisioned:
+            image = None
+            if from_image:
+                try:
+                    image = provisionFromImage(
+                        wasdir, name, "managed", from_image,
+                        cell=cell_name,
+                        node=node_name,
+                        host=host_name,
+                        checksum=module.params['image_checksum'],
+                        cacheDir=module.params['cache_dir'],
+                        logName="profile_nodeagent.{0}".format(name),
+                        logDir=logdir
+                    )
+                except (ImageError, ProfileRegistryError) as e:
+                    module.fail_json(
+                        msg="Profile {0} creation from {1} failed: {2}".format(name, from_image, e),
+                        stdout=getattr(e, 'stdout', ''),
+                        stderr=getattr(e, 'stderr', ''),
+                        lock=lock.stats()
+                    )
+                stdout_value = image.pop('stdout')
+                stderr_value = image.pop('stderr')
+            else:
+                returncode, stdout_value, stderr_value = runCommand(
+                    "{0}/bin/manageprofiles.sh -create "
+                    "-profileName {1} "
+                    "-profilePath {0}/profiles/{1} "
+                    "-templatePath {0}/profileTemplates/managed "
+                    "-cellName {2} "
+                    "-hostName {3} "
+                    "-nodeName {4} "
+                    "-enableAdminSecurity true "
+                    "-adminUserName {5} "
+                    "-adminPassword {6} ".format(wasdir, name, cell_name, host_name, node_name, username, password),
+                    *getLogFiles(logdir, "profile_nodeagent.{0}".format(name))
                 )
+                if returncode != 0:
+                    # Remove profile dir if creation fails so that it doesnt prevents us from retrying
+                    shutil.rmtree("{0}/profiles/{1}".format(wasdir, name), ignore_errors=False, onerror=None)
 
+                    module.fail_json(
+                        msg="Profile {0} creation failed".format(name), 
+                        stdout=stdout_value, 
+                        stderr=stderr_value,
+                        lock=lock.stats()
+                    )
+
+            federation = None
             if federate:
+                federation = dict(slot=None, wait=0.0, rounds=0, attempts=0, seconds=0.0)
+
+                # The deployment manager locks its repository while a node is added, and too many
+                # nodes at once make addNode.sh time out. They take turns through a number of slots
+                gate = None
+                if module.params['federation_slots'] > 0:
+                    gate = SlotGate(
+                        os.path.join(module.params['federation_lock_dir'] or getCacheDir(module.params['cache_dir'], "federation"), "{0}-{1}".format(dmgr_host, dmgr_port)),
+                        module.params['federation_slots'],
+                        module.params['federation_timeout'],
+                        "profile_nodeagent {0} on {1}".format(name, platform.node()),
+                        module.params['federation_backoff']
+                    )
+                    atexit.register(gate.release)
+
                 # Federate the node
-                child = subprocess.Popen([
-                    "{0}/bin/addNode.sh {1} {2} "
-                    "-conntype SOAP "
-                    "-username {3} "
-                    "-password {4} "
-                    "-profileName {5} ".format(wasdir, dmgr_host, dmgr_port, username, password, name)], 
-                    shell=True, 
-                    stdout=subprocess.PIPE, 
-                    stderr=subprocess.PIPE
-                )
-                stdout_value, stderr_value = child.communicate()
-                if child.returncode != 0:
+                started = time.time()
+                delay = module.params['federation_backoff']
+                while True:
+                    # Every attempt takes a slot, so other nodes can federate while this one backs off
+                    if gate is not None:
+                        try:
+                            gate.acquire()
+                        except (LockTimeout, IOError, OSError) as e:
+                            federation.update(gate.stats(), wait=round(federation['wait'] + gate.waited, 3))
+                            module.fail_json(
+                                msg="Profile {0} federation failed: {1}".format(name, e),
+                                lock=lock.stats(),
+                                federation=federation
+                            )
+                        federation.update(gate.stats(), wait=round(federation['wait'] + gate.waited, 3))
+                    federation['attempts'] += 1
+                    returncode, stdout_value, stderr_value = runCommand(
+                        "{0}/bin/addNode.sh {1} {2} "
+                        "-conntype SOAP "
+                        "-username {3} "
+                        "-password {4} "
+                        "-profileName {5} ".format(wasdir, dmgr_host, dmgr_port, username, password, name),
+                        *getLogFiles(logdir, "profile_nodeagent.{0}".format(name))
+                    )
+                    if gate is not None:
+                        gate.release()
+                    if returncode == 0 or federation['attempts'] > module.params['federation_retries']:
+                        break
+                    # A busy deployment manager is given more time before every retry. The wasdir lock
+                    # stays held, the profile is not usable by other tasks until it is federated
+                    time.sleep(delay * random.uniform(0.5, 1.0))
+                    delay = min(delay * 2, MAX_BACKOFF)
+                federation['seconds'] = round(time.time() - started, 3)
+
+                if returncode != 0:
                     module.fail_json(
                         msg="Profile {0} federation failed".format(name), 
                         stdout=stdout_value,
-                        stderr=stderr_value
+                        stderr=stderr_value,
+                        lock=lock.stats(),
+                        federation=federation
                     )
 
             module.exit_json(
                 changed=True,
-                msg="Profile {0} created successfully",
-                stdout=stdout_value
+                msg="Profile {0} created successfully".format(name),
+                stdout=stdout_value,
+                image=image,
+                lock=lock.stats(),
+                federation=federation
             )
 
         else:
             module.exit_json(
                 changed=False,
-                msg="Profile {0} already exists".format(name)
+                msg="Profile {0} already exists".format(name),
+                lock=lock.stats()
             )
 
     # Remove a profile
@@ -208,21 +348,18 @@ def main():
         if module.check_mode:
             module.exit_json(
                 changed=False, 
-                msg="Profile {0} is to be removed".format(name)
+                msg="Profile {0} is to be removed".format(name),
+                lock=lock.stats()
             )
 
-        if isProvisioned(wasdir, name):
+        if provisioned:
 
-            child = subprocess.Popen([
+            returncode, stdout_value, stderr_value = runCommand(
                 "{0}/bin/manageprofiles.sh -delete "
-                "-profileName {1} ".format(wasdir, name)], 
-                shell=True, 
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.PIPE
+                "-profileName {1} ".format(wasdir, name),
+                *getLogFiles(logdir, "profile_nodeagent.{0}".format(name))
             )
-
-            stdout_value, stderr_value = child.communicate()
-            if child.returncode != 0:
+            if returncode != 0:
                 # manageprofiles.sh -delete will fail if the profile does not exist.
                 # But creation of a profile with the same name will also fail if
                 # the directory is not empty. So we better remove the dir forcefully.
@@ -232,24 +369,32 @@ def main():
                     module.fail_json(
                         msg="Profile {0} removal failed".format(name), 
                         stdout=stdout_value, 
-                        stderr=stderr_value
+                        stderr=stderr_value,
+                        lock=lock.stats()
                     )
 
             module.exit_json(
                 changed=True, 
                 msg="Profile {0} removed successfully".format(name), 
                 stdout=stdout_value,
-                stderr=stderr_value
+                stderr=stderr_value,
+                lock=lock.stats()
             )
 
         else:
             module.exit_json(
                 changed=False,
-                msg="Profile {0} does not exist".format(name)
+                msg="Profile {0} does not exist".format(name),
+                lock=lock.stats()
             )
 
 
 # import module snippets
 from ansible.module_utils.basic import *
+from ansible.module_utils.websphere_cache import DEFAULT_CACHE_DIR, getCacheDir
+from ansible.module_utils.websphere_command import DEFAULT_LOG_DIR, getLogFiles, runCommand
+from ansible.module_utils.websphere_lock import DEFAULT_BACKOFF, DEFAULT_LOCK_TIMEOUT, MAX_BACKOFF, InstallationLock, LockTimeout, SlotGate
+from ansible.module_utils.was_profiles import ProfileRegistryError, getProfiles
+from ansible.module_utils.was_images import ImageError, provisionFromImage
 if __name__ == '__main__':
     main()
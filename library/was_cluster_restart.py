@@ -0,0 +1,361 @@
+#!/usr/bin/python
+
+#
+# This is an Ansible module. Restarts the members of a WebSphere cluster in
+# waves, so that the cluster keeps serving while it is restarted.
+#
+
+DOCUMENTATION = """
+module: was_cluster_restart
+version_added: "1.9.4"
+short_description: Rolling restart of a WebSphere Application Server cluster
+description:
+  - Restarts the members of a cluster in waves of max_unavailable members. Every wave is stopped, started and, before the next wave begins, checked for readiness.
+  - All waves run in the same wsadmin session, see was_server.
+options:
+  cluster:
+    required: true
+    description:
+      - Name of the cluster
+  wasdir:
+    required: true
+    description:
+      - Path to root of WAS installation directory
+  username:
+    required: false
+    description:
+      - Administrative user username
+  password:
+    required: false
+    description:
+      - Administrative user password
+  max_unavailable:
+    required: false
+    default: 1
+    description:
+      - Number of members restarted at the same time
+  ready:
+    required: false
+    default: log
+    choices: [ log, http, none ]
+    description:
+      - How a restarted member is found ready. log waits for ready_messages in its SystemOut.log and requires the logs of all members on this host, http for ready_url to answer with one of ready_status, none does not wait
+  ready_messages:
+    required: false
+    default: [ WSVR0001I ]
+    description:
+      - Message IDs or texts which tell that a member is ready
+  ready_url:
+    required: false
+    description:
+      - URL probed when ready is http. {name} and {node} are replaced with the member and its node, e.g. http://{node}.example.com:9080/health
+  ready_status:
+    required: false
+    default: [ 200 ]
+    description:
+      - HTTP status codes of a ready member
+  validate_certs:
+    required: false
+    default: true
+    description:
+      - Validate SSL certificates of ready_url
+  wait_timeout:
+    required: false
+    default: 600
+    description:
+      - Seconds a wave may take to get ready
+  failure_threshold:
+    required: false
+    default: 0
+    description:
+      - Number of members which may fail before the restart is aborted. The remaining waves are not started
+  session:
+    required: false
+    default: True
+    description:
+      - Run the waves in the long lived wsadmin session of the host
+  session_timeout:
+    required: false
+    default: 600
+    description:
+      - Seconds a wsadmin session started by this module is kept running after its last request
+  cache_dir:
+    required: false
+    default: "/var/cache/ansible-websphere"
+    description:
+      - Directory of the wsadmin session socket
+  logdir:
+    required: false
+    default: "/var/log/ansible-websphere"
+    description:
+      - Directory of the output log (was_cluster_restart.<cluster>.log)
+author: "Amir Mofasser (@amofasser)"
+"""
+
+EXAMPLES = """
+# Restart two members at a time and wait for the applications:
+- was_cluster_restart:
+    cluster: AppCluster
+    wasdir: /usr/local/WebSphere/AppServer/
+    max_unavailable: 2
+    ready_messages:
+      - WSVR0001I
+      - WSVR0221I
+# Restart one member at a time, gated on a health check:
+- was_cluster_restart:
+    cluster: AppCluster
+    wasdir: /usr/local/WebSphere/AppServer/
+    ready: http
+    ready_url: http://{node}.example.com:9080/health
+"""
+
+import os
+import socket
+import time
+
+
+def getConnection(module):
+    """
+    Returns the arguments of controlServers() shared by all waves
+    """
+    return dict(
+        connection=dict(username=module.params['username'], password=module.params['password']),
+        session=module.params['session'],
+        cacheDir=module.params['cache_dir'],
+        idleTimeout=module.params['session_timeout'],
+        logDir=module.params['logdir'],
+        name="was_cluster_restart." + module.params['cluster']
+    )
+
+
+def waitForUrls(module, members, started, timeout):
+    """
+    Polls the ready URL of every member until it answers with a ready status
+    :param members: list of timeline entries
+    :return: dict of member name -> seconds from started until ready, None if it did not get ready
+    """
+    statuses = [int(status) for status in module.params['ready_status']]
+    deadline = time.time() + timeout
+    ready = dict((member["name"], None) for member in members)
+    pending = list(members)
+    while pending:
+        for member in list(pending):
+            url = module.params['ready_url'].format(name=member["name"], node=member["node"])
+            try:
+                status = open_url(url, timeout=5, validate_certs=module.params['validate_certs']).getcode()
+            except HTTPError as e:
+                status = e.code
+            except (URLError, IOError, OSError, socket.error):
+                status = None
+            if status in statuses:
+                ready[member["name"]] = time.time() - started
+                pending.remove(member)
+        if not pending or time.time() >= deadline:
+            break
+        time.sleep(min(2, max(0, deadline - time.time())))
+    return ready
+
+
+def waitForLogs(module, wasdir, members, positions, started, timeout):
+    """
+    Waits for the ready messages in the SystemOut.log of every member
+    :param members: list of timeline entries
+    :param positions: dict of log directory -> position of SystemOut.log before the wave was stopped
+    :return: dict of member name -> seconds from started until ready, None if it did not get ready
+    """
+    ready = dict()
+    logDirs = dict()
+    for member in members:
+        # Members without logs on this host are refused in main(), a member whose logs are gone is not ready
+        logDir = findServerLogDir(wasdir, member["name"], member["node"])
+        if logDir is not None:
+            logDirs[logDir] = member["name"]
+
+    found = waitForMessages(
+        dict((logDir, positions.get(logDir, (None, 0))) for logDir in logDirs),
+        module.params['ready_messages'],
+        timeout,
+        started
+    )
+    for logDir in found:
+        ready[logDirs[logDir]] = found[logDir]
+    return ready
+
+
+def restartWave(module, wasdir, wave, number, begin):
+    """
+    Stops, starts and waits for the members of one wave
+    :param wave: list of dicts with the keys name and node
+    :param number: Number of the wave, starting at 1
+    :param begin: Start time of the restart. The timeline is relative to it
+    :return: list of timeline entries, one per member
+    """
+    timeout = module.params['wait_timeout']
+    timeline = dict()
+    for member in wave:
+        timeline[member["name"]] = dict(
+            name=member["name"],
+            node=member["node"],
+            wave=number,
+            stopping=None,
+            stopped=None,
+            starting=None,
+            started=None,
+            ready=None,
+            time_to_ready=None,
+            error=None
+        )
+
+    # Messages logged after this point belong to the restart
+    positions = getLogPositions(wasdir) if module.params['ready'] == 'log' else dict()
+
+    for action in ["stop", "start"]:
+        members = [member for member in wave if not timeline[member["name"]]["error"]]
+        if not members:
+            break
+        offset = time.time() - begin
+        returncode, results, stdout_value, stderr_value = controlServers(
+            wasdir,
+            action,
+            servers=members,
+            parallelism=len(members),
+            nodeParallelism=len(members),
+            **getConnection(module)
+        )
+        done = dict((result["name"], result) for result in results)
+        for member in members:
+            entry = timeline[member["name"]]
+            result = done.get(member["name"])
+            if result is None:
+                entry["error"] = "wsadmin failed to {0} the member: {1}".format(action, (stderr_value or stdout_value or "").strip()[-500:])
+                continue
+            entry["stopping" if action == "stop" else "starting"] = round(offset + result["waited"], 3)
+            entry["stopped" if action == "stop" else "started"] = round(offset + result["waited"] + result["seconds"], 3)
+            if result["error"]:
+                entry["error"] = result["error"]
+
+    # Readiness gates the next wave
+    started = [timeline[member["name"]] for member in wave if not timeline[member["name"]]["error"]]
+    if started and module.params['ready'] != 'none':
+        gate = time.time()
+        if module.params['ready'] == 'http':
+            ready = waitForUrls(module, started, gate, timeout)
+        else:
+            ready = waitForLogs(module, wasdir, started, positions, gate, timeout)
+        for entry in started:
+            seconds = ready.get(entry["name"])
+            if seconds is None:
+                entry["error"] = "Not ready after {0} seconds".format(timeout)
+            else:
+                entry["ready"] = round(gate - begin + seconds, 3)
+                entry["time_to_ready"] = round(entry["ready"] - entry["started"], 3)
+
+    return [timeline[member["name"]] for member in wave]
+
+
+def main():
+
+    # Read arguments
+    module = AnsibleModule(
+        argument_spec = dict(
+            cluster = dict(required=True),
+            wasdir = dict(required=True),
+            username = dict(required=False),
+            password = dict(required=False, no_log=True),
+            max_unavailable = dict(default=1, type='int'),
+            ready = dict(default='log', choices=['log', 'http', 'none']),
+            ready_messages = dict(default=[READY_MESSAGE], type='list'),
+            ready_url = dict(required=False),
+            ready_status = dict(default=[200], type='list'),
+            validate_certs = dict(default=True, type='bool'),
+            wait_timeout = dict(default=600, type='int'),
+            failure_threshold = dict(default=0, type='int'),
+            session = dict(default=True, type='bool'),
+            session_timeout = dict(default=DEFAULT_IDLE_TIMEOUT, type='int'),
+            cache_dir = dict(default=DEFAULT_CACHE_DIR),
+            logdir = dict(default=DEFAULT_LOG_DIR)
+        ),
+        required_if = [['ready', 'http', ['ready_url']]],
+        supports_check_mode = True
+    )
+
+    cluster = module.params['cluster']
+    wasdir = module.params['wasdir']
+    maxUnavailable = max(1, module.params['max_unavailable'])
+    failureThreshold = module.params['failure_threshold']
+
+    # Check if paths are valid
+    if not os.path.exists(wasdir):
+        module.fail_json(msg="{0} does not exists".format(wasdir))
+
+    begin = time.time()
+
+    # Members and their node, in the order of the cluster
+    returncode, members, stdout_value, stderr_value = controlServers(wasdir, "status", cluster=cluster, **getConnection(module))
+    if returncode != 0 or not members or not members[0]["name"]:
+        module.fail_json(
+            msg=(members and members[0]["error"]) or "Failed to list the members of cluster {0}".format(cluster),
+            stdout=stdout_value,
+            stderr=stderr_value
+        )
+
+    # The logs of members on other hosts can not be read, their readiness would only be guessed
+    if module.params['ready'] == 'log':
+        remote = [member for member in members if findServerLogDir(wasdir, member["name"], member["node"]) is None]
+        if remote:
+            module.fail_json(
+                msg="The logs of {0} are not on this host, use ready=http to gate them or ready=none to not wait".format(
+                    ", ".join("{0} on node {1}".format(member["name"], member["node"]) for member in remote))
+            )
+
+    waves = [members[index:index + maxUnavailable] for index in range(0, len(members), maxUnavailable)]
+    if module.check_mode:
+        module.exit_json(
+            changed=True,
+            msg="{0} members of cluster {1} would be restarted in {2} waves".format(len(members), cluster, len(waves)),
+            waves=[[member["name"] for member in wave] for wave in waves]
+        )
+
+    timeline = []
+    failures = 0
+    aborted = False
+    for number, wave in enumerate(waves, 1):
+        entries = restartWave(module, wasdir, wave, number, begin)
+        timeline.extend(entries)
+        failures += len([entry for entry in entries if entry["error"]])
+        if failures > failureThreshold:
+            aborted = number < len(waves)
+            break
+
+    elapsed = time.time() - begin
+    restarted = len([entry for entry in timeline if not entry["error"]])
+    if failures > failureThreshold:
+        module.fail_json(
+            changed=restarted > 0,
+            msg="{0} of {1} members of cluster {2} failed{3}".format(
+                failures, len(timeline), cluster, ", remaining waves were not started" if aborted else ""),
+            timeline=timeline,
+            waves=len(waves),
+            elapsed=elapsed
+        )
+
+    module.exit_json(
+        changed=True,
+        msg="{0} of {1} members of cluster {2} restarted in {3} waves".format(restarted, len(members), cluster, len(waves)),
+        timeline=timeline,
+        waves=len(waves),
+        elapsed=elapsed
+    )
+
+# import module snippets
+from ansible.module_utils.basic import *
+from ansible.module_utils.urls import open_url
+from ansible.module_utils.six.moves.urllib.error import HTTPError, URLError
+from ansible.module_utils.websphere_cache import DEFAULT_CACHE_DIR
+from ansible.module_utils.websphere_command import DEFAULT_LOG_DIR
+from ansible.module_utils.was_control import controlServers
+from ansible.module_utils.was_log import READY_MESSAGE, getLogPositions, waitForMessages
+from ansible.module_utils.was_process import findServerLogDir
+from ansible.module_utils.wsadmin_session import DEFAULT_IDLE_TIMEOUT
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/python
+
+#
+# This is an Ansible module. Answers read-only questions about a WebSphere
+# cell from the configuration repository, without wsadmin.
+#
+
+DOCUMENTATION = """
+module: was_config
+version_added: "1.9.4"
+short_description: Reads servers, ports, JVM settings and data sources from the WebSphere configuration repository
+description:
+  - Parses the XML documents below <profile>/config/cells directly instead of asking a connected wsadmin. The extracted data is cached with the mtime of every document, so later runs only parse the documents that changed
+options:
+  wasdir:
+    required: true
+    description:
+      - Path to root of WAS installation directory, or to a profile
+  profile:
+    required: false
+    description:
+      - Name of the profile whose repository is read. Use the deployment manager profile to see the whole cell. Default is the first profile with a repository
+  query:
+    required: false
+    default: all
+    choices: [ all, servers, ports, jvm, datasources, clusters ]
+    description:
+      - What to return
+  node:
+    required: false
+    description:
+      - Only return servers and data sources of this node
+  server:
+    required: false
+    description:
+      - Only return this server and its data sources
+  cache_dir:
+    required: false
+    default: "/var/cache/ansible-websphere"
+    description:
+      - Directory of the cached index
+author: "Amir Mofasser (@amofasser)"
+"""
+
+EXAMPLES = """
+# Ports of all servers on a node:
+- was_config:
+    wasdir: /usr/local/WebSphere/AppServer/
+    profile: Dmgr01
+    query: ports
+    node: node01
+  register: ports
+# JVM settings of one server:
+- was_config: wasdir=/usr/local/WebSphere/AppServer/ query=jvm server=AppSrv01
+"""
+
+import os
+
+
+def selectServers(model, node, server):
+    """
+    Returns the servers of the model that match the filters
+    :return: list of (node name, server name, server)
+    """
+    selected = []
+    for nodeName in sorted(model["nodes"]):
+        if node is not None and nodeName != node:
+            continue
+        servers = model["nodes"][nodeName]["servers"]
+        for serverName in sorted(servers):
+            if server is not None and serverName != server:
+                continue
+            selected.append((nodeName, serverName, servers[serverName]))
+    return selected
+
+
+def selectDatasources(model, node, server):
+    """
+    Returns the data sources visible to the servers that match the filters. Cell and cluster scoped ones are always included
+    """
+    selected = []
+    for datasource in model["datasources"]:
+        if node is not None and datasource.get("node") not in (None, node):
+            continue
+        if server is not None and datasource.get("server") not in (None, server):
+            continue
+        selected.append(datasource)
+    return selected
+
+
+def main():
+
+    # Read arguments
+    module = AnsibleModule(
+        argument_spec = dict(
+            wasdir = dict(required=True),
+            profile = dict(required=False),
+            query = dict(default='all', choices=['all', 'servers', 'ports', 'jvm', 'datasources', 'clusters']),
+            node = dict(required=False),
+            server = dict(required=False),
+            cache_dir = dict(default=DEFAULT_CACHE_DIR)
+        ),
+        supports_check_mode = True
+    )
+
+    wasdir = module.params['wasdir']
+    query = module.params['query']
+    node = module.params['node']
+    server = module.params['server']
+
+    # Check if paths are valid
+    if not os.path.exists(wasdir):
+        module.fail_json(msg="{0} does not exists".format(wasdir))
+
+    try:
+        model, stats = readConfig(wasdir, module.params['profile'], module.params['cache_dir'])
+    except ConfigError as e:
+        module.fail_json(msg=str(e))
+
+    servers = selectServers(model, node, server)
+    if query == 'servers':
+        result = [dict(name=name, node=nodeName, type=entry.get("type"), cluster=entry.get("cluster")) for nodeName, name, entry in servers]
+    elif query == 'ports':
+        result = []
+        for nodeName, name, entry in servers:
+            for endpoint in sorted(entry.get("endpoints") or {}):
+                result.append(dict(name=name, node=nodeName, endpoint=endpoint, **entry["endpoints"][endpoint]))
+    elif query == 'jvm':
+        result = [dict(name=name, node=nodeName, **(entry.get("jvm") or {})) for nodeName, name, entry in servers if entry.get("jvm")]
+    elif query == 'datasources':
+        result = selectDatasources(model, node, server)
+    elif query == 'clusters':
+        result = model["clusters"]
+    else:
+        nodes = dict()
+        for nodeName, name, entry in servers:
+            nodes.setdefault(nodeName, dict(host=model["nodes"][nodeName]["host"], servers=dict()))["servers"][name] = entry
+        result = dict(
+            cell=model["cell"],
+            nodes=nodes,
+            clusters=model["clusters"],
+            datasources=selectDatasources(model, node, server)
+        )
+
+    module.exit_json(changed=False, cell=model["cell"], result=result, stats=stats)
+
+# import module snippets
+from ansible.module_utils.basic import *
+from ansible.module_utils.websphere_cache import DEFAULT_CACHE_DIR
+from ansible.module_utils.was_config import ConfigError, readConfig
+if __name__ == '__main__':
+    main()
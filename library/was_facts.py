@@ -0,0 +1,134 @@
+#!/usr/bin/python
+
+#
+# This is an Ansible module. Publishes the topology of a WebSphere cell and
+# the run state of all its servers as facts.
+#
+
+DOCUMENTATION = """
+module: was_facts
+version_added: "1.9.4"
+short_description: Gathers the nodes, clusters and servers of a WebSphere cell as facts
+description:
+  - Collects the nodes, clusters and servers of a cell with their run state and process ID in one go and sets the fact was_facts. Servers are indexed by node, and the members of every cluster are listed
+options:
+  wasdir:
+    required: true
+    description:
+      - Path to root of WAS installation directory
+  source:
+    required: false
+    default: wsadmin
+    choices: [ wsadmin, local ]
+    description:
+      - wsadmin runs one script in the wsadmin session, which sees the whole cell. local runs serverStatus.sh -all in all profiles on this host at the same time
+  username:
+    required: false
+    description:
+      - Administrative user username
+  password:
+    required: false
+    description:
+      - Administrative user password
+  session:
+    required: false
+    default: True
+    description:
+      - Run the script in the long lived wsadmin session of the host, which was_server shares
+  session_timeout:
+    required: false
+    default: 600
+    description:
+      - Seconds a wsadmin session started by this module is kept running after its last request
+  cache_dir:
+    required: false
+    default: "/var/cache/ansible-websphere"
+    description:
+      - Directory of the wsadmin session socket and the topology script
+  logdir:
+    required: false
+    default: "/var/log/ansible-websphere"
+    description:
+      - Directory of the output logs
+author: "Amir Mofasser (@amofasser)"
+"""
+
+EXAMPLES = """
+# Gather the cell from the deployment manager:
+- was_facts:
+    wasdir: /usr/local/WebSphere/AppServer/
+# Start only what is not running yet:
+- was_server:
+    state: started
+    cluster: AppCluster
+    facts: "{{ was_facts }}"
+    wasdir: /usr/local/WebSphere/AppServer/
+# Gather the servers of this host without wsadmin:
+- was_facts:
+    wasdir: /usr/local/WebSphere/AppServer/
+    source: local
+"""
+
+import os
+import time
+
+
+def main():
+
+    # Read arguments
+    module = AnsibleModule(
+        argument_spec = dict(
+            wasdir = dict(required=True),
+            source = dict(default='wsadmin', choices=['wsadmin', 'local']),
+            username = dict(required=False),
+            password = dict(required=False, no_log=True),
+            session = dict(default=True, type='bool'),
+            session_timeout = dict(default=DEFAULT_IDLE_TIMEOUT, type='int'),
+            cache_dir = dict(default=DEFAULT_CACHE_DIR),
+            logdir = dict(default=DEFAULT_LOG_DIR)
+        ),
+        supports_check_mode = True
+    )
+
+    wasdir = module.params['wasdir']
+    username = module.params['username']
+    password = module.params['password']
+
+    # Check if paths are valid
+    if not os.path.exists(wasdir):
+        module.fail_json(msg="{0} does not exists".format(wasdir))
+
+    started = time.time()
+    if module.params['source'] == 'wsadmin':
+        returncode, facts, stdout_value, stderr_value = gatherTopology(
+            wasdir,
+            connection=dict(username=username, password=password),
+            session=module.params['session'],
+            cacheDir=module.params['cache_dir'],
+            idleTimeout=module.params['session_timeout'],
+            logDir=module.params['logdir']
+        )
+        if facts is None:
+            module.fail_json(msg="Failed to read the topology of the cell", stdout=stdout_value, stderr=stderr_value)
+    else:
+        facts, errors = gatherLocalTopology(wasdir, username, password, module.params['logdir'])
+        if errors and not any([node["servers"] for node in facts["nodes"].values()]):
+            module.fail_json(msg="Failed to read the servers of this host", errors=errors)
+        for error in errors:
+            module.warn(error)
+
+    facts["gathered_at"] = time.time()
+    module.exit_json(
+        changed=False,
+        ansible_facts=dict(was_facts=facts),
+        elapsed=time.time() - started
+    )
+
+# import module snippets
+from ansible.module_utils.basic import *
+from ansible.module_utils.websphere_cache import DEFAULT_CACHE_DIR
+from ansible.module_utils.websphere_command import DEFAULT_LOG_DIR
+from ansible.module_utils.was_topology import gatherLocalTopology, gatherTopology
+from ansible.module_utils.wsadmin_session import DEFAULT_IDLE_TIMEOUT
+if __name__ == '__main__':
+    main()
@@ -19,13 +19,17 @@ options:
     description:
       - Whether WAS should be stopped or started
   name:
-    required: true
+    required: false
     description:
-      - Name of the application server
+      - Name of the application server, or a list of servers given as dicts with the keys name and node. A list is started or stopped from one wsadmin script
   node:
-    required: true
+    required: false
     description:
-      - Name of the node on which the application server is running on
+      - Name of the node on which the application server is running on. Required if name is a single server. Default node of the servers in a list
+  cluster:
+    required: false
+    description:
+      - Name of a cluster. All its members are started or stopped from one wsadmin script. Requires wsadmin
   username:
     required: false
     description:
@@ -43,6 +47,86 @@ options:
     default: True
     description:
       - Use wsadmin to start/stop processes on a node (True) or the native startServer.sh/stopServer.sh on the node machine (False)
+  logdir:
+    required: false
+    default: "/var/log/ansible-websphere"
+    description:
+      - Directory of the output log (was_server.<name>.log) and the progress file (was_server.<name>.progress.json)
+  probe:
+    required: false
+    default: True
+    description:
+      - Read the PID file of servers on this host (logs/<server>/<server>.pid) and check the process in /proc before starting wsadmin. Servers which already are in the wanted state are skipped
+  wait_for:
+    required: false
+    choices: [ ready ]
+    description:
+      - Wait until the started servers have logged all ready_messages in their SystemOut.log. Only servers with logs on this host are waited for
+  ready_messages:
+    required: false
+    default: [ WSVR0001I ]
+    description:
+      - Message IDs or texts which tell that a server is ready, e.g. WSVR0221I for an application that has started. A server is ready when all of them have been logged
+  wait_timeout:
+    required: false
+    default: 600
+    description:
+      - Seconds to wait for the ready messages
+  parallelism:
+    required: false
+    default: 1
+    description:
+      - Number of servers started or stopped at the same time. Requires wsadmin
+  node_parallelism:
+    required: false
+    default: 1
+    description:
+      - Number of servers started or stopped at the same time on one node
+  session:
+    required: false
+    default: True
+    description:
+      - Run AdminControl in the long lived wsadmin session of the host instead of starting a new wsadmin. Falls back to a new wsadmin if no session can be started
+  session_timeout:
+    required: false
+    default: 600
+    description:
+      - Seconds a wsadmin session started by this module is kept running after its last request
+  cache_dir:
+    required: false
+    default: "/var/cache/ansible-websphere"
+    description:
+      - Directory of the wsadmin session socket
+  facts:
+    required: false
+    description:
+      - was_facts gathered earlier in the play. Servers which are STARTED or STOPPED in them, as wanted, are skipped, and a cluster is expanded to its members, so nothing is started when all of them already run. Gather them shortly before, they are not checked again
+  transport:
+    required: false
+    default: wsadmin
+    choices: [ wsadmin, soap ]
+    description:
+      - soap talks to the SOAP connector of the deployment manager (host and port) directly instead of running wsadmin, which saves the JVM start. Lists of servers only, no clusters
+  host:
+    required: false
+    default: localhost
+    description:
+      - Host of the SOAP connector (transport soap)
+  port:
+    required: false
+    default: 8879
+    description:
+      - Port of the SOAP connector (transport soap)
+  ssl:
+    required: false
+    default: false
+    description:
+      - Use HTTPS for the SOAP connector, which a cell with administrative security requires
+  validate_certs:
+    required: false
+    default: true
+    description:
+      - Validate the certificate of the SOAP connector
 author: "Amir Mofasser (@amofasser)"
 """
 
@@ -51,12 +135,27 @@ EXAMPLES = """
 - was_server: state=stopped name=AppSrv01 node=devnode wasdir=/usr/local/WebSphere/AppServer/
 # Start:
 - was_server: state=started name=AppSrv01 node=devnode wasdir=/usr/local/WebSphere/AppServer/
+# Start several servers from one wsadmin script:
+- was_server:
+    state: started
+    wasdir: /usr/local/WebSphere/AppServer/
+    name:
+      - { name: AppSrv01, node: node01 }
+      - { name: AppSrv02, node: node02 }
+# Stop all members of a cluster:
+- was_server: state=stopped cluster=AppCluster wasdir=/usr/local/WebSphere/AppServer/
+# Start a cluster, one member per node at a time on up to 8 nodes:
+- was_server: state=started cluster=AppCluster parallelism=8 node_parallelism=1 wasdir=/usr/local/WebSphere/AppServer/
+# Start through the SOAP connector of the deployment manager, without wsadmin:
+- was_server: state=started name=AppSrv01 node=devnode transport=soap host=dmgr.example.com ssl=true username=wasadmin password=secret wasdir=/usr/local/WebSphere/AppServer/
 """
 
 import os
+import re
 import subprocess
 import platform
 import datetime
+import time
 
 was_dict = dict(
     was_name = None,
@@ -79,16 +178,16 @@ def getState(stdout_value, name, wsadmin):
     was_dict["was_name"] = name
 
     try:
-	if wsadmin:
-           match = re.search("(Server \"{0}\" is already running)".format(name), stdout_value)
-           if match:
-               if match.group(0):
-                   was_dict["was_state"] = 1
-	else:
-	   match = re.search("(An instance of the server may already be running: {0})".format(name), stdout_value)
-	   if match:
-	      if match.group(0):
-		   was_dict["was_state"] = 1 
+        if wsadmin:
+            match = re.search("(Server \"{0}\" is already running)".format(name), stdout_value)
+            if match:
+                if match.group(0):
+                    was_dict["was_state"] = 1
+        else:
+            match = re.search("(An instance of the server may already be running: {0})".format(name), stdout_value)
+            if match:
+                if match.group(0):
+                    was_dict["was_state"] = 1 
 
     except AttributeError:
         raise
@@ -96,61 +195,350 @@ def getState(stdout_value, name, wsadmin):
     return was_dict
 
 
+def getServers(module):
+    """
+    Reads the servers to start or stop from the name, node and cluster options
+    :return: list of dicts with the keys name and node
+    """
+    name = module.params['name']
+    node = module.params['node']
+    if name is None:
+        return []
+    if not isinstance(name, list):
+        if node is None:
+            module.fail_json(msg="node is required when name is a single server")
+        return [dict(name=str(name), node=node)]
+    servers = []
+    for server in name:
+        if not isinstance(server, dict) or not server.get("name") or not (server.get("node") or node):
+            module.fail_json(msg="Every server in name needs a name and a node: {0}".format(server))
+        servers.append(dict(name=str(server["name"]), node=str(server.get("node") or node)))
+    return servers
+
+
+# Run states in was_facts which are trusted
+KNOWN_STATES = dict(STARTED=True, STOPPED=False)
+
+
+def getKnownState(facts, name, node):
+    """
+    Looks up the run state of a server in was_facts
+    :return: True if running, False if stopped, None if the server is not in the facts or in another state
+    """
+    server = ((facts.get("nodes") or {}).get(node) or {}).get("servers", {}).get(name)
+    if server is None:
+        return None
+    # STARTING, STOPPING or UNKNOWN may have changed since, the server is probed instead
+    return KNOWN_STATES.get(server.get("state"))
+
+
+def waitForReady(module, wasdir, results, positions, started):
+    """
+    Waits until the servers started by this task have logged the ready messages
+    :param results: list of per server results, time_to_ready is added to every one
+    :param positions: dict of log directory -> position of SystemOut.log before the servers were started
+    :param started: Time the servers were started
+    :return: list of results which did not get ready in time
+    """
+    timeout = module.params['wait_timeout']
+    waiting = dict()
+    for result in results:
+        # Servers which already were running are not restarted, so there is nothing to wait for
+        result["time_to_ready"] = None if result["changed"] else 0.0
+        if not result["changed"] or result["error"]:
+            continue
+        logDir = findServerLogDir(wasdir, result["name"], result["node"])
+        if logDir is None:
+            module.warn("Can not wait for server {0} on node {1}, its logs are not on this host".format(result["name"], result["node"]))
+            continue
+        waiting[logDir] = result
+
+    ready = waitForMessages(
+        dict((logDir, positions.get(logDir, (None, 0))) for logDir in waiting),
+        module.params['ready_messages'],
+        timeout,
+        started
+    )
+    notReady = []
+    for logDir in ready:
+        waiting[logDir]["time_to_ready"] = ready[logDir]
+        if ready[logDir] is None:
+            waiting[logDir]["error"] = "Not ready after {0} seconds".format(timeout)
+            notReady.append(waiting[logDir])
+    return notReady
+
+
+def getTimeToReady(results):
+    """
+    Returns the time until the slowest server was ready
+    """
+    times = [result.get("time_to_ready") for result in results if result.get("time_to_ready") is not None]
+    if not times:
+        return None
+    return max(times)
+
+
 def main():
 
     # Read arguments
     module = AnsibleModule(
         argument_spec = dict(
             state   = dict(default='started', choices=['started', 'stopped']),
-            name    = dict(required=True),
-            node = dict(required=True),
+            name    = dict(required=False, type='raw'),
+            node = dict(required=False),
+            cluster = dict(required=False),
             username = dict(required=False),
-            password = dict(required=False),
+            password = dict(required=False, no_log=True),
             wasdir  = dict(required=True),
-	    wsadmin = dict(default=True, type='bool')
+            wsadmin = dict(default=True, type='bool'),
+            logdir = dict(default=DEFAULT_LOG_DIR),
+            probe = dict(default=True, type='bool'),
+            wait_for = dict(required=False, choices=['ready']),
+            ready_messages = dict(default=[READY_MESSAGE], type='list'),
+            wait_timeout = dict(default=600, type='int'),
+            parallelism = dict(default=1, type='int'),
+            node_parallelism = dict(default=1, type='int'),
+            session = dict(default=True, type='bool'),
+            session_timeout = dict(default=DEFAULT_IDLE_TIMEOUT, type='int'),
+            cache_dir = dict(default=DEFAULT_CACHE_DIR),
+            facts = dict(required=False, type='dict'),
+            transport = dict(default='wsadmin', choices=['wsadmin', 'soap']),
+            host = dict(default='localhost'),
+            port = dict(default=DEFAULT_PORT, type='int'),
+            ssl = dict(default=False, type='bool'),
+            validate_certs = dict(default=True, type='bool')
         ),
+        required_one_of = [['name', 'cluster']],
         supports_check_mode = True
     )
 
     state = module.params['state']
-    name = module.params['name']
-    node = module.params['node']
+    cluster = module.params['cluster']
     username = module.params['username']
     password = module.params['password']
     wasdir = module.params['wasdir']
     wsadmin = module.params['wsadmin']
+    logdir = module.params['logdir']
+    servers = getServers(module)
+    single = cluster is None and len(servers) == 1 and not isinstance(module.params['name'], list)
+    action = "start" if state == 'started' else "stop"
+    waitReady = module.params['wait_for'] == 'ready' and state == 'started'
+    transport = module.params['transport']
 
     # Check if paths are valid
     if not os.path.exists(wasdir):
         module.fail_json(msg="{0} does not exists".format(wasdir))
 
+    # The members of a cluster in the facts are handled like a list of servers
+    facts = module.params['facts']
+    if facts and cluster is not None and cluster in (facts.get("clusters") or {}):
+        servers = servers + [dict(name=member["name"], node=member["node"]) for member in facts["clusters"][cluster]["members"]]
+        cluster = None
+    if transport == 'soap' and cluster is not None:
+        module.fail_json(msg="Clusters require transport=wsadmin or facts, the members are read from the configuration")
+
+    # Servers whose facts or PID file show that they already are in the wanted state are left out
+    started = time.time()
+    probed = []
+    differing = []
+    if module.params['probe'] or facts:
+        remaining = []
+        for server in servers:
+            running = None
+            if facts:
+                running = getKnownState(facts, server["name"], server["node"])
+            if running is None and module.params['probe']:
+                running = probeServer(wasdir, server["name"], server["node"])
+            if running is not None and running == (state == 'started'):
+                probed.append(dict(
+                    name=server["name"],
+                    node=server["node"],
+                    running_before=int(running),
+                    running=int(running),
+                    changed=False,
+                    seconds=0.0,
+                    waited=0.0,
+                    error=None,
+                    probed=True
+                ))
+            else:
+                if running is not None:
+                    # Known to be in the other state, so it would change in check mode
+                    differing.append(dict(
+                        name=server["name"],
+                        node=server["node"],
+                        running_before=int(running),
+                        running=int(not running),
+                        changed=True,
+                        seconds=0.0,
+                        waited=0.0,
+                        error=None,
+                        probed=True
+                    ))
+                remaining.append(server)
+        servers = remaining
+
+    if probed and not servers and cluster is None:
+        extra = dict()
+        if single:
+            msg = "Server {0} is already {1}".format(probed[0]["name"], state)
+            extra = dict(was_name=probed[0]["name"], was_state=probed[0]["running_before"], check_stdout=None)
+        else:
+            msg = "All {0} servers are already {1}".format(len(probed), state)
+        if waitReady:
+            waitForReady(module, wasdir, probed, {}, started)
+            extra["time_to_ready"] = 0.0
+        module.exit_json(changed=False, msg=msg, servers=probed, elapsed=time.time() - started, **extra)
+
+    if module.check_mode:
+        # Servers whose state could not be told, e.g. on other nodes, may change as well
+        known = set((server["name"], server["node"]) for server in differing)
+        unknown = [dict(
+            name=server["name"],
+            node=server["node"],
+            running_before=-1,
+            running=int(state == 'started'),
+            changed=True,
+            seconds=0.0,
+            waited=0.0,
+            error=None,
+            probed=False
+        ) for server in servers if (server["name"], server["node"]) not in known]
+        msg = "Servers would be {0}".format(state)
+        names = [server["name"] for server in unknown]
+        if cluster is not None:
+            names.append("cluster " + cluster)
+        if names:
+            msg = "{0}, could not probe {1}".format(msg, ", ".join(names))
+        module.exit_json(changed=bool(differing or unknown or cluster is not None), msg=msg, servers=probed + differing + unknown)
+
+    # Messages logged from now on tell that the servers are ready
+    positions = dict()
+    if waitReady:
+        positions = getLogPositions(wasdir)
+
+    # All servers are started or stopped over the same SOAP connections, or from one wsadmin script
+    extra = dict()
+    if transport == 'soap':
+        results, calls, connections = controlServersOverSoap(
+            lambda timeout: AdminClient(
+                module.params['host'],
+                module.params['port'],
+                username,
+                password,
+                ssl=module.params['ssl'],
+                validateCerts=module.params['validate_certs'],
+                timeout=timeout
+            ),
+            action,
+            servers,
+            parallelism=module.params['parallelism'],
+            nodeParallelism=module.params['node_parallelism'],
+            timeout=module.params['wait_timeout']
+        )
+        returncode, stdout_value, stderr_value = 0, "", ""
+        extra = dict(soap_calls=calls, soap_connections=connections)
+    elif wsadmin:
+        returncode, results, stdout_value, stderr_value = controlServers(
+            wasdir,
+            action,
+            servers=servers,
+            cluster=cluster,
+            connection=dict(username=username, password=password),
+            session=module.params['session'],
+            cacheDir=module.params['cache_dir'],
+            idleTimeout=module.params['session_timeout'],
+            logDir=logdir,
+            name="was_server." + (servers[0]["name"] if single else module.params['cluster'] or "batch"),
+            parallelism=module.params['parallelism'],
+            nodeParallelism=module.params['node_parallelism']
+        )
+
+    if transport == 'soap' or wsadmin:
+        for result in results:
+            result["probed"] = False
+        results = probed + results
+        if waitReady and returncode == 0:
+            waitForReady(module, wasdir, results, positions, started)
+        elapsed = time.time() - started
+        failed = [result for result in results if result["error"]]
+        changed = len([result for result in results if result["changed"]]) > 0
+
+        if single and results:
+            extra.update(was_name=results[0]["name"], was_state=results[0]["running_before"], check_stdout=stdout_value)
+        if waitReady:
+            extra["time_to_ready"] = getTimeToReady(results)
+
+        if returncode != 0 or failed or not results:
+            if failed and not failed[0]["name"]:
+                msg = failed[0]["error"]
+            elif failed:
+                msg = "Failed to {0} {1}".format(action, ", ".join([result["name"] for result in failed]))
+            else:
+                msg = "Failed to {0} servers".format(action)
+            module.fail_json(
+                changed=changed,
+                msg=msg,
+                servers=results,
+                elapsed=elapsed,
+                stdout=stdout_value,
+                stderr=stderr_value,
+                **extra
+            )
+
+        if single:
+            if changed:
+                msg = "Server {0} successfully {1}".format(results[0]["name"], state)
+            else:
+                msg = "Server {0} is already {1}".format(results[0]["name"], state)
+        else:
+            msg = "{0} of {1} servers {2}".format(len([result for result in results if result["changed"]]), len(results), state)
+        module.exit_json(
+            changed=changed,
+            msg=msg,
+            servers=results,
+            elapsed=elapsed,
+            stdout=stdout_value,
+            stderr=stderr_value,
+            **extra
+        )
+
+    # The native scripts only control one server on this node
+    if not single:
+        module.fail_json(msg="Lists of servers and clusters require wsadmin=true")
+    name = servers[0]["name"]
+    node = servers[0]["node"]
+
     cmd = ""
     credentials = ""
     if username is not None:
-	credentials += " {0} -username {1} ".format(credentials, username)
+        credentials += " {0} -username {1} ".format(credentials, username)
     if password is not None:
-  	credentials += " {0} -password {1} ".format(credentials, password)
+        credentials += " {0} -password {1} ".format(credentials, password)
 
     # Start server
     if state == 'started':
-	if wsadmin: 
-	    cmd = "{0}/bin/wsadmin.sh -lang jython {1} -c \"AdminControl.startServer('{2}', '{3}')\"".format(wasdir, credentials, name, node) 
-	else:
-	    cmd = "{0}/bin/startServer.sh {1} {2}".format(wasdir, name, credentials)
-        child = subprocess.Popen(
-            [cmd],
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE    
-        )
-        stdout_value, stderr_value = child.communicate()
-	if child.returncode != 0:
-	    module.fail_json(
-		changed=False,
-		msg="Failed to start server {0} on node {1}".format(name, node),
-		stdout=stdout_value,
-		stderr=stderr_value
-	    )
+        cmd = "{0}/bin/startServer.sh {1} {2}".format(wasdir, name, credentials)
+        returncode, stdout_value, stderr_value = runCommand(cmd, *getLogFiles(logdir, "was_server." + name))
+        if returncode != 0:
+            module.fail_json(
+                changed=False,
+                msg="Failed to start server {0} on node {1}".format(name, node),
+                stdout=stdout_value,
+                stderr=stderr_value
+            )
+
+        readiness = dict()
+        if waitReady:
+            result = dict(name=name, node=node, changed=getState(stdout_value, name, wsadmin)["was_state"] != 1, error=None)
+            if waitForReady(module, wasdir, [result], positions, started):
+                module.fail_json(
+                    changed=True,
+                    msg="Server {0} is not ready after {1} seconds".format(name, module.params['wait_timeout']),
+                    stdout=stdout_value,
+                    stderr=stderr_value
+                )
+            readiness = dict(time_to_ready=result["time_to_ready"])
 
         if getState(stdout_value, name, wsadmin)["was_state"] == 1:
             module.exit_json(
@@ -160,39 +548,32 @@ def main():
                 stderr=stderr_value,
                 was_name=getItem("was_name"),
                 was_state=getItem("was_state"),
-                check_stdout=getItem("check_stdout")
+                check_stdout=getItem("check_stdout"),
+                **readiness
             )
         else: 
             module.exit_json(
-                changed=False,
+                changed=True,
                 msg="Server {0} successfully started".format(name),
                 stdout=stdout_value,
                 stderr=stderr_value,
                 was_name=getItem("was_name"),
                 was_state=getItem("was_state"),
-                check_stdout=getItem("check_stdout")
+                check_stdout=getItem("check_stdout"),
+                **readiness
             )
 
     # Stop server
     if state == 'stopped':
-	if wsadmin:
-	   cmd = "{0}/bin/wsadmin.sh -lang jython {1} -c \"AdminControl.stopServer('{2}', '{3}')\"".format(wasdir, credentials, name, node)
-	else:
-	   cmd = "{0}/bin/stopServer.sh {1} {2}".format(wasdir, name, credentials)
-        child = subprocess.Popen(
-            [cmd],
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE    
-        )
-        stdout_value, stderr_value = child.communicate()
-	if child.returncode != 0:
-	    module.fail_json(
-		changed=False,
-		msg="Failed to stop server {0} on node {1}".format(name, node),
-		stdout=stdout_value,
-		stderr=stderr_value
-	    )
+        cmd = "{0}/bin/stopServer.sh {1} {2}".format(wasdir, name, credentials)
+        returncode, stdout_value, stderr_value = runCommand(cmd, *getLogFiles(logdir, "was_server." + name))
+        if returncode != 0:
+            module.fail_json(
+                changed=False,
+                msg="Failed to stop server {0} on node {1}".format(name, node),
+                stdout=stdout_value,
+                stderr=stderr_value
+            )
         if getState(stdout_value, name, wsadmin)["was_state"] == 0:
             module.exit_json(
                 changed=False,
@@ -205,7 +586,7 @@ def main():
             )
         else:
             module.exit_json(
-                changed=False,
+                changed=True,
                 msg="Server {0} successfully stopped".format(name),
                 stdout=stdout_value,
                 stderr=stderr_value,
@@ -216,5 +597,12 @@ def main():
 
 # import module snippets
 from ansible.module_utils.basic import *
+from ansible.module_utils.websphere_cache import DEFAULT_CACHE_DIR
+from ansible.module_utils.websphere_command import DEFAULT_LOG_DIR, getLogFiles, runCommand
+from ansible.module_utils.was_control import controlServers
+from ansible.module_utils.was_log import READY_MESSAGE, getLogPositions, waitForMessages
+from ansible.module_utils.was_process import findServerLogDir, probeServer
+from ansible.module_utils.was_soap import DEFAULT_PORT, AdminClient, controlServersOverSoap
+from ansible.module_utils.wsadmin_session import DEFAULT_IDLE_TIMEOUT
 if __name__ == '__main__':
     main()
@@ -11,24 +11,85 @@
 # -username
 # -password
 # -f <jython_script> <arguments> ...
+#
+# The script runs in the long lived wsadmin session of the host (see
+# module_utils/wsadmin_session.py) unless session=false, or if no session
+# can be started.
+#
+# A list of scripts (scripts=...) runs in one wsadmin through a generated
+# driver (see module_utils/wsadmin_batch.py), which can save the
+# configuration once at the end.
+#
+# With idempotent=true a digest of the scripts, their parameters and the
+# target cell is recorded after a successful run, together with the epoch of
+# the configuration repository. A run with the same digest against an
+# unchanged repository is skipped.
 
+import hashlib
 import os
 import subprocess
 import platform
 import datetime
+import time
+
+def getScriptDigest(scripts, host, port, cell, save=None):
+    """
+    Returns the digest of a script run
+    :param scripts: list of (path, params). The content of every script is hashed
+    :param cell: Name of the target cell
+    :param save: Whether a batch saves the configuration, None for a single script
+    :return: hex string
+    """
+    digest = hashlib.sha256()
+    for script, params in scripts:
+        with open(script, "rb") as f:
+            digest.update(f.read())
+        digest.update(b"\0" + str(params).encode("utf-8"))
+    values = [host, port, cell]
+    if save is not None:
+        values.append(save)
+    for value in values:
+        digest.update(b"\0" + str(value).encode("utf-8"))
+    return digest.hexdigest()
+
+def getScripts(module):
+    """
+    Reads the scripts option
+    :return: list of (path, params)
+    """
+    scripts = []
+    for entry in module.params['scripts']:
+        if isinstance(entry, dict) and entry.get("script"):
+            scripts.append((entry["script"], entry.get("params")))
+        elif isinstance(entry, string_types):
+            scripts.append((entry, None))
+        else:
+            module.fail_json(msg="Every entry of scripts needs a script: {0}".format(entry))
+    return scripts
 
 def main():
 
     # Read arguments
     module = AnsibleModule(
         argument_spec = dict(
-            params = dict(required=True),
+            params = dict(required=False),
             host = dict(default='localhost', required=False),
             port = dict(default='8879', required=False),
             username = dict(required=False),
             password = dict(required=False),
-            script = dict(required=True)
-        )
+            script = dict(required=False),
+            scripts = dict(required=False, type='list'),
+            save = dict(default=False, type='bool'),
+            wasdir = dict(required=True),
+            logdir = dict(default=DEFAULT_LOG_DIR),
+            session = dict(default=True, type='bool'),
+            session_timeout = dict(default=DEFAULT_IDLE_TIMEOUT, type='int'),
+            cache_dir = dict(default=DEFAULT_CACHE_DIR),
+            idempotent = dict(default=False, type='bool')
+        ),
+        required_one_of = [['script', 'scripts']],
+        mutually_exclusive = [['script', 'scripts']],
+        supports_check_mode = True
     )
 
     params = module.params['params']
@@ -37,18 +98,106 @@ def main():
     username = module.params['username']
     password = module.params['password']
     script = module.params['script']
+    wasdir = module.params['wasdir']
+    logdir = module.params['logdir']
+
+    connection = dict(conntype="SOAP", host=host, port=port, username=username, password=password)
+
+    # A list of scripts, or a single script whose changes are saved, runs as a batch
+    save = module.params['save']
+    scripts = None
+    if module.params['scripts'] is not None:
+        scripts = getScripts(module)
+    elif save:
+        scripts = [(script, params)]
+    entries = scripts or [(script, params)]
+    label = script if scripts is None else ", ".join([path for path, args in scripts])
+
+    for path, args in entries:
+        if not os.path.isfile(path):
+            module.fail_json(msg="{0} does not exists".format(path))
+
+    # Skip the run if the same script was applied to the repository as it is now
+    digest = None
+    configDir = None
+    if module.params['idempotent']:
+        configDir = findConfigDir(wasdir)
+        if configDir is None:
+            module.warn("No configuration repository below {0}, the script always runs".format(wasdir))
+        else:
+            statePath = os.path.join(getCacheDir(module.params['cache_dir'], "wsadmin"), "applied.json")
+            applied = loadJson(statePath, dict())
+            digest = getScriptDigest(entries, host, port, ",".join(getCellNames(configDir)), save if scripts is not None else None)
+            epoch = getRepositoryEpoch(configDir)
+            if applied.get(digest, dict()).get("epoch") == epoch:
+                module.exit_json(
+                    changed=False,
+                    msg="Script already applied to the current configuration: " + label,
+                    digest=digest,
+                    epoch=epoch
+                )
+
+    if module.check_mode:
+        module.exit_json(changed=True, msg="Script would be executed: " + label, digest=digest)
+
+    # Run all scripts in one wsadmin
+    extra = dict()
+    if scripts is not None:
+        returncode, results, saved, stdout_value, stderr_value, session = runBatch(
+            wasdir,
+            [(path, getScriptArgs(args)) for path, args in scripts],
+            save=save,
+            connection=connection,
+            session=module.params['session'],
+            cacheDir=module.params['cache_dir'],
+            idleTimeout=module.params['session_timeout'],
+            logDir=logdir,
+            name="wsadmin.batch"
+        )
+        failed = [result for result in results if result["status"] == "failed"]
+        if returncode != 0 or failed:
+            if failed:
+                msg = "Failed executing wsadmin script: " + failed[0]["script"]
+            elif saved is not None and saved["rc"] != 0:
+                msg = "Failed to save the configuration"
+            else:
+                msg = "Failed executing wsadmin scripts: " + label
+            module.fail_json(msg=msg, scripts=results, saved=saved, stdout=stdout_value, stderr=stderr_value, session=session)
+        extra = dict(scripts=results, saved=saved)
+    else:
+        # Run wsadmin script
+        returncode, stdout_value, stderr_value, session = runWsadmin(
+            wasdir,
+            script=script,
+            args=params,
+            connection=connection,
+            session=module.params['session'],
+            cacheDir=module.params['cache_dir'],
+            idleTimeout=module.params['session_timeout'],
+            logDir=logdir,
+            name="wsadmin." + os.path.basename(script)
+        )
+        if returncode != 0:
+            module.fail_json(msg="Failed executing wsadmin script: " + script, stdout=stdout_value, stderr=stderr_value, session=session)
 
-    # Run wsadmin command server
-    if state == 'stopped':
-        child = subprocess.Popen([wasdir+"/bin/wsadmin.sh -lang jython -conntype SOAP -host "+host+" -port "+port+" -username " + username + " -password " + password " -f "+script+" "+params], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout_value, stderr_value = child.communicate()
-        if child.returncode != 0:
-            module.fail_json(msg="Failed executing wsadmin script: " + ¨script, stdout=stdout_value, stderr=stderr_value)
+    # The epoch after the run includes the changes saved by the script
+    epoch = None
+    if digest is not None:
+        epoch = getRepositoryEpoch(configDir)
+        applied = loadJson(statePath, dict())
+        applied[digest] = dict(epoch=epoch, script=[os.path.abspath(path) for path, args in entries], applied_at=time.time())
+        saveJson(statePath, applied)
 
-        module.exit_json(changed=True, msg="Script executed successfully: " + scrpit, stdout=stdout_value)
+    module.exit_json(changed=True, msg="Script executed successfully: " + label, stdout=stdout_value, session=session, digest=digest, epoch=epoch, **extra)
 
 
 # import module snippets
 from ansible.module_utils.basic import *
+from ansible.module_utils.websphere_cache import DEFAULT_CACHE_DIR, getCacheDir, loadJson, saveJson
+from ansible.module_utils.websphere_command import DEFAULT_LOG_DIR
+from ansible.module_utils.was_config import findConfigDir, getCellNames, getRepositoryEpoch
+from ansible.module_utils.six import string_types
+from ansible.module_utils.wsadmin_batch import getScriptArgs, runBatch
+from ansible.module_utils.wsadmin_session import DEFAULT_IDLE_TIMEOUT, runWsadmin
 if __name__ == '__main__':
     main()
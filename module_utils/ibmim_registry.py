@@ -0,0 +1,104 @@
+#
+# Reads the install registry of IBM Installation Manager.
+#
+# Installation Manager keeps track of every installed package in
+# <appDataLocation>/installRegistry.xml. Reading that file directly is a lot
+# cheaper than starting a JVM with "imcl listInstalledPackages".
+#
+# <installRegistry>
+#   <profile id='IBM WebSphere Application Server V8.5' kind='product'>
+#     <property name='installLocation' value='/opt/IBM/WebSphere/AppServer'/>
+#     <offering id='com.ibm.websphere.ND.v85' version='8.5.5010.20160721_0036' .../>
+#   </profile>
+# </installRegistry>
+#
+
+import os
+import xml.etree.ElementTree as ElementTree
+
+# Locations used by Installation Manager when cic.appDataLocation is not set
+DEFAULT_APPDATA_LOCATIONS = [
+    "/var/ibm/InstallationManager",
+    os.path.expanduser("~/var/ibm/InstallationManager")
+]
+
+REGISTRY_FILE = "installRegistry.xml"
+
+
+def getAppDataLocations(ibmim):
+    """
+    Returns the candidate agent data locations of an Installation Manager installation
+    :param ibmim: Installation directory of Installation Manager
+    :return: list of paths, most specific first
+    """
+    locations = []
+    config = os.path.join(ibmim, "eclipse", "configuration", "config.ini")
+    if os.path.isfile(config):
+        with open(config) as f:
+            for line in f:
+                if line.startswith("cic.appDataLocation="):
+                    location = line.split("=", 1)[1].strip()
+                    location = location.replace("\\:", ":").replace("@user.home", os.path.expanduser("~"))
+                    locations.append(location)
+                    break
+    return locations + DEFAULT_APPDATA_LOCATIONS
+
+
+def findInstallRegistry(ibmim):
+    """
+    Finds the install registry of an Installation Manager installation
+    :param ibmim: Installation directory of Installation Manager
+    :return: Path to installRegistry.xml or None if it could not be found
+    """
+    for location in getAppDataLocations(ibmim):
+        registry = os.path.join(location, REGISTRY_FILE)
+        if os.path.isfile(registry):
+            return registry
+    return None
+
+
+def readInstalledPackages(registry):
+    """
+    Streams the install registry and returns every installed offering
+    :param registry: Path to installRegistry.xml
+    :return: list of dicts with the keys id, version, name, path and profile
+    """
+    packages = []
+    offerings = []
+    properties = {}
+
+    for event, elem in ElementTree.iterparse(registry, events=("end",)):
+        if elem.tag == "property":
+            properties[elem.get("name")] = elem.get("value")
+        elif elem.tag == "offering":
+            offerings.append(dict(elem.attrib))
+        elif elem.tag == "profile":
+            for offering in offerings:
+                packages.append(dict(
+                    id = offering.get("id"),
+                    version = offering.get("version"),
+                    name = offering.get("name", elem.get("id")),
+                    path = properties.get("installLocation"),
+                    profile = elem.get("id")
+                ))
+            offerings = []
+            properties = {}
+            elem.clear()
+
+    return packages
+
+
+def findPackage(packages, packageId):
+    """
+    Looks up a package by its ID, with or without the version suffix
+    :param packages: list returned by readInstalledPackages()
+    :param packageId: Package ID, e.g. com.ibm.websphere.ND.v85 or com.ibm.websphere.ND.v85_8.5.5010.20160721_0036
+    :return: dict or None if the package is not installed
+    """
+    for package in packages:
+        if package["id"] == packageId:
+            return package
+        fullId = "{0}_{1}".format(package["id"], package["version"])
+        if packageId.startswith(package["id"] + "_") and fullId.startswith(packageId):
+            return package
+    return None
@@ -0,0 +1,359 @@
+#
+# Lists the packages available in Installation Manager repositories.
+#
+# Local repositories are read straight from disk. A repository contains a
+# repository.config and one jar per offering version below Offerings/:
+#
+#   /var/data/was/repository.config
+#   /var/data/was/Offerings/com.ibm.websphere.ND.v85_8.5.5010.20160721_0036.jar
+#
+# Composite repositories list their children in repository.config as
+# repository.url.<name>=<path>. Remote repositories are listed with
+# "imcl listAvailablePackages". Listings are cached below the cache directory.
+# Remote listings are trusted for a TTL and then revalidated with conditional
+# GETs of repository.config and repository.xml (ETag/Last-Modified), so a
+# repository server is only asked for its full metadata when it has actually
+# changed.
+#
+
+import os
+import re
+import subprocess
+import threading
+import time
+
+from ansible.module_utils.six.moves.urllib.error import HTTPError, URLError
+from ansible.module_utils.urls import open_url
+from ansible.module_utils.websphere_cache import getCacheDir, loadJson, saveJson
+
+OFFERINGS_DIRS = ["Offerings", "Fixes"]
+
+# Metadata of a repository that changes whenever its offerings change
+REVALIDATED_DOCUMENTS = ["repository.config", "repository.xml"]
+
+# Bytes a probe must read before its throughput means anything
+MIN_THROUGHPUT_SAMPLE = 64 * 1024
+
+
+def isRemote(repository):
+    """
+    Checks if a repository is an URL rather than a local path
+    """
+    return re.match("^[a-zA-Z]+://", repository) is not None and not repository.startswith("file:")
+
+
+def splitRepositories(repositories):
+    """
+    Splits a comma separated list of repositories
+    :return: list of repositories
+    """
+    if isinstance(repositories, (list, tuple)):
+        return list(repositories)
+    return [repository.strip() for repository in (repositories or "").split(",") if repository.strip()]
+
+
+def splitPackageId(packageId):
+    """
+    Splits com.ibm.websphere.ND.v85_8.5.5010.20160721_0036 into ID and version
+    :return: tuple of id and version, version is None if the ID has no version
+    """
+    parts = packageId.split("_", 1)
+    return parts[0], (parts[1] if len(parts) > 1 else None)
+
+
+def compareVersions(a, b):
+    """
+    Compares two Installation Manager versions such as 8.5.5010.20160721_0036
+    :return: negative if a is older than b, 0 if equal, positive if a is newer
+    """
+    def key(version):
+        return [(0, int(part), "") if part.isdigit() else (1, 0, part) for part in re.split("[._-]", version or "")]
+    ka, kb = key(a), key(b)
+    return (ka > kb) - (ka < kb)
+
+
+def readRepositoryConfig(path):
+    """
+    Reads the properties of a repository.config
+    :param path: Path to repository.config
+    :return: dict
+    """
+    config = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#") and "=" in line:
+                key, value = line.split("=", 1)
+                config[key.strip()] = value.strip()
+    return config
+
+
+def getLocalStamp(repository):
+    """
+    Returns the modification times which identify the content of a local repository
+    """
+    stamp = []
+    for name in REVALIDATED_DOCUMENTS + OFFERINGS_DIRS:
+        try:
+            stamp.append(os.stat(os.path.join(repository, name)).st_mtime)
+        except OSError:
+            stamp.append(None)
+    return stamp
+
+
+def listLocalPackages(repository):
+    """
+    Lists the packages of a local repository without starting Java
+    :param repository: Path (or file: URL) of the repository
+    :return: list of dicts with the keys id and version, or None if this is not a readable repository
+    """
+    if repository.startswith("file:"):
+        repository = re.sub("^file:(//)?", "", repository)
+    config = os.path.join(repository, "repository.config")
+    if not os.path.isfile(config):
+        return None
+
+    properties = readRepositoryConfig(config)
+    if properties.get("LayoutPolicy") == "Composite":
+        packages = []
+        for key in sorted(properties):
+            if key.startswith("repository.url."):
+                child = listLocalPackages(os.path.join(repository, properties[key]))
+                if child is None:
+                    return None
+                packages.extend(child)
+        return packages
+
+    packages = []
+    for name in OFFERINGS_DIRS:
+        directory = os.path.join(repository, name)
+        if not os.path.isdir(directory):
+            continue
+        for entry in sorted(os.listdir(directory)):
+            base, extension = os.path.splitext(entry)
+            if extension not in (".jar", ".zip") or "_" not in base:
+                continue
+            packageId, version = splitPackageId(base)
+            packages.append(dict(id=packageId, version=version))
+    return packages
+
+
+def listImclPackages(ibmim, repository):
+    """
+    Lists the packages of a repository with imcl listAvailablePackages
+    :param ibmim: Installation directory of Installation Manager
+    :param repository: Path or URL of the repository
+    :return: tuple of the list of packages, stdout and stderr. The list is None if imcl failed
+    """
+    child = subprocess.Popen(
+        ["{0}/eclipse/tools/imcl listAvailablePackages "
+         "-repositories {1}".format(ibmim, repository)],
+        shell=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True
+    )
+    stdout_value, stderr_value = child.communicate()
+    if child.returncode != 0:
+        return None, stdout_value, stderr_value
+
+    packages = []
+    for line in stdout_value.splitlines():
+        line = line.strip()
+        if re.match("^[\\w.-]+_[0-9][\\w.-]*$", line):
+            packageId, version = splitPackageId(line)
+            packages.append(dict(id=packageId, version=version))
+    return packages, stdout_value, stderr_value
+
+
+def revalidateDocument(url, cached, timeout=30):
+    """
+    Asks the server whether a document changed since it was last seen
+    :param cached: dict with the etag and last_modified of the document, or with missing=True
+    :return: tuple of (unchanged, validators). validators is None if the server could not be asked
+    """
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+    try:
+        response = open_url(url, headers=headers, timeout=timeout)
+        info = response.info()
+        return False, dict(etag=info.get("ETag"), last_modified=info.get("Last-Modified"))
+    except HTTPError as e:
+        if e.code == 304 and cached:
+            return True, cached
+        if e.code == 404:
+            # Not every repository has a repository.xml
+            return bool(cached and cached.get("missing")), dict(missing=True)
+        return False, None
+    except (URLError, IOError, OSError):
+        return False, None
+
+
+def revalidateRemote(repository, entry, timeout=30):
+    """
+    Asks a remote repository whether its metadata (repository.config and repository.xml) changed since it was listed
+    :param repository: URL of the repository
+    :param entry: Cached entry with the validators of the previous listing, or None
+    :param timeout: Timeout in seconds
+    :return: tuple of (unchanged, validators). unchanged is True only if no document changed
+    """
+    previous = (entry or {}).get("documents") or {}
+    unchanged = bool(previous)
+    documents = {}
+    for name in REVALIDATED_DOCUMENTS:
+        same, validators = revalidateDocument("{0}/{1}".format(repository.rstrip("/"), name), previous.get(name), timeout)
+        if validators is None:
+            return False, {}
+        unchanged = unchanged and same
+        documents[name] = validators
+    return unchanged, dict(documents=documents)
+
+
+def listAvailablePackages(ibmim, repositories, cacheDir, ttl=0):
+    """
+    Lists the packages available in a set of repositories. Local listings are
+    cached until repository.config, repository.xml or the offerings directories change. Remote
+    listings are cached for ttl seconds and then revalidated with the server
+    :param ibmim: Installation directory of Installation Manager
+    :param repositories: list or comma separated string of repositories
+    :param cacheDir: Root cache directory
+    :param ttl: Seconds a remote listing is used without asking the server
+    :return: dict of repository -> list of packages. The list is None if the repository could not be read
+    """
+    path = os.path.join(getCacheDir(cacheDir, "ibmim"), "repositories.json")
+    cache = loadJson(path, {})
+    listings = {}
+
+    for repository in splitRepositories(repositories):
+        packages = None
+        entry = cache.get(repository)
+        if not isRemote(repository):
+            stamp = getLocalStamp(repository)
+            if entry and entry.get("stamp") == stamp:
+                packages = entry["packages"]
+            else:
+                packages = listLocalPackages(repository)
+                if packages is not None:
+                    cache[repository] = dict(stamp=stamp, packages=packages)
+        else:
+            now = time.time()
+            if entry and now - entry.get("fetched", 0) < ttl:
+                packages = entry["packages"]
+            else:
+                unchanged, validators = revalidateRemote(repository, entry)
+                if unchanged:
+                    packages = entry["packages"]
+                else:
+                    packages = listImclPackages(ibmim, repository)[0]
+                if packages is not None and (validators or ttl > 0):
+                    cache[repository] = dict(packages=packages, fetched=now, **validators)
+        if packages is None and not isRemote(repository):
+            packages = listImclPackages(ibmim, repository)[0]
+        listings[repository] = packages
+
+    saveJson(path, cache)
+    return listings
+
+
+def probeRepository(repository, timeout=10):
+    """
+    Measures how fast a repository answers by reading its repository.config
+    and, if present, repository.xml. The throughput is only measured if they
+    are large enough to tell it apart from the latency
+    :param repository: Path or URL of the repository
+    :param timeout: Timeout in seconds
+    :return: dict with the keys repository, reachable, latency (seconds), throughput (bytes/second or None) and error
+    """
+    result = dict(repository=repository, reachable=False, latency=None, throughput=None, error=None)
+    size = 0
+    started = time.time()
+    try:
+        for name in ["repository.config", "repository.xml"]:
+            if isRemote(repository):
+                try:
+                    response = open_url("{0}/{1}".format(repository.rstrip("/"), name), timeout=timeout)
+                except HTTPError as e:
+                    if name != "repository.config" and e.code == 404:
+                        continue
+                    raise
+            else:
+                path = os.path.join(re.sub("^file:(//)?", "", repository), name)
+                if name != "repository.config" and not os.path.isfile(path):
+                    continue
+                response = open(path, "rb")
+            try:
+                if result["latency"] is None:
+                    response.read(1)
+                    size += 1
+                    result["latency"] = time.time() - started
+                for chunk in iter(lambda: response.read(65536), b""):
+                    size += len(chunk)
+            finally:
+                response.close()
+    except (HTTPError, URLError, IOError, OSError) as e:
+        result["error"] = str(e)
+        return result
+
+    result["reachable"] = True
+    if size >= MIN_THROUGHPUT_SAMPLE:
+        result["throughput"] = size / max(time.time() - started - result["latency"], 0.000001)
+    return result
+
+
+def selectRepositories(repositories, mode, timeout=10, referenceSize=10 * 1024 * 1024):
+    """
+    Probes all repositories in parallel and orders them by the estimated time to
+    download referenceSize bytes. Unreachable repositories are left out
+    :param repositories: list or comma separated string of repositories
+    :param mode: 'order' to keep all reachable repositories, fastest first. 'fastest' to keep only the fastest
+    :param timeout: Timeout in seconds of a probe
+    :param referenceSize: Number of bytes used to weigh latency against throughput
+    :return: tuple of the selected repositories and the probe results in the same order
+    """
+    repositories = splitRepositories(repositories)
+    results = [None] * len(repositories)
+
+    def probe(index):
+        results[index] = probeRepository(repositories[index], timeout)
+
+    threads = [threading.Thread(target=probe, args=(index,)) for index in range(len(repositories))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Weigh in the throughput only if it could be measured for every repository
+    reachable = [result for result in results if result["reachable"]]
+    for result in reachable:
+        result["score"] = result["latency"]
+        if None not in [other["throughput"] for other in reachable]:
+            result["score"] += float(referenceSize) / result["throughput"]
+    reachable.sort(key=lambda result: result["score"])
+
+    ranked = reachable + [result for result in results if not result["reachable"]]
+
+    # Leave it to Installation Manager to report the error if nothing answered
+    if not reachable:
+        return repositories, ranked
+    if mode == "fastest":
+        reachable = reachable[:1]
+    return [result["repository"] for result in reachable], ranked
+
+
+def getLatestVersions(listings):
+    """
+    Returns the newest available version of every package
+    :param listings: dict returned by listAvailablePackages()
+    :return: dict of package ID -> version
+    """
+    latest = {}
+    for packages in listings.values():
+        for package in packages or []:
+            current = latest.get(package["id"])
+            if current is None or compareVersions(package["version"], current) > 0:
+                latest[package["id"]] = package["version"]
+    return latest
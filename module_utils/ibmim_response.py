@@ -0,0 +1,141 @@
+#
+# Builds Installation Manager response files.
+#
+# A response file lets imcl install several offerings, with their features,
+# fixes and preferences, in a single "imcl input" run.
+#
+# <agent-input acceptLicense='true'>
+#   <server>
+#     <repository location='/var/data/was'/>
+#   </server>
+#   <profile id='IBM WebSphere Application Server V8.5' installLocation='/opt/IBM/WebSphere/AppServer'>
+#     <data key='eclipseLocation' value='/opt/IBM/WebSphere/AppServer'/>
+#     <data key='user.wasjava' value='java8'/>
+#   </profile>
+#   <install>
+#     <offering id='com.ibm.websphere.ND.v85' profile='IBM WebSphere Application Server V8.5' features='core.feature' installFixes='none'/>
+#   </install>
+#   <preference name='com.ibm.cic.common.core.preferences.eclipseCache' value='/opt/IBM/IMShared'/>
+# </agent-input>
+#
+
+import hashlib
+import os
+import xml.etree.ElementTree as ElementTree
+
+from ansible.module_utils.websphere_cache import getCacheDir, loadJson, saveJson
+
+# Preference used by Installation Manager for the shared resources directory
+SHARED_RESOURCES_PREFERENCE = "com.ibm.cic.common.core.preferences.eclipseCache"
+
+
+def toCsv(value):
+    """
+    Joins a list to a comma separated string. Strings are returned as is
+    """
+    if isinstance(value, (list, tuple)):
+        return ",".join([str(v) for v in value])
+    return value
+
+
+def parseProperties(value):
+    """
+    Parses the properties given to imcl install -properties
+    :param value: Comma separated string in the format key1=value,key2=value, or None
+    :return: dict of key -> value
+    :raises ValueError: if an entry has no key
+    """
+    properties = dict()
+    for entry in (value or "").split(","):
+        if not entry.strip():
+            continue
+        key, sep, data = entry.partition("=")
+        if not sep or not key.strip():
+            raise ValueError("Property '{0}' is not in the format key=value".format(entry))
+        properties[key.strip()] = data.strip()
+    return properties
+
+
+def buildResponseFile(offerings, repositories, profiles, preferences=None, imShared=None, installFixes="none", properties=None):
+    """
+    Builds the XML of a response file
+    :param offerings: list of dicts with the keys id, version, profile, features and install_fixes
+    :param repositories: list or comma separated string of repositories
+    :param profiles: list of dicts with the keys id, install_location and data
+    :param preferences: dict of Installation Manager preferences
+    :param imShared: Path to the shared resources directory
+    :param installFixes: Default value of installFixes for offerings which do not set it
+    :param properties: dict of install properties, the same as imcl install -properties. They become data of every profile
+    :return: The response file as a string
+    """
+    root = ElementTree.Element("agent-input", acceptLicense="true")
+
+    server = ElementTree.SubElement(root, "server")
+    if not isinstance(repositories, (list, tuple)):
+        repositories = repositories.split(",")
+    for repository in repositories:
+        ElementTree.SubElement(server, "repository", location=repository.strip())
+
+    for profile in profiles:
+        element = ElementTree.SubElement(root, "profile", id=profile["id"], installLocation=profile["install_location"])
+        data = dict(eclipseLocation=profile["install_location"])
+        data.update(properties or {})
+        data.update(profile.get("data") or {})
+        for key in sorted(data):
+            ElementTree.SubElement(element, "data", key=key, value=str(data[key]))
+
+    install = ElementTree.SubElement(root, "install")
+    for offering in offerings:
+        element = ElementTree.SubElement(install, "offering", id=offering["id"])
+        if offering.get("version"):
+            element.set("version", offering["version"])
+        element.set("profile", offering["profile"])
+        if offering.get("features"):
+            element.set("features", toCsv(offering["features"]))
+        element.set("installFixes", offering.get("install_fixes") or installFixes)
+
+    preferences = dict(preferences or {})
+    if imShared:
+        preferences.setdefault(SHARED_RESOURCES_PREFERENCE, imShared)
+    for name in sorted(preferences):
+        ElementTree.SubElement(root, "preference", name=name, value=str(preferences[name]))
+
+    return "<?xml version='1.0' encoding='UTF-8'?>\n" + ElementTree.tostring(root).decode("utf-8") + "\n"
+
+
+def getDigest(content):
+    """
+    Returns the SHA-256 digest of a response file
+    """
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def writeResponseFile(cacheDir, content):
+    """
+    Writes a response file to the cache directory. The file name contains its digest
+    :param cacheDir: Root cache directory
+    :param content: The response file as a string
+    :return: Path to the response file
+    """
+    path = os.path.join(getCacheDir(cacheDir, "ibmim"), "response-{0}.xml".format(getDigest(content)))
+    with open(path, "w") as f:
+        f.write(content)
+    return path
+
+
+def isApplied(cacheDir, digest):
+    """
+    Checks if a response file with this digest has been applied successfully before
+    """
+    applied = loadJson(os.path.join(getCacheDir(cacheDir, "ibmim"), "responses.json"), {})
+    return digest in applied
+
+
+def recordApplied(cacheDir, digest, path):
+    """
+    Records that a response file has been applied successfully
+    """
+    state = os.path.join(getCacheDir(cacheDir, "ibmim"), "responses.json")
+    applied = loadJson(state, {})
+    applied[digest] = path
+    saveJson(state, applied)
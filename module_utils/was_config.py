@@ -0,0 +1,310 @@
+#
+# Reads the configuration repository of a profile without wsadmin.
+#
+# Read-only questions (which servers exist, their ports, JVM settings and
+# data sources) are answered from the XML documents below
+# <profile>/config/cells/<cell>:
+#
+#   cell.xml                                  name of the cell
+#   clusters/<cluster>/cluster.xml            cluster members
+#   nodes/<node>/serverindex.xml              servers of a node and their ports
+#   nodes/<node>/servers/<server>/server.xml  JVM settings
+#   .../resources.xml                         data sources, at every scope
+#
+# Every document is read with iterparse, keeping only the attributes that
+# are needed. The extracted data is kept in an index below the cache
+# directory together with the mtime and size of every document, so a later
+# run only parses the documents that changed.
+#
+
+import hashlib
+import os
+import time
+import xml.etree.ElementTree as ElementTree
+
+from ansible.module_utils.websphere_cache import getCacheDir, loadJson, saveJson
+from ansible.module_utils.was_process import getProfileDirs
+
+# Bumped when the extracted data changes, so old indexes are parsed again
+INDEX_VERSION = 1
+
+XMI_TYPE = "{http://www.omg.org/XMI}type"
+
+# Directories below a cell which hold no documents the index needs
+SKIPPED_DIRS = set(["applications", "blas", "cus", "assets", "deployments"])
+
+
+class ConfigError(Exception):
+    pass
+
+
+def localName(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def iterStart(path):
+    """
+    Streams the start of every element of a document
+    :return: generator of (depth, local name, attributes)
+    """
+    depth = 0
+    for event, element in ElementTree.iterparse(path, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            yield depth, localName(element.tag), element.attrib
+        else:
+            depth -= 1
+            # The attributes have been read at the start, the subtree is not needed
+            element.clear()
+
+
+def parseCell(path):
+    for depth, tag, attrib in iterStart(path):
+        return dict(name=attrib.get("name"))
+    return dict(name=None)
+
+
+def parseCluster(path):
+    members = []
+    for depth, tag, attrib in iterStart(path):
+        if tag == "members" and attrib.get("memberName"):
+            members.append(dict(name=attrib.get("memberName"), node=attrib.get("nodeName"), weight=attrib.get("weight")))
+    return dict(members=members)
+
+
+def parseServerIndex(path):
+    host = None
+    servers = dict()
+    server = None
+    endpoint = None
+    for depth, tag, attrib in iterStart(path):
+        if depth == 1:
+            host = attrib.get("hostName")
+        elif tag == "serverEntries":
+            server = servers.setdefault(attrib.get("serverName"), dict(type=attrib.get("serverType"), endpoints=dict()))
+        elif tag == "specialEndpoints" and server is not None:
+            endpoint = attrib.get("endPointName")
+        elif tag == "endPoint" and server is not None and endpoint:
+            port = attrib.get("port")
+            server["endpoints"][endpoint] = dict(host=attrib.get("host"), port=int(port) if port and port.isdigit() else None)
+    return dict(host=host, servers=servers)
+
+
+def parseServer(path):
+    server = dict(name=None, cluster=None, jvm=None)
+    jvm = None
+    for depth, tag, attrib in iterStart(path):
+        if tag == "Server" and server["name"] is None:
+            server["name"] = attrib.get("name")
+            server["cluster"] = attrib.get("clusterName")
+        elif tag == "jvmEntries" and server["jvm"] is None:
+            jvm = server["jvm"] = dict(
+                initial_heap=attrib.get("initialHeapSize"),
+                maximum_heap=attrib.get("maximumHeapSize"),
+                arguments=attrib.get("genericJvmArguments"),
+                debug=attrib.get("debugMode") == "true",
+                properties=dict()
+            )
+        elif tag == "systemProperties" and jvm is not None:
+            jvm["properties"][attrib.get("name")] = attrib.get("value")
+    return server
+
+
+def parseResources(path):
+    datasources = []
+    provider = None
+    providerDepth = None
+    datasource = None
+    for depth, tag, attrib in iterStart(path):
+        if providerDepth is not None and depth <= providerDepth:
+            # A sibling of the provider ends it
+            provider = providerDepth = datasource = None
+        if tag == "JDBCProvider":
+            provider = attrib.get("name")
+            providerDepth = depth
+        elif tag == "factories":
+            datasource = None
+            if provider is not None and attrib.get(XMI_TYPE, "").endswith(":DataSource"):
+                datasource = dict(
+                    name=attrib.get("name"),
+                    jndi_name=attrib.get("jndiName"),
+                    provider=provider,
+                    auth_alias=attrib.get("authDataAlias"),
+                    properties=dict()
+                )
+                datasources.append(datasource)
+        elif tag == "resourceProperties" and datasource is not None:
+            datasource["properties"][attrib.get("name")] = attrib.get("value")
+    return dict(datasources=datasources)
+
+
+PARSERS = {
+    "cell.xml": parseCell,
+    "cluster.xml": parseCluster,
+    "serverindex.xml": parseServerIndex,
+    "server.xml": parseServer,
+    "resources.xml": parseResources
+}
+
+
+def findConfigDir(wasdir, profile=None):
+    """
+    Finds the config directory of a profile
+    :param wasdir: Path to the WAS installation or profile
+    :param profile: Name of the profile, the first profile with a cell if None
+    :return: path, or None
+    """
+    for directory in getProfileDirs(wasdir):
+        if profile is not None and os.path.basename(directory) != profile:
+            continue
+        config = os.path.join(directory, "config")
+        if os.path.isdir(os.path.join(config, "cells")):
+            return config
+    return None
+
+
+def listDocuments(configDir):
+    """
+    Returns the documents of the repository the index is built from
+    :return: dict of path relative to configDir -> (mtime, size)
+    """
+    documents = dict()
+    cells = os.path.join(configDir, "cells")
+    for directory, dirnames, filenames in os.walk(cells):
+        # Application binaries can be large, and hold no topology
+        if os.path.dirname(directory) == cells:
+            dirnames[:] = [dirname for dirname in dirnames if dirname not in SKIPPED_DIRS]
+        for filename in filenames:
+            if filename in PARSERS:
+                path = os.path.join(directory, filename)
+                stat = os.stat(path)
+                documents[os.path.relpath(path, configDir)] = (stat.st_mtime, stat.st_size)
+    return documents
+
+
+def getCellNames(configDir):
+    """
+    :return: sorted list of the cells in a repository
+    """
+    cells = os.path.join(configDir, "cells")
+    return sorted([name for name in os.listdir(cells) if os.path.isdir(os.path.join(cells, name))])
+
+
+def getRepositoryEpoch(configDir):
+    """
+    Returns a fingerprint of the whole repository, which changes whenever a document is added, removed or saved
+    :param configDir: Path to the config directory of a profile
+    :return: hex string
+    """
+    digest = hashlib.sha256()
+    cells = os.path.join(configDir, "cells")
+    for directory, dirnames, filenames in os.walk(cells):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(directory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            digest.update("{0}\0{1}\0{2}\n".format(os.path.relpath(path, cells), stat.st_mtime, stat.st_size).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def loadIndex(configDir, cacheDir=None):
+    """
+    Returns the index of a repository, parsing only the documents that changed since the cached index
+    :param configDir: Path to the config directory of a profile
+    :param cacheDir: Root cache directory
+    :return: tuple of the index (dict of relative path -> dict with mtime, size and data) and statistics
+    """
+    configDir = os.path.realpath(configDir)
+    path = os.path.join(getCacheDir(cacheDir, "was_config"), "index-{0}.json".format(hashlib.sha256(configDir.encode("utf-8")).hexdigest()[:16]))
+    cached = loadJson(path, dict())
+    if cached.get("version") != INDEX_VERSION or cached.get("root") != configDir:
+        cached = dict()
+    files = cached.get("files", dict())
+
+    documents = listDocuments(configDir)
+    stats = dict(documents=len(documents), parsed=0, reused=0, removed=0)
+    index = dict()
+    for relpath, (mtime, size) in documents.items():
+        entry = files.get(relpath)
+        if entry is not None and entry.get("mtime") == mtime and entry.get("size") == size:
+            index[relpath] = entry
+            stats["reused"] += 1
+            continue
+        try:
+            data = PARSERS[os.path.basename(relpath)](os.path.join(configDir, relpath))
+        except ElementTree.ParseError as e:
+            raise ConfigError("Failed to parse {0}: {1}".format(os.path.join(configDir, relpath), e))
+        index[relpath] = dict(mtime=mtime, size=size, data=data)
+        stats["parsed"] += 1
+    stats["removed"] = len([relpath for relpath in files if relpath not in index])
+
+    if stats["parsed"] or stats["removed"] or not cached:
+        saveJson(path, dict(version=INDEX_VERSION, root=configDir, files=index))
+    return index, stats
+
+
+def getScope(parts):
+    """
+    Returns the scope of a resources.xml from its path below the cells directory
+    :param parts: list of path components, starting with cells
+    """
+    if len(parts) >= 7 and parts[2] == "nodes" and parts[4] == "servers":
+        return dict(scope="server", node=parts[3], server=parts[5])
+    if len(parts) >= 5 and parts[2] == "nodes":
+        return dict(scope="node", node=parts[3])
+    if len(parts) >= 5 and parts[2] == "clusters":
+        return dict(scope="cluster", cluster=parts[3])
+    return dict(scope="cell")
+
+
+def buildModel(index):
+    """
+    Combines the documents of the index into one model of the cell
+    :return: dict with the keys cell, nodes, clusters and datasources
+    """
+    model = dict(cell=None, nodes=dict(), clusters=dict(), datasources=[])
+    for relpath in sorted(index):
+        parts = relpath.split(os.sep)
+        filename = parts[-1]
+        data = index[relpath]["data"]
+        if filename == "cell.xml" and len(parts) == 3:
+            model["cell"] = data["name"]
+        elif filename == "cluster.xml" and len(parts) == 5:
+            model["clusters"][parts[3]] = data
+        elif filename == "serverindex.xml" and len(parts) == 5:
+            node = model["nodes"].setdefault(parts[3], dict(host=None, servers=dict()))
+            node["host"] = data["host"]
+            for name, server in data["servers"].items():
+                node["servers"].setdefault(name, dict(cluster=None, jvm=None)).update(type=server["type"], endpoints=server["endpoints"])
+        elif filename == "server.xml" and len(parts) == 7:
+            node = model["nodes"].setdefault(parts[3], dict(host=None, servers=dict()))
+            server = node["servers"].setdefault(parts[5], dict(type=None, endpoints=dict()))
+            server.update(cluster=data["cluster"], jvm=data["jvm"])
+        elif filename == "resources.xml":
+            scope = getScope(parts)
+            for datasource in data["datasources"]:
+                entry = dict(datasource)
+                entry.update(scope)
+                model["datasources"].append(entry)
+    return model
+
+
+def readConfig(wasdir, profile=None, cacheDir=None):
+    """
+    Reads the configuration repository of a profile
+    :param wasdir: Path to the WAS installation or profile
+    :param profile: Name of the profile
+    :return: tuple of the model and statistics (documents, parsed, reused, removed, seconds)
+    """
+    started = time.time()
+    configDir = findConfigDir(wasdir, profile)
+    if configDir is None:
+        raise ConfigError("No configuration repository found below {0}".format(wasdir))
+    index, stats = loadIndex(configDir, cacheDir)
+    model = buildModel(index)
+    stats["seconds"] = round(time.time() - started, 4)
+    stats["config_dir"] = configDir
+    return model, stats
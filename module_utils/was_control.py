@@ -0,0 +1,255 @@
+#
+# Starts and stops many WebSphere application servers from one wsadmin run.
+#
+# A Jython script resolves the servers (a list of name/node pairs or the
+# members of a cluster), checks which are running, and issues
+# AdminControl.startServer()/stopServer() only where the state differs (the
+# action status only reports the state). startServer() blocks until the
+# server is up, so the calls run in Jython threads: up to parallelism servers
+# at a time, and at most nodeParallelism on the same node.
+#
+# The script is the same for every run. It reads the request from a UTF-8
+# file, so names outside of ASCII arrive intact:
+#
+#   action <TAB> parallelism <TAB> nodeParallelism <TAB> cluster
+#   server <TAB> node
+#
+# and writes one line per server to a result file, so large clusters are not
+# cut off by the tail of stdout:
+#
+#   queued <TAB> server <TAB> node
+#   result <TAB> server <TAB> node <TAB> running before <TAB> running after <TAB> seconds <TAB> error <TAB> waited
+#
+# running is 1 or 0, or -1 if it could not be determined. waited is the
+# number of seconds the server was queued for a free slot. A queued server
+# without a result failed.
+#
+
+import codecs
+import hashlib
+import os
+import tempfile
+
+from ansible.module_utils.websphere_cache import getCacheDir
+from ansible.module_utils.wsadmin_session import DEFAULT_IDLE_TIMEOUT, runWsadmin
+
+# Runs in wsadmin, so it must stay compatible with Jython 2.1
+SCRIPT = """
+import codecs
+import sys
+import threading
+import time
+
+lines = codecs.open(sys.argv[0], "r", "utf-8").read().splitlines()
+action, parallelism, nodeParallelism, cluster = lines[0].split("\\t")
+parallelism = int(parallelism)
+nodeParallelism = int(nodeParallelism)
+servers = [line.split("\\t") for line in lines[1:] if line]
+
+out = codecs.open(sys.argv[1], "w", "utf-8")
+lock = threading.Condition()
+
+def emit(fields):
+    lock.acquire()
+    try:
+        out.write("\\t".join(fields) + "\\n")
+        out.flush()
+    finally:
+        lock.release()
+
+def isRunning(name, node):
+    if AdminControl.completeObjectName("type=Server,node=%s,process=%s,*" % (node, name)):
+        return 1
+    return 0
+
+def errorText():
+    return str(sys.exc_info()[1]).replace("\\t", " ").replace("\\r", " ").replace("\\n", " ")
+
+if cluster:
+    clusterId = AdminConfig.getid("/ServerCluster:%s/" % cluster)
+    if not clusterId:
+        emit(["result", "", "", "-1", "-1", "0", "Cluster %s does not exist" % cluster, "0"])
+        out.close()
+        sys.exit(1)
+    for member in AdminConfig.list("ClusterMember", clusterId).splitlines():
+        if member.strip():
+            servers.append([AdminConfig.showAttribute(member, "memberName"), AdminConfig.showAttribute(member, "nodeName")])
+
+for server in servers:
+    emit(["queued", server[0], server[1]])
+
+active = {}
+total = [0]
+
+def control(name, node, waited):
+    started = time.time()
+    before = -1
+    after = -1
+    error = ""
+    try:
+        try:
+            before = isRunning(name, node)
+            if action == "start" and not before:
+                AdminControl.startServer(name, node)
+            elif action == "stop" and before:
+                AdminControl.stopServer(name, node)
+            after = isRunning(name, node)
+        except:
+            error = errorText()
+        emit(["result", name, node, str(before), str(after), "%.3f" % (time.time() - started), error, "%.3f" % waited])
+    finally:
+        lock.acquire()
+        try:
+            active[node] = active[node] - 1
+            total[0] = total[0] - 1
+            lock.notifyAll()
+        finally:
+            lock.release()
+
+queued = time.time()
+pending = servers[:]
+lock.acquire()
+try:
+    while pending or total[0]:
+        # The first queued server whose node has a free slot
+        chosen = None
+        if total[0] < parallelism:
+            for server in pending:
+                if active.get(server[1], 0) < nodeParallelism:
+                    chosen = server
+                    break
+        if chosen is None:
+            lock.wait()
+            continue
+        pending.remove(chosen)
+        active[chosen[1]] = active.get(chosen[1], 0) + 1
+        total[0] = total[0] + 1
+        threading.Thread(target=control, args=(chosen[0], chosen[1], time.time() - queued)).start()
+finally:
+    lock.release()
+out.close()
+"""
+
+
+def buildControlRequest(action, servers=None, cluster=None, parallelism=1, nodeParallelism=1):
+    """
+    Generates the request read by the control script
+    :param action: start, stop or status
+    :param servers: list of dicts with the keys name and node
+    :param cluster: Name of a cluster whose members are added to servers
+    :param parallelism: Number of servers started or stopped at the same time
+    :param nodeParallelism: Number of servers started or stopped at the same time on one node
+    :return: The request as a string
+    """
+    lines = ["\t".join([action, str(max(1, parallelism)), str(max(1, nodeParallelism)), cluster or ""])]
+    for server in servers or []:
+        lines.append("\t".join([server["name"], server["node"]]))
+    return "\n".join(lines) + "\n"
+
+
+def getMissingResult(name, node):
+    """
+    :return: the result of a server the control script did not report, which fails
+    """
+    return dict(
+        name=name,
+        node=node,
+        running_before=-1,
+        running=-1,
+        changed=False,
+        seconds=0.0,
+        waited=0.0,
+        error="No result from the control script"
+    )
+
+
+def readControlResults(path, action):
+    """
+    Reads the per server results written by the control script
+    :return: list of dicts with the keys name, node, running_before, running, changed, seconds, waited and error
+    """
+    wanted = dict(start=1, stop=0).get(action)
+    queued = []
+    results = []
+    try:
+        with codecs.open(path, "r", "utf-8") as f:
+            lines = f.read().splitlines()
+    except (IOError, OSError):
+        lines = []
+    for line in lines:
+        fields = line.rstrip("\r").split("\t")
+        if fields[0] == "queued" and len(fields) > 2:
+            queued.append((fields[1], fields[2]))
+        if fields[0] != "result" or len(fields) < 7:
+            continue
+        before, after = int(fields[3]), int(fields[4])
+        error = fields[6] or None
+        if error is None and wanted is not None and after != wanted:
+            error = "Server is {0} after {1}".format("running" if after == 1 else "not running", action)
+        results.append(dict(
+            name=fields[1],
+            node=fields[2],
+            running_before=before,
+            running=after,
+            changed=wanted is not None and before != wanted and after == wanted,
+            seconds=float(fields[5]),
+            waited=float(fields[7]) if len(fields) > 7 else 0.0,
+            error=error
+        ))
+
+    # wsadmin ended before these servers reported back
+    done = set((result["name"], result["node"]) for result in results)
+    for name, node in queued:
+        if (name, node) not in done:
+            results.append(getMissingResult(name, node))
+    return results
+
+
+def controlServers(wasdir, action, servers=None, cluster=None, connection=None, session=True, cacheDir=None,
+                   idleTimeout=DEFAULT_IDLE_TIMEOUT, logDir=None, name="was_server", parallelism=1, nodeParallelism=1):
+    """
+    Starts or stops servers from one wsadmin run
+    :param wasdir: Path to the WAS installation or profile
+    :param action: start, stop or status
+    :param servers: list of dicts with the keys name and node
+    :param cluster: Name of a cluster whose members are started or stopped as well
+    :param parallelism: Number of servers started or stopped at the same time
+    :param nodeParallelism: Number of servers started or stopped at the same time on one node
+    :return: tuple of returncode, list of per server results, stdout and stderr
+    """
+    directory = getCacheDir(cacheDir, "was_server")
+    path = os.path.join(directory, "control-{0}.py".format(hashlib.sha256(SCRIPT.encode("utf-8")).hexdigest()[:16]))
+    if not os.path.exists(path):
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            f.write(SCRIPT)
+        os.rename(tmp, path)
+
+    fd, request = tempfile.mkstemp(dir=directory, prefix="control-", suffix=".request")
+    with os.fdopen(fd, "wb") as f:
+        f.write(buildControlRequest(action, servers, cluster, parallelism, nodeParallelism).encode("utf-8"))
+    fd, output = tempfile.mkstemp(dir=directory, prefix="control-", suffix=".txt")
+    os.close(fd)
+    try:
+        returncode, stdout_value, stderr_value, used = runWsadmin(
+            wasdir,
+            script=path,
+            args=[request, output],
+            connection=connection,
+            session=session,
+            cacheDir=cacheDir,
+            idleTimeout=idleTimeout,
+            logDir=logDir,
+            name=name
+        )
+        results = readControlResults(output, action)
+    finally:
+        os.remove(request)
+        os.remove(output)
+
+    # Servers the script was asked for, but never queued
+    done = set((result["name"], result["node"]) for result in results)
+    for server in servers or []:
+        if (server["name"], server["node"]) not in done:
+            results.append(getMissingResult(server["name"], server["node"]))
+    return returncode, results, stdout_value, stderr_value
@@ -0,0 +1,372 @@
+#
+# Provisions profiles from pre-built images instead of profile templates.
+#
+# Creating a profile with manageprofiles.sh -create runs the template engine
+# for several minutes. An image is a profile that was created once, either
+# archived with manageprofiles.sh -backupProfile (a zip) or packed into a
+# tarball. Restoring it is a copy, after which only the host, node and cell
+# names are changed with wsadmin in local mode.
+#
+# Images are copied into a cache on the host, keyed by the WAS version of the
+# installation and the profile template, so an image is never restored into
+# an installation of another version:
+#
+#   /var/cache/ansible-websphere/profile_images/<version>/<template>/sources.json
+#   /var/cache/ansible-websphere/profile_images/<version>/<template>/<sha256>.zip
+#
+# sources.json remembers the digest of every source (by size and mtime for
+# files, by ETag/Last-Modified for URLs), so a known image is neither copied
+# nor downloaded again.
+#
+
+import hashlib
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import time
+import xml.etree.ElementTree as ElementTree
+
+from ansible.module_utils.websphere_archive import CHUNK_SIZE, ArchiveError, download, hashFile, parseChecksum
+from ansible.module_utils.websphere_cache import getCacheDir, loadJson, saveJson
+from ansible.module_utils.websphere_command import getLogFiles, runCommand
+from ansible.module_utils.ibmim_repository import isRemote
+from ansible.module_utils.was_config import parseServerIndex
+from ansible.module_utils.was_profiles import ProfileRegistryError, getProfiles, registerProfile, unregisterProfile
+from ansible.module_utils.was_topology import readSetupCmdLine
+from ansible.module_utils.wsadmin_session import runWsadmin
+
+TARBALL_SUFFIXES = [".tar.gz", ".tgz", ".tar"]
+
+# Runs in wsadmin -conntype NONE, so it must stay compatible with Jython 2.1
+SCRIPT = """
+import sys
+
+oldCell, newCell, oldNode, newNode, oldHost, newHost = sys.argv[0:6]
+
+if newHost != oldHost:
+    AdminTask.changeHostName("[-nodeName %s -hostName %s]" % (oldNode, newHost))
+if newNode != oldNode:
+    AdminTask.renameNode("[-nodeName %s -newNodeName %s]" % (oldNode, newNode))
+if newCell != oldCell:
+    AdminTask.renameCell("[-newCellName %s]" % newCell)
+AdminConfig.save()
+"""
+
+
+class ImageError(Exception):
+
+    def __init__(self, msg, stdout="", stderr=""):
+        Exception.__init__(self, msg)
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+def getWasVersion(wasdir):
+    """
+    Reads the version of a WAS installation from properties/version/WAS.product
+    :return: version string, or None if not found
+    """
+    try:
+        root = ElementTree.parse(os.path.join(wasdir, "properties", "version", "WAS.product")).getroot()
+    except (IOError, OSError, ElementTree.ParseError):
+        return None
+    version = root.find("version")
+    if version is None or not (version.text or "").strip():
+        return None
+    return version.text.strip()
+
+
+def getImageSuffix(src):
+    """
+    :return: the suffix of an image, .zip for a -backupProfile archive or one of TARBALL_SUFFIXES
+    """
+    path = src.split("?", 1)[0].lower()
+    for suffix in [".zip"] + TARBALL_SUFFIXES:
+        if path.endswith(suffix):
+            return suffix
+    raise ImageError("{0} is neither a zip (manageprofiles.sh -backupProfile) nor a tarball".format(src))
+
+
+def copyFile(src, path, algorithms):
+    """
+    Copies a file and hashes it on the way
+    :return: dict of algorithm -> hex digest
+    """
+    digests = dict((algorithm, hashlib.new(algorithm)) for algorithm in algorithms)
+    with open(src, "rb") as source:
+        with open(path, "wb") as f:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                f.write(chunk)
+                for digest in digests.values():
+                    digest.update(chunk)
+    return dict((algorithm, digest.hexdigest()) for algorithm, digest in digests.items())
+
+
+def fetchImage(src, version, template, cacheDir=None, checksum=None, timeout=60, validateCerts=True):
+    """
+    Returns the cached copy of an image, copying or downloading it into the cache first if needed
+    :param src: Path or URL of the image
+    :param version: WAS version of the installation the image is restored into
+    :param template: Name of the profile template of the image
+    :param checksum: Expected checksum as <algorithm>:<hex>, not checked if None
+    :return: dict with the keys path, digest and reused
+    """
+    suffix = getImageSuffix(src)
+    try:
+        algorithm, expected = parseChecksum(checksum)
+    except ArchiveError as e:
+        raise ImageError(str(e))
+    directory = getCacheDir(cacheDir, os.path.join("profile_images", version, template))
+    index = os.path.join(directory, "sources.json")
+    sources = loadJson(index, {})
+    entry = sources.get(src)
+    if entry and not os.path.exists(os.path.join(directory, entry["digest"] + suffix)):
+        entry = None
+
+    # A SHA-256 checksum is the name of the cached copy. Otherwise an unchanged file is looked up in the index
+    digest = None
+    if algorithm == "sha256":
+        digest = expected
+    elif entry and not isRemote(src) and os.path.isfile(src) and (algorithm is None or entry.get(algorithm) == expected):
+        stat = os.stat(src)
+        if entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+            digest = entry["digest"]
+    if digest and os.path.exists(os.path.join(directory, digest + suffix)):
+        return dict(path=os.path.join(directory, digest + suffix), digest=digest, reused=True)
+
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    os.close(fd)
+    try:
+        algorithms = set(["sha256"] + ([algorithm] if algorithm else []))
+        if isRemote(src):
+            try:
+                validators, digests = download(src, tmp, entry, algorithms, timeout, validateCerts)
+            except ArchiveError as e:
+                raise ImageError(str(e))
+            if validators is None:
+                cached = os.path.join(directory, entry["digest"] + suffix)
+                if algorithm is not None and algorithm not in entry:
+                    # Cached before without this checksum
+                    entry.update(hashFile(cached, [algorithm]))
+                    saveJson(index, sources)
+                if algorithm is None or entry.get(algorithm) == expected:
+                    return dict(path=cached, digest=entry["digest"], reused=True)
+                raise ImageError("Checksum of {0} does not match, expected {1} but got {2}".format(src, expected, entry[algorithm]))
+        else:
+            if not os.path.isfile(src):
+                raise ImageError("{0} not found".format(src))
+            stat = os.stat(src)
+            validators = dict(size=stat.st_size, mtime=stat.st_mtime)
+            digests = copyFile(src, tmp, algorithms)
+
+        if algorithm and digests[algorithm] != expected:
+            raise ImageError("Checksum of {0} does not match, expected {1} but got {2}".format(src, expected, digests[algorithm]))
+        digest = digests["sha256"]
+        path = os.path.join(directory, digest + suffix)
+        reused = os.path.exists(path)
+        if not reused:
+            os.rename(tmp, path)
+
+        entry = dict(validators, digest=digest)
+        entry.update(digests)
+        sources[src] = entry
+        saveJson(index, sources)
+        return dict(path=path, digest=digest, reused=reused)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def extractTarball(path, dest):
+    """
+    Extracts a profile tarball into dest. Members outside of dest are refused
+    """
+    try:
+        archive = tarfile.open(path)
+    except (tarfile.TarError, IOError, OSError) as e:
+        raise ImageError("{0} is not a valid tarball: {1}".format(path, e))
+    try:
+        root = os.path.realpath(dest)
+        for member in archive.getmembers():
+            target = os.path.realpath(os.path.join(dest, member.name))
+            if target != root and not target.startswith(root + os.sep):
+                raise ImageError("{0} would be extracted outside of {1}".format(member.name, dest))
+            if member.issym() or member.islnk():
+                link = os.path.realpath(os.path.join(os.path.dirname(target), member.linkname))
+                if link != root and not link.startswith(root + os.sep):
+                    raise ImageError("{0} links outside of {1}".format(member.name, dest))
+        archive.extractall(dest)
+    finally:
+        archive.close()
+
+
+def readInstallRoot(profile):
+    """
+    Reads the profile directory a profile was created in from bin/setupCmdLine.sh
+    :return: path, or None if not found
+    """
+    try:
+        with open(os.path.join(profile, "bin", "setupCmdLine.sh")) as f:
+            for line in f:
+                match = re.match("^\\s*USER_INSTALL_ROOT=(\\S+)", line)
+                if match:
+                    return match.group(1).strip("\"'")
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def discardProfile(wasdir, name, path, logName=None, logDir=None):
+    """
+    Removes a half provisioned profile, so that provisioning can be retried
+    """
+    returncode, stdout_value, stderr_value = runCommand(
+        "{0}/bin/manageprofiles.sh -delete -profileName {1}".format(wasdir, name),
+        *getLogFiles(logDir, logName or name)
+    )
+    if returncode != 0:
+        # Otherwise the registry still lists the profile and the retry finds it already there
+        try:
+            unregisterProfile(wasdir, name)
+        except (ProfileRegistryError, IOError, OSError) as e:
+            raise ImageError("Profile {0} could not be removed: {1}".format(name, e), stdout_value, stderr_value)
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def restoreImage(wasdir, name, image, template, cacheDir=None, logName=None, logDir=None):
+    """
+    Restores a profile from an image
+    :param image: Path to the cached image
+    :return: tuple of the profile directory, stdout and stderr
+    """
+    before = getProfiles(wasdir, cacheDir)
+    stdout_value = stderr_value = ""
+    if image.endswith(".zip"):
+        # The profile comes back with the name and path it was backed up with
+        returncode, stdout_value, stderr_value = runCommand(
+            "{0}/bin/manageprofiles.sh -restoreProfile -backupFile {1}".format(wasdir, image),
+            *getLogFiles(logDir, logName or name)
+        )
+        if returncode != 0:
+            raise ImageError("Restoring {0} failed".format(image), stdout_value, stderr_value)
+    else:
+        path = os.path.join(wasdir, "profiles", name)
+        if os.path.exists(path):
+            raise ImageError("{0} already exists".format(path))
+        try:
+            os.makedirs(path)
+            extractTarball(image, path)
+            # The scripts and the configuration of the profile hold the directory it was created in
+            root = readInstallRoot(path)
+            if root is None or os.path.normpath(root) != os.path.normpath(path):
+                raise ImageError("the image was created in {0}, not in {1}".format(root or "an unknown directory", path))
+            registerProfile(wasdir, name, path, os.path.join(wasdir, "profileTemplates", template))
+        except (ImageError, ProfileRegistryError, IOError, OSError) as e:
+            shutil.rmtree(path, ignore_errors=True)
+            raise ImageError("Restoring {0} failed: {1}".format(image, e))
+
+    profiles = getProfiles(wasdir, cacheDir)
+    if name not in profiles:
+        restored = [profile for profile in profiles if profile not in before]
+        for profile in restored:
+            discardProfile(wasdir, profile, profiles[profile]["path"], logName, logDir)
+        raise ImageError("{0} does not hold profile {1} but {2}".format(image, name, ", ".join(restored) or "no profile"), stdout_value, stderr_value)
+    return profiles[name]["path"], stdout_value, stderr_value
+
+
+def readNames(profile):
+    """
+    Reads the cell, node and host name of a profile
+    :return: tuple of cell, node and host, None where not found
+    """
+    cell, node = readSetupCmdLine(profile)
+    host = None
+    if cell and node:
+        try:
+            host = parseServerIndex(os.path.join(profile, "config", "cells", cell, "nodes", node, "serverindex.xml"))["host"]
+        except (IOError, OSError, ElementTree.ParseError):
+            pass
+    return cell, node, host
+
+
+def renameProfile(profile, cell=None, node=None, host=None, cacheDir=None, logName=None, logDir=None):
+    """
+    Changes the host, node and cell name of a restored profile with wsadmin in local mode
+    :param profile: Path to the profile
+    :return: tuple of a dict of what was renamed (key -> dict with from and to), stdout and stderr
+    """
+    current = dict(zip(["cell", "node", "host"], readNames(profile)))
+    if not current["cell"] or not current["node"]:
+        raise ImageError("Cell and node of {0} not found in bin/setupCmdLine.sh".format(profile))
+    wanted = dict(cell=cell or current["cell"], node=node or current["node"], host=host or current["host"])
+    renamed = dict((key, {"from": current[key], "to": wanted[key]}) for key in ["host", "node", "cell"] if wanted[key] and wanted[key] != current[key])
+    if not renamed:
+        return renamed, "", ""
+
+    directory = getCacheDir(cacheDir, "profile_images")
+    script = os.path.join(directory, "rename-{0}.py".format(hashlib.sha256(SCRIPT.encode("utf-8")).hexdigest()[:16]))
+    if not os.path.exists(script):
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            f.write(SCRIPT)
+        os.rename(tmp, script)
+
+    args = [current["cell"], wanted["cell"], current["node"], wanted["node"], current["host"] or "-", wanted["host"] or "-"]
+    returncode, stdout_value, stderr_value, used = runWsadmin(
+        profile,
+        script=script,
+        args=args,
+        connection=dict(conntype="NONE"),
+        session=False,
+        logDir=logDir,
+        name=logName or "profile_images"
+    )
+    if returncode != 0:
+        raise ImageError("Renaming {0} failed".format(", ".join(sorted(renamed))), stdout_value, stderr_value)
+    return renamed, stdout_value, stderr_value
+
+
+def provisionFromImage(wasdir, name, template, src, cell=None, node=None, host=None, checksum=None,
+                       cacheDir=None, logName=None, logDir=None, timeout=60, validateCerts=True):
+    """
+    Creates a profile from an image and gives it its own host, node and cell name
+    :param wasdir: Path to the WAS installation
+    :param name: Profile Name
+    :param template: Name of the profile template of the image (management, managed, ...)
+    :param src: Path or URL of the image
+    :return: dict with the keys path (the cached image), digest, version, template, reused, profile (the profile directory),
+        renamed, seconds, stdout and stderr
+    """
+    version = getWasVersion(wasdir)
+    if version is None:
+        raise ImageError("Version of {0} not found in properties/version/WAS.product".format(wasdir))
+
+    started = time.time()
+    image = fetchImage(src, version, template, cacheDir, checksum, timeout, validateCerts)
+    image.update(version=version, template=template)
+    fetched = time.time()
+
+    profile, stdout_value, stderr_value = restoreImage(wasdir, name, image["path"], template, cacheDir, logName, logDir)
+    restored = time.time()
+
+    try:
+        renamed, stdout_rename, stderr_rename = renameProfile(profile, cell, node, host, cacheDir, logName, logDir)
+    except ImageError:
+        # A profile with the names of the image would clash with the node it was built on
+        discardProfile(wasdir, name, profile, logName, logDir)
+        raise
+
+    image.update(
+        profile=profile,
+        renamed=renamed,
+        seconds=dict(
+            fetch=round(fetched - started, 3),
+            restore=round(restored - fetched, 3),
+            rename=round(time.time() - restored, 3)
+        ),
+        stdout="\n".join([output for output in [stdout_value, stdout_rename] if output]),
+        stderr="\n".join([output for output in [stderr_value, stderr_rename] if output])
+    )
+    return image
@@ -0,0 +1,161 @@
+#
+# Waits for messages in the SystemOut.log of WebSphere application servers.
+#
+# startServer returns before the applications of a server are ready. The log
+# of every server is read incrementally from the byte offset it had before
+# the server was started, until the ready messages show up:
+#
+#   [10/16/16 9:41:17:342 CEST] 00000001 WsServerImpl  A   WSVR0001I: Server server1 open for e-business
+#
+# The log directories are watched with inotify where available, so a message
+# is seen as soon as it is written. Otherwise the logs are polled.
+#
+
+import glob
+import os
+import select
+import time
+
+from ansible.module_utils.was_process import getProfileDirs
+
+# Logged by a server when it is open for e-business
+READY_MESSAGE = "WSVR0001I"
+
+# Seconds between two reads of the logs without inotify
+POLL_INTERVAL = 0.5
+
+# inotify events of a log being written, created or rotated
+IN_MODIFY = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+
+def getLogPosition(path):
+    """
+    Returns the inode and the size of a log file
+    :return: tuple of inode and size, (None, 0) if the file does not exist
+    """
+    try:
+        stat = os.stat(path)
+        return stat.st_ino, stat.st_size
+    except OSError:
+        return None, 0
+
+
+def getLogPositions(wasdir):
+    """
+    Returns the current position of the SystemOut.log of every server below wasdir
+    :param wasdir: Path to the WAS installation or profile
+    :return: dict of log directory -> (inode, size)
+    """
+    positions = {}
+    for profile in getProfileDirs(wasdir):
+        for logDir in glob.glob(os.path.join(profile, "logs", "*")):
+            if os.path.isdir(logDir):
+                positions[logDir] = getLogPosition(os.path.join(logDir, "SystemOut.log"))
+    return positions
+
+
+class LogTail():
+    """
+    Reads the lines appended to a log file since a position. Starts over if the log is rotated
+    """
+
+    def __init__(self, path, position):
+        self.path = path
+        self.inode, self.offset = position
+        self.partial = b""
+
+    def read(self):
+        """
+        :return: list of new complete lines
+        """
+        inode, size = getLogPosition(self.path)
+        if inode is None:
+            return []
+        if inode != self.inode or size < self.offset:
+            self.inode, self.offset, self.partial = inode, 0, b""
+        if size == self.offset:
+            return []
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        self.offset += len(data)
+        lines = (self.partial + data).split(b"\n")
+        self.partial = lines.pop()
+        return [line.decode("utf-8", "replace") for line in lines]
+
+
+class LogNotifier():
+    """
+    Blocks until one of a set of directories changes, or a timeout passes
+    """
+
+    def __init__(self, directories):
+        self.fd = None
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK)
+            if fd < 0:
+                return
+            for directory in directories:
+                if libc.inotify_add_watch(fd, directory.encode("utf-8"), IN_MODIFY | IN_MOVED_TO | IN_CREATE) < 0:
+                    os.close(fd)
+                    return
+            self.fd = fd
+        except (OSError, AttributeError):
+            self.fd = None
+
+    def wait(self, timeout):
+        if self.fd is None:
+            time.sleep(min(timeout, POLL_INTERVAL))
+            return
+        readable = select.select([self.fd], [], [], timeout)[0]
+        if readable:
+            try:
+                os.read(self.fd, 65536)
+            except OSError:
+                pass
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def waitForMessages(positions, messages, timeout, started=None):
+    """
+    Waits until every message has appeared in the SystemOut.log of every log directory
+    :param positions: dict of log directory -> (inode, size) where reading starts
+    :param messages: list of message IDs or texts
+    :param timeout: Seconds to wait
+    :param started: Time the readiness is measured from, now if None
+    :return: dict of log directory -> seconds from started until the last message appeared, None if it did not
+    """
+    started = started or time.time()
+    deadline = time.time() + timeout
+    tails = dict((logDir, LogTail(os.path.join(logDir, "SystemOut.log"), position)) for logDir, position in positions.items())
+    pending = dict((logDir, set(messages or [READY_MESSAGE])) for logDir in positions)
+    ready = dict((logDir, None) for logDir in positions)
+
+    notifier = LogNotifier(list(positions))
+    try:
+        while True:
+            for logDir in list(pending):
+                for line in tails[logDir].read():
+                    for message in list(pending[logDir]):
+                        if message in line:
+                            pending[logDir].discard(message)
+                if not pending[logDir]:
+                    ready[logDir] = time.time() - started
+                    del pending[logDir]
+            remaining = deadline - time.time()
+            if not pending or remaining <= 0:
+                break
+            # Events can be missed between a read and the wait, so never block for long
+            notifier.wait(min(remaining, 1.0))
+    finally:
+        notifier.close()
+    return ready
@@ -0,0 +1,97 @@
+#
+# Finds out whether WebSphere application servers are running without
+# starting a JVM.
+#
+# A running server keeps its process ID in the logs directory of its profile:
+#
+#   /opt/IBM/WebSphere/AppServer/profiles/AppSrv01/logs/server1/server1.pid
+#
+# The process must still exist and its command line must end with the server
+# name, otherwise the file is stale. Servers without a logs directory on this
+# host (servers on other nodes) can not be probed.
+#
+
+import glob
+import os
+
+
+def getProfileDirs(wasdir):
+    """
+    Returns the profile directories below a WAS installation. wasdir may also be a profile
+    :param wasdir: Path to the WAS installation or profile
+    :return: list of paths
+    """
+    if os.path.isdir(os.path.join(wasdir, "config", "cells")):
+        return [wasdir]
+    return sorted(glob.glob(os.path.join(wasdir, "profiles", "*")))
+
+
+def findServerLogDir(wasdir, name, node=None):
+    """
+    Finds the logs directory of a server on this host
+    :param wasdir: Path to the WAS installation or profile
+    :param name: Name of the server
+    :param node: Name of the node of the server. Any node if None
+    :return: path, or None if the server has no logs directory on this host
+    """
+    for profile in getProfileDirs(wasdir):
+        logDir = os.path.join(profile, "logs", name)
+        if not os.path.isdir(logDir):
+            continue
+        if node is None or glob.glob(os.path.join(profile, "config", "cells", "*", "nodes", node, "servers", name)):
+            return logDir
+    return None
+
+
+def readCmdline(pid):
+    """
+    Returns the command line of a process
+    :return: list of arguments, or None if there is no such process
+    """
+    try:
+        with open("/proc/{0}/cmdline".format(pid), "rb") as f:
+            return f.read().decode("utf-8", "replace").split("\0")
+    except (IOError, OSError):
+        return None
+
+
+def readPid(logDir, name):
+    """
+    Reads the PID file of a server
+    :param logDir: logs directory of the server
+    :return: process ID, or None if there is no valid PID file
+    """
+    try:
+        with open(os.path.join(logDir, "{0}.pid".format(name))) as f:
+            return int(f.read().strip())
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def probeServer(wasdir, name, node=None):
+    """
+    Checks if a server is running from its PID file and /proc
+    :param wasdir: Path to the WAS installation or profile
+    :param name: Name of the server
+    :param node: Name of the node of the server
+    :return: True if running, False if stopped, None if this can not be told without wsadmin
+    """
+    if not os.path.isdir("/proc/self"):
+        return None
+    logDir = findServerLogDir(wasdir, name, node)
+    if logDir is None:
+        return None
+
+    # The PID file is removed when the server stops cleanly
+    if not os.path.exists(os.path.join(logDir, "{0}.pid".format(name))):
+        return False
+    pid = readPid(logDir, name)
+    if pid is None:
+        return None
+
+    cmdline = readCmdline(pid)
+    if cmdline is None:
+        return False
+    # The server name is the last argument of the java command line
+    arguments = [argument for argument in cmdline if argument]
+    return len(arguments) > 0 and arguments[-1] == name
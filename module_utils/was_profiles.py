@@ -0,0 +1,180 @@
+#
+# Reads the profile registry of a WebSphere installation.
+#
+# manageprofiles.sh keeps the profiles it created in
+# <wasdir>/properties/profileRegistry.xml:
+#
+#   <profiles>
+#     <profile isAReservationTicket="false" isDefault="true" name="Dmgr01"
+#              path="/opt/IBM/WebSphere/AppServer/profiles/Dmgr01"
+#              template="/opt/IBM/WebSphere/AppServer/profileTemplates/management">
+#       <augmentor template="..."/>
+#     </profile>
+#   </profiles>
+#
+# Reading it directly answers "does profile X exist" without starting the
+# manageprofiles.sh JVM. The parsed registry is cached with its mtime and
+# size, so it is only parsed again after manageprofiles.sh changed it.
+#
+# A profile that was copied in place from a tarball is added to the registry
+# the same way manageprofiles.sh -restoreProfile does, so that the other
+# WebSphere tools (and manageprofiles.sh -delete) know about it. This includes
+# its entry in <wasdir>/properties/fsdb/<name>.sh, where the scripts in
+# <wasdir>/bin look up the profile given with -profileName:
+#
+#   #!/bin/sh
+#   export WAS_USER_SCRIPT=/opt/IBM/WebSphere/AppServer/profiles/AppSrv01/bin/setupCmdLine.sh
+#
+
+import hashlib
+import os
+import tempfile
+import xml.etree.ElementTree as ElementTree
+
+from ansible.module_utils.websphere_cache import getCacheDir, loadJson, saveJson
+
+
+class ProfileRegistryError(Exception):
+    pass
+
+
+def getRegistryPath(wasdir):
+    return os.path.join(wasdir, "properties", "profileRegistry.xml")
+
+
+def getFsdbPath(wasdir, name):
+    return os.path.join(wasdir, "properties", "fsdb", "{0}.sh".format(name))
+
+
+def parseProfileRegistry(path):
+    """
+    Parses a profile registry
+    :return: dict of profile name -> dict with the keys path, template, default and augmentors
+    """
+    profiles = dict()
+    try:
+        root = ElementTree.parse(path).getroot()
+    except ElementTree.ParseError as e:
+        raise ProfileRegistryError("Failed to parse {0}: {1}".format(path, e))
+    for element in root.iter("profile"):
+        # A reservation ticket is a name held for a profile that does not exist yet
+        if element.get("isAReservationTicket") == "true" or not element.get("name"):
+            continue
+        profiles[element.get("name")] = dict(
+            path=element.get("path"),
+            template=element.get("template"),
+            default=element.get("isDefault") == "true",
+            augmentors=[augmentor.get("template") for augmentor in element.iter("augmentor")]
+        )
+    return profiles
+
+
+def getProfiles(wasdir, cacheDir=None):
+    """
+    Returns the profiles of a WAS installation
+    :param wasdir: Path to the WAS installation
+    :param cacheDir: Root cache directory
+    :return: dict of profile name -> dict with the keys path, template, default and augmentors
+    """
+    path = os.path.realpath(getRegistryPath(wasdir))
+    try:
+        stat = os.stat(path)
+    except OSError:
+        # No profile has been created yet
+        return dict()
+
+    cachePath = os.path.join(getCacheDir(cacheDir, "was_profiles"), "registry-{0}.json".format(hashlib.sha256(path.encode("utf-8")).hexdigest()[:16]))
+    cached = loadJson(cachePath, dict())
+    if cached.get("path") == path and cached.get("mtime") == stat.st_mtime and cached.get("size") == stat.st_size:
+        return cached["profiles"]
+
+    profiles = parseProfileRegistry(path)
+    saveJson(cachePath, dict(path=path, mtime=stat.st_mtime, size=stat.st_size, profiles=profiles))
+    return profiles
+
+
+def readRegistry(registry):
+    """
+    :return: ElementTree of the profile registry, an empty one if it does not exist yet
+    """
+    if not os.path.exists(registry):
+        return ElementTree.ElementTree(ElementTree.Element("profiles"))
+    try:
+        return ElementTree.parse(registry)
+    except ElementTree.ParseError as e:
+        raise ProfileRegistryError("Failed to parse {0}: {1}".format(registry, e))
+
+
+def writeFile(path, write):
+    """
+    Atomically replaces a file of the installation
+    :param write: Function writing the content to a binary file object
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.rename(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def registerProfile(wasdir, name, path, template):
+    """
+    Adds a profile to the profile registry and the fsdb, creating the registry if needed
+    :param wasdir: Path to the WAS installation
+    :param name: Profile Name
+    :param path: Path to the profile directory
+    :param template: Path to the profile template the profile was created from
+    """
+    registry = getRegistryPath(wasdir)
+    tree = readRegistry(registry)
+    root = tree.getroot()
+    for element in root.findall("profile"):
+        if element.get("name") == name:
+            root.remove(element)
+    default = not [element for element in root.findall("profile") if element.get("isDefault") == "true"]
+    ElementTree.SubElement(root, "profile", dict(
+        isAReservationTicket="false",
+        isDefault="true" if default else "false",
+        name=name,
+        path=path,
+        template=template
+    ))
+
+    fsdb = getFsdbPath(wasdir, name)
+    script = "#!/bin/sh\nexport WAS_USER_SCRIPT={0}\n".format(os.path.join(path, "bin", "setupCmdLine.sh"))
+    writeFile(fsdb, lambda f: f.write(script.encode("utf-8")))
+    os.chmod(fsdb, 0o755)
+    writeFile(registry, lambda f: tree.write(f, encoding="UTF-8", xml_declaration=True))
+
+
+def unregisterProfile(wasdir, name):
+    """
+    Removes a profile from the profile registry and the fsdb, as manageprofiles.sh -delete does
+    :param wasdir: Path to the WAS installation
+    :param name: Profile Name
+    """
+    fsdb = getFsdbPath(wasdir, name)
+    if os.path.exists(fsdb):
+        os.remove(fsdb)
+    registry = getRegistryPath(wasdir)
+    if not os.path.exists(registry):
+        return
+    tree = readRegistry(registry)
+    root = tree.getroot()
+    removed = [element for element in root.findall("profile") if element.get("name") == name]
+    if not removed:
+        return
+    for element in removed:
+        root.remove(element)
+    # Another profile becomes the default, if there is one
+    remaining = root.findall("profile")
+    if remaining and not [element for element in remaining if element.get("isDefault") == "true"]:
+        remaining[0].set("isDefault", "true")
+    writeFile(registry, lambda f: tree.write(f, encoding="UTF-8", xml_declaration=True))
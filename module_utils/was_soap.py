@@ -0,0 +1,372 @@
+#
+# Talks to the SOAP connector of a deployment manager or node agent (port
+# 8879 by default) without starting a wsadmin JVM.
+#
+# Every AdminService call is one SOAP request posted to the connector:
+#
+#   <SOAP-ENV:Body>
+#     <ns1:getAttribute xmlns:ns1="urn:AdminService">
+#       <objectname xsi:type="xsd:string">WebSphere:name=server1,type=Server,...</objectname>
+#       <attribute xsi:type="xsd:string">state</attribute>
+#     </ns1:getAttribute>
+#   </SOAP-ENV:Body>
+#
+# Object names, parameters and results are exchanged in their string form.
+# The HTTP connection is kept alive between calls, so a batch of servers
+# costs one TCP (and TLS) handshake per worker instead of one per call.
+#
+
+import base64
+import select
+import socket
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from xml.sax.saxutils import escape
+
+from ansible.module_utils.six.moves import http_client
+
+DEFAULT_PORT = 8879
+
+ADMIN_SERVICE = "urn:AdminService"
+
+ENVELOPE = """<?xml version="1.0" encoding="UTF-8"?>
+<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema">
+<SOAP-ENV:Body>
+<ns1:{0} xmlns:ns1="urn:AdminService" SOAP-ENV:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">
+{1}
+</ns1:{0}>
+</SOAP-ENV:Body>
+</SOAP-ENV:Envelope>
+"""
+
+# Seconds between two checks that a stopped server is gone
+STOP_POLL_INTERVAL = 0.5
+
+# Seconds the socket waits for an answer beyond the timeout of the operation, as launchProcess only answers once the server is up
+RESPONSE_MARGIN = 60
+
+
+class SoapError(Exception):
+    """
+    The connector could not be reached or answered with a fault
+    """
+    pass
+
+
+def encodeValue(tag, value):
+    """
+    Encodes a parameter of an AdminService call
+    :param value: string, or list of strings
+    :return: XML fragment
+    """
+    if isinstance(value, (list, tuple)):
+        items = "".join(['<item xsi:type="xsd:string">{0}</item>'.format(escape(str(item))) for item in value])
+        return '<{0} SOAP-ENV:arrayType="xsd:string[{1}]">{2}</{0}>'.format(tag, len(value), items)
+    return '<{0} xsi:type="xsd:string">{1}</{0}>'.format(tag, escape(str(value)))
+
+
+def localName(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def decodeResponse(body):
+    """
+    Reads the return value of an AdminService response
+    :return: string, list of strings for arrays, or None
+    """
+    try:
+        root = ElementTree.fromstring(body)
+    except ElementTree.ParseError as e:
+        raise SoapError("Invalid SOAP response: {0}".format(e))
+    for element in root.iter():
+        if localName(element.tag) == "Fault":
+            fault = [child.text for child in element.iter() if localName(child.tag) == "faultstring"]
+            raise SoapError((fault and fault[0]) or "SOAP fault")
+    for element in root.iter():
+        if localName(element.tag) == "return":
+            items = [child for child in element if localName(child.tag) == "item"]
+            if items:
+                return [(item.text or "") for item in items]
+            if element.get("{http://www.w3.org/2001/XMLSchema-instance}nil") == "true":
+                return None
+            return element.text or ""
+    return None
+
+
+class AdminClient():
+    """
+    Client of the SOAP connector. One instance keeps one HTTP connection alive and must not be shared between threads
+    """
+
+    def __init__(self, host="localhost", port=DEFAULT_PORT, username=None, password=None, ssl=False, validateCerts=True, timeout=60):
+        self.host = host
+        self.port = int(port)
+        self.username = username
+        self.password = password
+        self.ssl = ssl
+        self.validateCerts = validateCerts
+        self.timeout = timeout
+        self.connection = None
+        # Calls made and connections opened, to tell how well keep-alive works
+        self.calls = 0
+        self.connections = 0
+
+    def connect(self):
+        if self.ssl:
+            import ssl
+            context = ssl.create_default_context()
+            if not self.validateCerts:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            self.connection = http_client.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=context)
+        else:
+            self.connection = http_client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        self.connections += 1
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def isStale(self):
+        # An idle keep-alive connection only becomes readable when the connector closes it
+        sock = self.connection.sock
+        if sock is None:
+            return True
+        try:
+            return bool(select.select([sock], [], [], 0)[0])
+        except (select.error, ValueError):
+            return True
+
+    def send(self, body):
+        headers = {
+            "Content-Type": "text/xml; charset=utf-8",
+            "SOAPAction": '"{0}"'.format(ADMIN_SERVICE),
+            "Connection": "keep-alive"
+        }
+        if self.username is not None:
+            credentials = "{0}:{1}".format(self.username, self.password or "")
+            headers["Authorization"] = "Basic " + base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+        self.connection.request("POST", "/", body, headers)
+
+    def receive(self):
+        response = self.connection.getresponse()
+        data = response.read()
+        if response.getheader("Connection", "").lower() == "close":
+            self.close()
+        return response.status, data
+
+    def call(self, operation, params):
+        """
+        Calls an AdminService operation
+        :param operation: Name of the operation, e.g. invoke
+        :param params: list of (name, value) in the order the connector expects them
+        :return: The decoded return value
+        """
+        body = ENVELOPE.format(operation, "\n".join([encodeValue(tag, value) for tag, value in params])).encode("utf-8")
+        if self.connection is not None and self.isStale():
+            self.close()
+        reused = self.connection is not None
+        if not reused:
+            self.connect()
+        self.calls += 1
+        try:
+            self.send(body)
+        except (http_client.HTTPException, socket.error) as e:
+            self.close()
+            # The connector closed the idle connection before the request could be sent, so it is sent again
+            if not reused:
+                raise SoapError("Failed to reach the SOAP connector at {0}:{1}: {2}".format(self.host, self.port, e))
+            try:
+                self.connect()
+                self.send(body)
+            except (http_client.HTTPException, socket.error) as e:
+                self.close()
+                raise SoapError("Failed to reach the SOAP connector at {0}:{1}: {2}".format(self.host, self.port, e))
+        # The request may have been carried out from here on, an invoke must not be sent twice
+        try:
+            status, data = self.receive()
+        except socket.timeout:
+            self.close()
+            raise SoapError("The SOAP connector at {0}:{1} did not answer {2} within {3} seconds".format(self.host, self.port, operation, self.timeout))
+        except (http_client.HTTPException, socket.error) as e:
+            self.close()
+            raise SoapError("Lost the connection to the SOAP connector at {0}:{1} during {2}: {3}".format(self.host, self.port, operation, e))
+        if status == 401:
+            raise SoapError("The SOAP connector at {0}:{1} rejected the credentials".format(self.host, self.port))
+        if status >= 400 and status != 500:
+            raise SoapError("The SOAP connector at {0}:{1} answered with HTTP {2}".format(self.host, self.port, status))
+        # Faults come with status 500
+        return decodeResponse(data)
+
+    def queryNames(self, pattern):
+        """
+        :param pattern: Object name pattern, e.g. WebSphere:type=Server,node=node01,*
+        :return: list of object names
+        """
+        names = self.call("queryNames", [("objectname", pattern), ("queryexp", "")])
+        if names is None or names == "":
+            return []
+        if not isinstance(names, list):
+            names = [names]
+        return [name for name in names if name]
+
+    def getAttribute(self, objectName, attribute):
+        return self.call("getAttribute", [("objectname", objectName), ("attribute", attribute)])
+
+    def invoke(self, objectName, operation, params=None, signature=None):
+        return self.call("invoke", [
+            ("objectname", objectName),
+            ("operationname", operation),
+            ("params", list(params or [])),
+            ("signature", list(signature or []))
+        ])
+
+
+def getServerMBean(client, name, node):
+    names = client.queryNames("WebSphere:type=Server,node={0},process={1},*".format(node, name))
+    return names[0] if names else None
+
+
+def isServerRunning(client, name, node):
+    """
+    Same as AdminControl.completeObjectName() in was_control, plus the state attribute
+    :return: 1 if the server is running, 0 if not
+    """
+    mbean = getServerMBean(client, name, node)
+    if mbean is None:
+        return 0
+    return 0 if client.getAttribute(mbean, "state") in ("STOPPING", "STOPPED") else 1
+
+
+def startServer(client, name, node, timeout):
+    """
+    Same as AdminControl.startServer(name, node, timeout): the node agent launches the server and waits for it
+    """
+    agents = client.queryNames("WebSphere:type=NodeAgent,node={0},*".format(node))
+    if not agents:
+        raise SoapError("The node agent of node {0} is not running".format(node))
+    launched = client.invoke(agents[0], "launchProcess", [name, str(int(timeout))], ["java.lang.String", "java.lang.Integer"])
+    if str(launched).lower() != "true":
+        raise SoapError("Node agent of node {0} failed to launch server {1}".format(node, name))
+
+
+def stopServer(client, name, node, timeout):
+    """
+    Same as AdminControl.stopServer(name, node): stops the server and waits until its MBean is gone
+    """
+    mbean = getServerMBean(client, name, node)
+    if mbean is None:
+        return
+    client.invoke(mbean, "stop")
+    deadline = time.time() + timeout
+    while getServerMBean(client, name, node) is not None:
+        if time.time() >= deadline:
+            raise SoapError("Server {0} did not stop within {1} seconds".format(name, timeout))
+        time.sleep(STOP_POLL_INTERVAL)
+
+
+def controlServersOverSoap(clientFactory, action, servers, parallelism=1, nodeParallelism=1, timeout=600):
+    """
+    Starts or stops servers through the SOAP connector, like the script of was_control does through wsadmin
+    :param clientFactory: Function returning a new AdminClient for a socket timeout in seconds. Every worker thread gets its own
+    :param action: start, stop or status
+    :param servers: list of dicts with the keys name and node
+    :param parallelism: Number of servers started or stopped at the same time
+    :param nodeParallelism: Number of servers started or stopped at the same time on one node
+    :param timeout: Seconds a server may take to start or stop
+    :return: tuple of per server results (as readControlResults() of was_control) and the number of calls and connections
+    """
+    wanted = dict(start=1, stop=0).get(action)
+    lock = threading.Condition()
+    pending = list(servers)
+    active = dict()
+    results = []
+    clients = []
+    failures = []
+    queued = time.time()
+
+    def result(server, before, after, error, started, waited):
+        return dict(
+            name=server["name"],
+            node=server["node"],
+            running_before=before,
+            running=after,
+            changed=wanted is not None and before != wanted and after == wanted,
+            seconds=round(time.time() - started, 3),
+            waited=round(waited, 3),
+            error=error
+        )
+
+    def control(client, server, waited):
+        started = time.time()
+        before = -1
+        after = -1
+        error = None
+        try:
+            before = isServerRunning(client, server["name"], server["node"])
+            if action == "start" and not before:
+                startServer(client, server["name"], server["node"], timeout)
+            elif action == "stop" and before:
+                stopServer(client, server["name"], server["node"], timeout)
+            after = isServerRunning(client, server["name"], server["node"])
+        except SoapError as e:
+            error = str(e)
+        except Exception as e:
+            # Anything else must not end the thread, or the server would be missing from the results
+            error = "{0} failed: {1}: {2}".format(action, type(e).__name__, e)
+        if error is None and wanted is not None and after != wanted:
+            error = "Server is {0} after {1}".format("running" if after == 1 else "not running", action)
+        return result(server, before, after, error, started, waited)
+
+    def worker():
+        try:
+            client = clientFactory(timeout + RESPONSE_MARGIN)
+        except Exception as e:
+            with lock:
+                failures.append("{0}: {1}".format(type(e).__name__, e))
+            return
+        with lock:
+            clients.append(client)
+        try:
+            while True:
+                with lock:
+                    # The first queued server whose node has a free slot
+                    chosen = None
+                    while chosen is None and pending:
+                        for server in pending:
+                            if active.get(server["node"], 0) < nodeParallelism:
+                                chosen = server
+                                break
+                        if chosen is None:
+                            lock.wait()
+                    if chosen is None:
+                        return
+                    pending.remove(chosen)
+                    active[chosen["node"]] = active.get(chosen["node"], 0) + 1
+                waited = time.time() - queued
+                try:
+                    done = control(client, chosen, waited)
+                finally:
+                    with lock:
+                        active[chosen["node"]] -= 1
+                        lock.notify_all()
+                with lock:
+                    results.append(done)
+        finally:
+            client.close()
+
+    workers = [threading.Thread(target=worker) for i in range(max(1, min(parallelism, len(servers))))]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    # Servers left when no worker could connect
+    for server in pending:
+        results.append(result(server, -1, -1, "No SOAP connection: {0}".format(failures[0] if failures else "no worker"), queued, 0))
+
+    order = dict(((server["node"], server["name"]), index) for index, server in enumerate(servers))
+    results.sort(key=lambda result: order.get((result["node"], result["name"]), 0))
+    return results, sum([client.calls for client in clients]), sum([client.connections for client in clients])
@@ -0,0 +1,258 @@
+#
+# Collects the topology of a cell (nodes, servers, clusters) together with
+# the run state and process ID of every server.
+#
+# With wsadmin, one generated Jython script walks the configuration and asks
+# the Server MBeans for state and pid. It writes one line per item to a file,
+# so large cells are not cut off by the tail of stdout:
+#
+#   node <TAB> node <TAB> host
+#   server <TAB> node <TAB> server <TAB> type <TAB> state <TAB> pid
+#   member <TAB> cluster <TAB> server <TAB> node
+#
+# Without wsadmin, serverStatus.sh -all runs in every profile on this host at
+# the same time, and the clusters are read from the profile configuration.
+#
+
+import glob
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import xml.etree.ElementTree as ElementTree
+
+from ansible.module_utils.websphere_cache import getCacheDir
+from ansible.module_utils.websphere_command import getLogFiles, runCommand
+from ansible.module_utils.was_config import parseCluster
+from ansible.module_utils.was_process import getProfileDirs, readPid
+from ansible.module_utils.wsadmin_session import DEFAULT_IDLE_TIMEOUT, runWsadmin
+
+# Runs in wsadmin, so it must stay compatible with Jython 2.1
+SCRIPT = """
+import sys
+
+out = open(sys.argv[0], "w")
+
+def emit(fields):
+    out.write("\\t".join(fields) + "\\n")
+
+def lines(text):
+    return [line for line in text.splitlines() if line.strip()]
+
+for cell in lines(AdminConfig.list("Cell")):
+    emit(["cell", AdminConfig.showAttribute(cell, "name")])
+
+for node in lines(AdminConfig.list("Node")):
+    nodeName = AdminConfig.showAttribute(node, "name")
+    emit(["node", nodeName, AdminConfig.showAttribute(node, "hostName") or ""])
+    for server in lines(AdminConfig.list("Server", node)):
+        name = AdminConfig.showAttribute(server, "name")
+        state = "STOPPED"
+        pid = ""
+        mbean = AdminControl.completeObjectName("type=Server,node=%s,process=%s,*" % (nodeName, name))
+        if mbean:
+            try:
+                state = AdminControl.getAttribute(mbean, "state")
+                pid = AdminControl.getAttribute(mbean, "pid") or ""
+            except:
+                state = "UNKNOWN"
+        emit(["server", nodeName, name, AdminConfig.showAttribute(server, "serverType") or "", state, pid])
+
+for cluster in lines(AdminConfig.list("ServerCluster")):
+    clusterName = AdminConfig.showAttribute(cluster, "name")
+    for member in lines(AdminConfig.list("ClusterMember", cluster)):
+        emit(["member", clusterName, AdminConfig.showAttribute(member, "memberName"), AdminConfig.showAttribute(member, "nodeName")])
+
+out.close()
+"""
+
+# serverStatus.sh -all prints one of these for every server of the profile
+STATUS = re.compile('ADMU050[89]I: The (.+?) "(.+?)" (?:is (\\w+)|cannot be reached)')
+
+SERVER_TYPES = {
+    "Application Server": "APPLICATION_SERVER",
+    "Node Agent": "NODE_AGENT",
+    "Deployment Manager": "DEPLOYMENT_MANAGER",
+    "Web server": "WEB_SERVER"
+}
+
+
+def buildFacts(source, cells, nodes, servers, members):
+    """
+    Indexes the topology by node and by cluster
+    :param nodes: dict of node name -> host name
+    :param servers: list of dicts with the keys name, node, type, state and pid
+    :param members: list of (cluster, server, node)
+    :return: dict with the keys cell, source, nodes and clusters
+    """
+    clusterOf = dict(((server, node), cluster) for cluster, server, node in members)
+    facts = dict(cell=cells[0] if cells else None, source=source, nodes=dict(), clusters=dict())
+    for node, host in nodes.items():
+        facts["nodes"][node] = dict(host=host, servers=dict())
+    for server in servers:
+        node = facts["nodes"].setdefault(server["node"], dict(host=None, servers=dict()))
+        node["servers"][server["name"]] = dict(
+            type=server["type"],
+            cluster=clusterOf.get((server["name"], server["node"])),
+            state=server["state"],
+            running=server["state"] == "STARTED",
+            pid=server["pid"]
+        )
+    for cluster, name, node in members:
+        entry = facts["clusters"].setdefault(cluster, dict(members=[], running=0))
+        entry["members"].append(dict(name=name, node=node))
+        server = facts["nodes"].get(node, dict(servers=dict()))["servers"].get(name)
+        if server is not None and server["running"]:
+            entry["running"] += 1
+    return facts
+
+
+def readTopology(path):
+    """
+    Reads the file written by the topology script
+    :return: dict as returned by buildFacts()
+    """
+    cells = []
+    nodes = dict()
+    servers = []
+    members = []
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip("\r\n").split("\t")
+            if fields[0] == "cell" and len(fields) > 1:
+                cells.append(fields[1])
+            elif fields[0] == "node" and len(fields) > 2:
+                nodes[fields[1]] = fields[2] or None
+            elif fields[0] == "server" and len(fields) > 5:
+                pid = fields[5]
+                servers.append(dict(
+                    node=fields[1],
+                    name=fields[2],
+                    type=fields[3] or None,
+                    state=fields[4],
+                    pid=int(pid) if pid.isdigit() else None
+                ))
+            elif fields[0] == "member" and len(fields) > 3:
+                members.append((fields[1], fields[2], fields[3]))
+    return buildFacts("wsadmin", cells, nodes, servers, members)
+
+
+def gatherTopology(wasdir, connection=None, session=True, cacheDir=None, idleTimeout=DEFAULT_IDLE_TIMEOUT, logDir=None):
+    """
+    Collects the topology of the cell with one wsadmin script
+    :param wasdir: Path to the WAS installation or profile
+    :param connection: dict with the optional keys conntype, host, port, username and password
+    :return: tuple of returncode, facts (None if the script failed), stdout and stderr
+    """
+    directory = getCacheDir(cacheDir, "was_facts")
+    script = os.path.join(directory, "topology-{0}.py".format(hashlib.sha256(SCRIPT.encode("utf-8")).hexdigest()[:16]))
+    if not os.path.exists(script):
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            f.write(SCRIPT)
+        os.rename(tmp, script)
+
+    fd, output = tempfile.mkstemp(dir=directory, prefix="topology-", suffix=".txt")
+    os.close(fd)
+    try:
+        returncode, stdout_value, stderr_value, used = runWsadmin(
+            wasdir,
+            script=script,
+            args=[output],
+            connection=connection,
+            session=session,
+            cacheDir=cacheDir,
+            idleTimeout=idleTimeout,
+            logDir=logDir,
+            name="was_facts"
+        )
+        facts = readTopology(output) if returncode == 0 else None
+    finally:
+        os.remove(output)
+    return returncode, facts, stdout_value, stderr_value
+
+
+def readSetupCmdLine(profile):
+    """
+    Reads the cell and node of a profile from bin/setupCmdLine.sh
+    :return: tuple of cell and node, None where not found
+    """
+    values = dict()
+    try:
+        with open(os.path.join(profile, "bin", "setupCmdLine.sh")) as f:
+            for line in f:
+                match = re.match("^\\s*(WAS_CELL|WAS_NODE)=(\\S+)", line)
+                if match:
+                    values[match.group(1)] = match.group(2).strip("\"'")
+    except (IOError, OSError):
+        pass
+    return values.get("WAS_CELL"), values.get("WAS_NODE")
+
+
+def readClusterMembers(profile, cell):
+    """
+    Reads the cluster members from the cluster.xml files of a profile
+    :return: list of (cluster, server, node)
+    """
+    members = []
+    for path in sorted(glob.glob(os.path.join(profile, "config", "cells", cell or "*", "clusters", "*", "cluster.xml"))):
+        cluster = os.path.basename(os.path.dirname(path))
+        try:
+            data = parseCluster(path)
+        except (IOError, OSError, ElementTree.ParseError):
+            continue
+        for member in data["members"]:
+            members.append((cluster, member["name"], member["node"]))
+    return members
+
+
+def gatherLocalTopology(wasdir, username=None, password=None, logDir=None):
+    """
+    Collects the servers of the profiles on this host with serverStatus.sh -all, all profiles at the same time
+    :param wasdir: Path to the WAS installation or profile
+    :return: tuple of facts and a list of errors
+    """
+    credentials = ""
+    if username is not None:
+        credentials += " -username {0}".format(username)
+    if password is not None:
+        credentials += " -password {0}".format(password)
+
+    profiles = [profile for profile in getProfileDirs(wasdir) if os.path.exists(os.path.join(profile, "bin", "serverStatus.sh"))]
+    outputs = dict()
+
+    def status(profile):
+        cmd = "{0}/bin/serverStatus.sh -all{1}".format(profile, credentials)
+        outputs[profile] = runCommand(cmd, *getLogFiles(logDir, "was_facts." + os.path.basename(profile)))
+
+    threads = [threading.Thread(target=status, args=(profile,)) for profile in profiles]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    cells = []
+    nodes = dict()
+    servers = []
+    members = []
+    errors = []
+    for profile in profiles:
+        returncode, stdout_value, stderr_value = outputs[profile]
+        cell, node = readSetupCmdLine(profile)
+        if cell and cell not in cells:
+            cells.append(cell)
+        node = node or os.path.basename(profile)
+        nodes.setdefault(node, None)
+        found = STATUS.findall(stdout_value)
+        if returncode != 0 and not found:
+            errors.append("serverStatus.sh failed in {0}: {1}".format(profile, (stderr_value or stdout_value).strip()[-500:]))
+            continue
+        for kind, name, state in found:
+            state = state or "STOPPED"
+            pid = readPid(os.path.join(profile, "logs", name), name) if state == "STARTED" else None
+            servers.append(dict(name=name, node=node, type=SERVER_TYPES.get(kind, kind), state=state, pid=pid))
+        for member in readClusterMembers(profile, cell):
+            if member not in members:
+                members.append(member)
+    return buildFacts("local", cells, nodes, servers, members), errors
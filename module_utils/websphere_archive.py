@@ -0,0 +1,239 @@
+#
+# Unpacks installer archives into a content-addressed cache.
+#
+# An archive (a local zip or an URL) is read once: it is hashed while it is
+# downloaded, checked against an optional checksum and then extracted with
+# several threads. The extracted tree is stored below the SHA-256 of the
+# archive, so installing the same archive again on a host reuses the tree:
+#
+#   /var/cache/ansible-websphere/archives/sources.json
+#   /var/cache/ansible-websphere/archives/<sha256>/install
+#
+# sources.json remembers the digest of every source (by size and mtime for
+# files, by ETag/Last-Modified for URLs), so a known archive is neither read
+# nor downloaded again.
+#
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+
+from ansible.module_utils.six.moves.urllib.error import HTTPError
+from ansible.module_utils.urls import open_url
+from ansible.module_utils.websphere_cache import getCacheDir, loadJson, saveJson
+from ansible.module_utils.ibmim_repository import isRemote
+
+CHUNK_SIZE = 1024 * 1024
+
+# Written into an extracted tree once all members are in place
+COMPLETE_MARKER = ".complete"
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def isArchive(src):
+    """
+    Checks if src is an archive rather than an extracted directory
+    """
+    return src is not None and (isRemote(src) or (src.lower().endswith(".zip") and not os.path.isdir(src)))
+
+
+def parseChecksum(checksum):
+    """
+    Splits a checksum given as <algorithm>:<hex>. A checksum without algorithm is a SHA-256
+    :return: tuple of algorithm and lower case hex digest, or (None, None)
+    """
+    if not checksum:
+        return None, None
+    if ":" in checksum:
+        algorithm, value = checksum.split(":", 1)
+    else:
+        algorithm, value = "sha256", checksum
+    algorithm = algorithm.strip().lower()
+    if algorithm not in getattr(hashlib, "algorithms_guaranteed", getattr(hashlib, "algorithms", ())):
+        raise ArchiveError("Unsupported checksum algorithm {0}".format(algorithm))
+    return algorithm, value.strip().lower()
+
+
+def download(src, path, entry, algorithms, timeout=60, validateCerts=True):
+    """
+    Streams an archive to path and hashes it on the way
+    :param entry: Cached entry of a previous download with its etag and last_modified, or None
+    :param algorithms: list of hash algorithms
+    :return: tuple of a dict with the etag and last_modified of the response and a dict of
+        algorithm -> hex digest, or (None, None) if the server answered 304
+    """
+    headers = {}
+    if entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    try:
+        response = open_url(src, headers=headers, timeout=timeout, validate_certs=validateCerts)
+    except HTTPError as e:
+        if e.code == 304:
+            return None, None
+        raise ArchiveError("Failed downloading {0}: {1}".format(src, e))
+    digests = dict((algorithm, hashlib.new(algorithm)) for algorithm in algorithms)
+    try:
+        with open(path, "wb") as f:
+            for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+                f.write(chunk)
+                for digest in digests.values():
+                    digest.update(chunk)
+        info = response.info()
+        validators = dict(etag=info.get("ETag"), last_modified=info.get("Last-Modified"))
+        return validators, dict((algorithm, digest.hexdigest()) for algorithm, digest in digests.items())
+    finally:
+        response.close()
+
+
+def hashFile(path, algorithms):
+    """
+    Hashes a file with several algorithms in one pass
+    :return: dict of algorithm -> hex digest
+    """
+    digests = dict((algorithm, hashlib.new(algorithm)) for algorithm in algorithms)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            for digest in digests.values():
+                digest.update(chunk)
+    return dict((algorithm, digest.hexdigest()) for algorithm, digest in digests.items())
+
+
+def extractMembers(path, dest, members):
+    """
+    Extracts members of a zip file. Every thread opens the archive on its own.
+    zipfile checks the CRC of every member while it is read
+    """
+    archive = zipfile.ZipFile(path)
+    try:
+        for member in members:
+            target = os.path.join(dest, member.filename)
+            if member.filename.endswith("/"):
+                if not os.path.isdir(target):
+                    os.makedirs(target)
+                continue
+            archive.extract(member, dest)
+            # zipfile does not restore the permissions, the installer needs its executables
+            mode = (member.external_attr >> 16) & 0o777
+            if mode:
+                os.chmod(target, mode)
+    finally:
+        archive.close()
+
+
+def extractArchive(path, dest, parallel=4):
+    """
+    Extracts a zip file with several threads into dest
+    :param path: Path to the zip file
+    :param dest: Directory to extract to, must exist
+    :param parallel: Number of threads
+    """
+    try:
+        archive = zipfile.ZipFile(path)
+        members = archive.infolist()
+        archive.close()
+    except zipfile.BadZipfile as e:
+        raise ArchiveError("{0} is not a valid zip file: {1}".format(path, e))
+
+    for member in members:
+        target = os.path.realpath(os.path.join(dest, member.filename))
+        if not target.startswith(os.path.realpath(dest) + os.sep) and target != os.path.realpath(dest):
+            raise ArchiveError("{0} would be extracted outside of {1}".format(member.filename, dest))
+
+    # Directories first, then the files spread over the threads, biggest first
+    extractMembers(path, dest, [member for member in members if member.filename.endswith("/")])
+    files = sorted([member for member in members if not member.filename.endswith("/")], key=lambda member: -member.file_size)
+    slices = [files[index::max(1, parallel)] for index in range(max(1, parallel))]
+    errors = []
+
+    def worker(members):
+        try:
+            extractMembers(path, dest, members)
+        except (zipfile.BadZipfile, IOError, OSError) as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=worker, args=(members,)) for members in slices if members]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise ArchiveError("Failed extracting {0}: {1}".format(path, "; ".join(errors)))
+
+
+def unpackArchive(src, cacheDir, checksum=None, parallel=4, timeout=60, validateCerts=True):
+    """
+    Returns the extracted tree of an archive, extracting it into the cache first if needed
+    :param src: Path or URL of a zip file
+    :param cacheDir: Root cache directory
+    :param checksum: Expected checksum as <algorithm>:<hex>, not checked if None
+    :param parallel: Number of extraction threads
+    :return: dict with the keys path (the extracted tree), digest (SHA-256 of the archive) and reused
+    """
+    algorithm, expected = parseChecksum(checksum)
+    root = getCacheDir(cacheDir, "archives")
+    index = os.path.join(root, "sources.json")
+    sources = loadJson(index, {})
+    entry = sources.get(src)
+
+    # A SHA-256 checksum is the address of the tree. Otherwise an unchanged file is looked up in the index
+    digest = None
+    if algorithm == "sha256":
+        digest = expected
+    elif entry and not isRemote(src) and os.path.isfile(src) and (algorithm is None or entry.get(algorithm) == expected):
+        stat = os.stat(src)
+        if entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+            digest = entry["digest"]
+    if digest and os.path.exists(os.path.join(root, digest, COMPLETE_MARKER)):
+        return dict(path=os.path.join(root, digest), digest=digest, reused=True)
+
+    work = tempfile.mkdtemp(prefix=".unpack-", dir=root)
+    try:
+        algorithms = set(["sha256"] + ([algorithm] if algorithm else []))
+        if isRemote(src):
+            # The server is asked whether the archive changed since it was extracted
+            path = os.path.join(work, "archive.zip")
+            cached = entry if entry and os.path.exists(os.path.join(root, entry["digest"], COMPLETE_MARKER)) else None
+            validators, digests = download(src, path, cached, algorithms, timeout, validateCerts)
+            if validators is None:
+                if algorithm is None or cached.get(algorithm) == expected:
+                    return dict(path=os.path.join(root, cached["digest"]), digest=cached["digest"], reused=True)
+                raise ArchiveError("Checksum of {0} does not match, expected {1}".format(src, expected))
+        else:
+            if not os.path.isfile(src):
+                raise ArchiveError("{0} not found".format(src))
+            path = src
+            stat = os.stat(src)
+            validators = dict(size=stat.st_size, mtime=stat.st_mtime)
+            digests = hashFile(path, algorithms)
+
+        if algorithm and digests[algorithm] != expected:
+            raise ArchiveError("Checksum of {0} does not match, expected {1} but got {2}".format(src, expected, digests[algorithm]))
+        digest = digests["sha256"]
+
+        tree = os.path.join(root, digest)
+        reused = os.path.exists(os.path.join(tree, COMPLETE_MARKER))
+        if not reused:
+            staging = os.path.join(work, "tree")
+            os.makedirs(staging)
+            extractArchive(path, staging, parallel)
+            open(os.path.join(staging, COMPLETE_MARKER), "w").close()
+            if os.path.exists(tree):
+                shutil.rmtree(tree)
+            os.rename(staging, tree)
+
+        entry = dict(validators, digest=digest)
+        entry.update(digests)
+        sources[src] = entry
+        saveJson(index, sources)
+        return dict(path=tree, digest=digest, reused=reused)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
@@ -0,0 +1,92 @@
+#
+# Small on-host state store shared by the modules.
+#
+# Modules keep facts they have already learned (content hashes, repository
+# listings, parsed metadata) in JSON files below a cache directory, so that
+# an identical re-run can skip starting Java.
+#
+
+import json
+import os
+import tempfile
+
+DEFAULT_CACHE_DIR = "/var/cache/ansible-websphere"
+
+# Used instead of the cache and log directories when they can not be written, e.g. when the play does not become root
+USER_DIR = os.path.join("~", ".ansible", "websphere")
+
+
+def getWritableDir(path, fallback, mode=0o777):
+    """
+    Returns (and creates) a directory the module can write to
+    :param path: Path of the directory
+    :param fallback: Path used if path can not be created or written
+    :param mode: Mode of created directories
+    :return: path or fallback
+    """
+    for candidate in [path, os.path.expanduser(fallback)]:
+        try:
+            os.makedirs(candidate, mode)
+        except OSError:
+            # Exists already, possibly created by a concurrent task, or not permitted
+            pass
+        if os.path.isdir(candidate) and os.access(candidate, os.W_OK | os.X_OK):
+            return candidate
+    raise OSError("Neither {0} nor {1} can be written".format(path, fallback))
+
+
+def getCacheDir(cacheDir, name):
+    """
+    Returns (and creates) the cache directory of a module
+    :param cacheDir: Root cache directory, DEFAULT_CACHE_DIR if None
+    :param name: Name of the subdirectory, usually the module name
+    :return: path, below USER_DIR if the root cache directory can not be written
+    """
+    return getWritableDir(os.path.join(cacheDir or DEFAULT_CACHE_DIR, name), os.path.join(USER_DIR, "cache", name), 0o700)
+
+
+def loadJson(path, default=None):
+    """
+    Reads a JSON file. Missing or corrupt files are treated as empty
+    :param path: Path to the JSON file
+    :param default: Value returned if the file can not be read
+    :return: The decoded content or default
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return default
+
+
+def saveJson(path, data):
+    """
+    Atomically writes data as JSON, so concurrent readers never see a partial file
+    :param path: Path to the JSON file
+    :param data: Data to store
+    """
+    directory = os.path.dirname(path)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.rename(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def getMtimes(paths):
+    """
+    Returns the modification times of files or directories, used to key cached entries
+    :param paths: list of paths
+    :return: dict of path -> mtime, None for missing paths
+    """
+    mtimes = {}
+    for path in paths:
+        try:
+            mtimes[path] = os.stat(path).st_mtime
+        except OSError:
+            mtimes[path] = None
+    return mtimes
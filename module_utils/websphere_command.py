@@ -0,0 +1,224 @@
+#
+# Runs long running IBM tools (imcl, manageprofiles.sh, wsadmin.sh, ...)
+# without buffering their whole output in memory.
+#
+# The output of the child is streamed to a rotating log file on the host.
+# Only the last lines of stdout and stderr are kept for the module result.
+# A small JSON progress file (percent complete and current phase) is
+# rewritten while the child runs, so an async_status poll can read it cheaply:
+#
+#   {"percent": 42, "phase": "Installing com.ibm.websphere.ND.v85", "finished": false, "returncode": null, ...}
+#
+
+import os
+import re
+import subprocess
+import threading
+import time
+from collections import deque
+
+from ansible.module_utils.websphere_cache import USER_DIR, getWritableDir, saveJson
+
+DEFAULT_LOG_DIR = "/var/log/ansible-websphere"
+
+# Lines of stdout and stderr kept in memory for the module result
+DEFAULT_TAIL_LINES = 200
+
+# Size of a log file before it is rotated, and number of rotated files kept
+MAX_LOG_BYTES = 50 * 1024 * 1024
+LOG_BACKUPS = 3
+
+# Seconds between two updates of the progress file
+PROGRESS_INTERVAL = 1.0
+
+# imcl -showProgress draws a ruler and then one dot per step on the line below:
+#                  25%                50%                75%                100%
+# ------------------|------------------|------------------|------------------|
+# ............................
+RULER = re.compile("^-+(\\|-*)+\\|$")
+PERCENT = re.compile("(\\d{1,3})(?:\\.\\d+)?%")
+
+
+def getLogFiles(logDir, name):
+    """
+    Returns the paths of the output log and the progress file of a run, and creates their directory
+    :param logDir: Directory of the log files, DEFAULT_LOG_DIR if None. Falls back to USER_DIR/log if it can not be written
+    :param name: Name of the run, e.g. the module name and the profile name
+    :return: tuple of log file and progress file
+    """
+    logDir = getWritableDir(logDir or DEFAULT_LOG_DIR, os.path.join(USER_DIR, "log"))
+    name = re.sub("[^\\w.-]", "_", name)
+    return os.path.join(logDir, "{0}.log".format(name)), os.path.join(logDir, "{0}.progress.json".format(name))
+
+
+class RotatingLog():
+    """
+    Append only log file which is rotated when it grows beyond maxBytes
+    """
+
+    def __init__(self, path, maxBytes=MAX_LOG_BYTES, backups=LOG_BACKUPS):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.backups = backups
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.file = open(path, "ab")
+
+    def write(self, data):
+        with self.lock:
+            if self.file.tell() + len(data) > self.maxBytes:
+                self.rotate()
+            self.file.write(data)
+            self.file.flush()
+
+    def rotate(self):
+        self.file.close()
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists("{0}.{1}".format(self.path, index)):
+                os.rename("{0}.{1}".format(self.path, index), "{0}.{1}".format(self.path, index + 1))
+        if self.backups > 0:
+            os.rename(self.path, "{0}.1".format(self.path))
+        self.file = open(self.path, "wb")
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class Progress():
+    """
+    Derives the percent complete and the current phase from the output of a child
+    """
+
+    def __init__(self, path, pid):
+        self.path = path
+        self.lock = threading.Lock()
+        self.state = dict(pid=pid, started=time.time(), updated=None, percent=None, phase=None, finished=False, returncode=None)
+        self.rulerLength = None
+        self.written = 0
+
+    def line(self, line, complete):
+        """
+        Feeds a complete line, or the partial line which is currently being written
+        """
+        stripped = line.strip()
+        with self.lock:
+            if RULER.match(stripped):
+                self.rulerLength = len(stripped)
+                self.state["percent"] = 0
+            elif self.rulerLength and stripped and stripped.strip(".") == "":
+                self.state["percent"] = min(100, len(stripped) * 100 // self.rulerLength)
+                if complete:
+                    self.rulerLength = None
+            elif complete and stripped:
+                percents = PERCENT.findall(stripped)
+                if len(percents) == 1:
+                    self.state["percent"] = min(100, int(percents[0]))
+                elif not percents:
+                    self.state["phase"] = stripped[:200]
+        self.write()
+
+    def write(self, force=False):
+        if not self.path:
+            return
+        with self.lock:
+            now = time.time()
+            if not force and now - self.written < PROGRESS_INTERVAL:
+                return
+            self.written = now
+            self.state["updated"] = now
+            state = dict(self.state)
+        saveJson(self.path, state)
+
+    def finish(self, returncode):
+        with self.lock:
+            self.state["finished"] = True
+            self.state["returncode"] = returncode
+            if returncode == 0:
+                self.state["percent"] = 100
+        self.write(force=True)
+
+
+def toText(data):
+    if isinstance(data, bytes):
+        return data.decode("utf-8", "replace")
+    return data
+
+
+def pump(stream, tail, log, progress):
+    """
+    Copies the output of a child to the log file and the tail, chunk by chunk.
+    Reading chunks instead of lines lets the progress follow progress bars
+    which never end their line
+    """
+    partial = b""
+    fd = stream.fileno()
+    while True:
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            break
+        if log:
+            log.write(chunk)
+        lines = (partial + chunk).split(b"\n")
+        partial = lines.pop()
+        for line in lines:
+            line = toText(line).rstrip("\r")
+            tail.append(line)
+            progress.line(line, True)
+        if partial:
+            progress.line(toText(partial), False)
+        # Never keep more than a line worth of partial output
+        if len(partial) > 65536:
+            tail.append(toText(partial))
+            partial = b""
+    if partial:
+        line = toText(partial)
+        tail.append(line)
+        progress.line(line, True)
+    stream.close()
+
+
+def runCommand(cmd, logFile=None, progressFile=None, tailLines=DEFAULT_TAIL_LINES, env=None):
+    """
+    Runs a shell command and streams its output
+    :param cmd: Command line
+    :param logFile: Path of the rotating output log, no log if None
+    :param progressFile: Path of the progress file, no progress file if None
+    :param tailLines: Number of lines of stdout and stderr to return
+    :param env: Environment of the child, the current environment if None
+    :return: tuple of returncode, the tail of stdout and the tail of stderr
+    """
+    log = RotatingLog(logFile) if logFile else None
+    if progressFile and not os.path.isdir(os.path.dirname(progressFile)):
+        os.makedirs(os.path.dirname(progressFile))
+
+    child = subprocess.Popen(
+        [cmd],
+        shell=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=env
+    )
+    progress = Progress(progressFile, child.pid)
+    progress.write(force=True)
+
+    stdoutTail = deque(maxlen=tailLines)
+    stderrTail = deque(maxlen=tailLines)
+    threads = [
+        threading.Thread(target=pump, args=(child.stdout, stdoutTail, log, progress)),
+        threading.Thread(target=pump, args=(child.stderr, stderrTail, log, progress))
+    ]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    child.wait()
+
+    progress.finish(child.returncode)
+    if log:
+        log.close()
+
+    return child.returncode, "\n".join(stdoutTail), "\n".join(stderrTail)
@@ -0,0 +1,283 @@
+#
+# Serializes the tools that are not safe to run concurrently against one
+# installation (manageprofiles.sh, addNode.sh, server create).
+#
+# Every installation has a lock file and a queue directory below the cache
+# directory, named after the SHA-256 of its real path:
+#
+#   /var/cache/ansible-websphere/locks/<sha256>.lock
+#   /var/cache/ansible-websphere/locks/<sha256>.queue/<microseconds>-<pid>
+#
+# A task that wants the installation puts a ticket into the queue and waits
+# until its ticket is the oldest one, then takes an exclusive flock on the
+# lock file. Tickets are served first come, first served. The flock is
+# released by the kernel when a holder dies, and tickets of processes that no
+# longer exist are removed by the next waiter, so a killed task never blocks
+# the queue. The queue directory is only accessible to its owner, so the
+# tasks of one installation must run as the same user to queue up together.
+#
+# A slot gate limits how many tasks do something at the same time across
+# hosts, for example federate nodes into one deployment manager. It is a
+# directory of slot files, which may be shared between the hosts over NFS
+# (with locking enabled on the mount). A task takes the first slot file it
+# can flock and otherwise backs off, waiting a little longer every round.
+#
+
+import fcntl
+import hashlib
+import os
+import random
+import time
+
+from ansible.module_utils.websphere_cache import getCacheDir
+
+# Seconds a task waits for the installation before it gives up
+DEFAULT_LOCK_TIMEOUT = 3600
+
+POLL_INTERVAL = 0.5
+
+# Seconds between two rounds over the slots of a gate, doubled after every round up to MAX_BACKOFF
+DEFAULT_BACKOFF = 5
+MAX_BACKOFF = 60
+
+
+class LockTimeout(Exception):
+    pass
+
+
+def isAlive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # EPERM: the process exists but belongs to another user
+        return e.errno == 1
+    return True
+
+
+class InstallationLock(object):
+    """
+    Exclusive, first come first served lock of an installation directory
+    """
+
+    def __init__(self, path, cacheDir=None, timeout=DEFAULT_LOCK_TIMEOUT, holder=None):
+        """
+        :param path: Path to the installation
+        :param cacheDir: Root cache directory
+        :param timeout: Seconds to wait for the lock
+        :param holder: Description of the task, shown to the tasks waiting behind it
+        """
+        self.path = os.path.realpath(path)
+        self.cacheDir = cacheDir
+        self.timeout = timeout
+        self.holder = holder or "pid {0}".format(os.getpid())
+        self.lockFile = None
+        self.ticket = None
+        self.ahead = 0
+        self.waited = 0.0
+        self.acquiredAt = None
+
+    def getPaths(self):
+        directory = getCacheDir(self.cacheDir, "locks")
+        key = hashlib.sha256(self.path.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(directory, key + ".lock"), os.path.join(directory, key + ".queue")
+
+    def readQueue(self, queueDir):
+        """
+        Returns the tickets in the queue, oldest first. Tickets of dead processes are removed
+        """
+        tickets = []
+        for ticket in sorted(os.listdir(queueDir)):
+            try:
+                pid = int(ticket.rsplit("-", 1)[1])
+            except (IndexError, ValueError):
+                continue
+            if ticket != os.path.basename(self.ticket) and not isAlive(pid):
+                try:
+                    os.remove(os.path.join(queueDir, ticket))
+                except OSError:
+                    pass
+                continue
+            tickets.append(ticket)
+        return tickets
+
+    def readHolder(self, queueDir, ticket):
+        try:
+            with open(os.path.join(queueDir, ticket)) as f:
+                return f.read().strip()
+        except (IOError, OSError):
+            return None
+
+    def acquire(self):
+        """
+        Waits in the queue until the installation is free, then locks it
+        :raises LockTimeout: if the lock could not be taken within the timeout
+        """
+        lockPath, queueDir = self.getPaths()
+        if not os.path.isdir(queueDir):
+            try:
+                os.makedirs(queueDir, 0o700)
+            except OSError:
+                if not os.path.isdir(queueDir):
+                    raise
+
+        started = time.time()
+        self.ticket = os.path.join(queueDir, "{0:020d}-{1}".format(int(started * 1000000), os.getpid()))
+        with open(self.ticket, "w") as f:
+            f.write(self.holder)
+        self.lockFile = open(lockPath, "a")
+
+        tickets = self.readQueue(queueDir)
+        self.ahead = tickets.index(os.path.basename(self.ticket))
+        try:
+            while True:
+                tickets = self.readQueue(queueDir)
+                if tickets[0] == os.path.basename(self.ticket):
+                    try:
+                        fcntl.flock(self.lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except IOError:
+                        # The previous holder has not closed the lock file yet
+                        pass
+                if time.time() - started > self.timeout:
+                    holder = tickets[0] != os.path.basename(self.ticket) and self.readHolder(queueDir, tickets[0])
+                    raise LockTimeout("{0} is still locked by {1} after {2} seconds".format(self.path, holder or "another task", self.timeout))
+                time.sleep(POLL_INTERVAL)
+        except BaseException:
+            self.waited = time.time() - started
+            self.release()
+            raise
+        self.acquiredAt = time.time()
+        self.waited = self.acquiredAt - started
+
+    def release(self):
+        if self.lockFile is not None:
+            # Closing the file releases the flock
+            self.lockFile.close()
+            self.lockFile = None
+        if self.ticket is not None:
+            try:
+                os.remove(self.ticket)
+            except OSError:
+                pass
+            self.ticket = None
+
+    def stats(self):
+        """
+        :return: dict with the keys acquired, wait (seconds waited for the lock) and ahead (tasks queued before this one)
+        """
+        return dict(
+            acquired=self.acquiredAt is not None,
+            wait=round(self.waited, 3),
+            ahead=self.ahead
+        )
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+
+class SlotGate(object):
+    """
+    Lets at most a number of tasks through at the same time
+    """
+
+    def __init__(self, directory, slots, timeout=DEFAULT_LOCK_TIMEOUT, holder=None, backoff=DEFAULT_BACKOFF):
+        """
+        :param directory: Directory of the slot files, shared by all tasks of the gate
+        :param slots: Number of tasks let through at the same time
+        :param timeout: Seconds to wait for a slot
+        :param holder: Description of the task, shown to the tasks waiting for a slot
+        :param backoff: Seconds to wait after the first round over all slots
+        """
+        self.directory = directory
+        self.slots = slots
+        self.timeout = timeout
+        self.holder = holder or "pid {0}".format(os.getpid())
+        self.backoff = backoff
+        self.slotFile = None
+        self.slot = None
+        self.rounds = 0
+        self.waited = 0.0
+
+    def tryAcquire(self):
+        # Start at a random slot, so the waiting tasks do not all try slot 0 first
+        offset = random.randint(0, self.slots - 1)
+        for index in range(self.slots):
+            slot = (offset + index) % self.slots
+            slotFile = open(os.path.join(self.directory, "slot-{0}.lock".format(slot)), "a+")
+            try:
+                fcntl.flock(slotFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                slotFile.close()
+                continue
+            slotFile.seek(0)
+            slotFile.truncate()
+            slotFile.write(self.holder)
+            slotFile.flush()
+            self.slotFile = slotFile
+            self.slot = slot
+            return True
+        return False
+
+    def readHolders(self):
+        holders = []
+        for slot in range(self.slots):
+            try:
+                with open(os.path.join(self.directory, "slot-{0}.lock".format(slot))) as f:
+                    holders.append(f.read().strip() or "slot {0}".format(slot))
+            except (IOError, OSError):
+                pass
+        return holders
+
+    def acquire(self):
+        """
+        Waits for a free slot, backing off between the rounds over the slots
+        :raises LockTimeout: if no slot was free within the timeout
+        """
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory, 0o755)
+            except OSError:
+                if not os.path.isdir(self.directory):
+                    raise
+
+        started = time.time()
+        delay = self.backoff
+        while True:
+            self.rounds += 1
+            if self.tryAcquire():
+                break
+            remaining = self.timeout - (time.time() - started)
+            if remaining <= 0:
+                self.waited = time.time() - started
+                raise LockTimeout("None of the {0} slots of {1} got free within {2} seconds, held by {3}".format(
+                    self.slots, self.directory, self.timeout, ", ".join(self.readHolders())))
+            # Jitter keeps the waiting tasks from coming back all at once
+            time.sleep(min(delay * random.uniform(0.5, 1.0), remaining))
+            delay = min(delay * 2, MAX_BACKOFF)
+        self.waited = time.time() - started
+
+    def release(self):
+        if self.slotFile is not None:
+            self.slotFile.close()
+            self.slotFile = None
+
+    def stats(self):
+        """
+        :return: dict with the keys slot (None if no slot was taken), wait (seconds waited for the slot) and rounds
+        """
+        return dict(
+            slot=self.slot,
+            wait=round(self.waited, 3),
+            rounds=self.rounds
+        )
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.release()
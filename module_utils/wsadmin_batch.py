@@ -0,0 +1,214 @@
+#
+# Runs an ordered list of Jython scripts in one wsadmin.
+#
+# A driver is generated with the list of scripts and their arguments. It
+# runs the scripts one after the other in the same connected wsadmin (the
+# session, or one wsadmin.sh), each with its own sys.argv and namespace, and
+# optionally saves the configuration once at the end. A failing script stops
+# the batch and discards the unsaved changes.
+#
+# The output of every script goes to its own file in an output directory,
+# and every finished script appends a line to results.txt there:
+#
+#   script <TAB> index <TAB> returncode <TAB> seconds
+#   save <TAB> returncode <TAB> seconds
+#
+# The driver also prints the line to stdout, prefixed with a marker, so the
+# wsadmin log shows the progress of the batch.
+#
+
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import tempfile
+from collections import deque
+
+from ansible.module_utils.six import string_types
+from ansible.module_utils.websphere_cache import getCacheDir
+from ansible.module_utils.websphere_command import DEFAULT_TAIL_LINES
+from ansible.module_utils.wsadmin_session import DEFAULT_IDLE_TIMEOUT, runWsadmin
+
+MARKER = "@@WSADMIN-BATCH@@"
+
+# Runs in wsadmin, so it must stay compatible with Jython 2.1
+SCRIPT = """
+import sys
+import time
+import traceback
+
+MARKER = "%(marker)s"
+scripts = %(scripts)s
+save = %(save)d
+
+try:
+    runFile = execfile
+except NameError:
+    def runFile(path, namespace):
+        exec(compile(open(path).read(), path, "exec"), namespace)
+
+outputDir = sys.argv[0]
+results = open(outputDir + "/results.txt", "w")
+
+def report(fields):
+    line = "\\t".join(fields)
+    results.write(line + "\\n")
+    results.flush()
+    sys.stdout.write(MARKER + "\\t" + line + "\\n")
+    sys.stdout.flush()
+
+failed = 0
+index = 0
+for script in scripts:
+    started = time.time()
+    output = open("%%s/%%d.out" %% (outputDir, index), "w")
+    stdout = sys.stdout
+    stderr = sys.stderr
+    sys.stdout = output
+    sys.stderr = output
+    sys.argv = script[1]
+    namespace = globals().copy()
+    namespace["__name__"] = "__main__"
+    rc = 0
+    try:
+        try:
+            runFile(script[0], namespace)
+        except SystemExit:
+            e = sys.exc_info()[1]
+            if e.code is None:
+                rc = 0
+            elif type(e.code) == type(0):
+                rc = e.code
+            else:
+                output.write(str(e.code) + "\\n")
+                rc = 1
+        except:
+            traceback.print_exc(file=output)
+            rc = 1
+    finally:
+        sys.stdout = stdout
+        sys.stderr = stderr
+        output.close()
+    report(["script", str(index), str(rc), "%%.3f" %% (time.time() - started)])
+    index = index + 1
+    if rc != 0:
+        failed = 1
+        break
+
+if failed:
+    # Unsaved changes would otherwise stay in the workspace of the session
+    AdminConfig.reset()
+elif save:
+    started = time.time()
+    rc = 0
+    output = open(outputDir + "/save.out", "w")
+    try:
+        try:
+            AdminConfig.save()
+        except:
+            traceback.print_exc(file=output)
+            rc = 1
+    finally:
+        output.close()
+    report(["save", str(rc), "%%.3f" %% (time.time() - started)])
+    failed = rc
+
+results.close()
+sys.exit(failed)
+"""
+
+
+def getScriptArgs(params):
+    """
+    :param params: list of arguments, or a space separated string
+    :return: list of arguments
+    """
+    if params is None:
+        return []
+    if isinstance(params, string_types):
+        return shlex.split(params)
+    return [str(param) for param in params]
+
+
+def buildBatchScript(scripts, save=False):
+    """
+    Generates the driver of a batch
+    :param scripts: list of (path, list of arguments)
+    :param save: Save the configuration after the last script
+    :return: The script as a string
+    """
+    return SCRIPT % dict(
+        marker=MARKER,
+        scripts=json.dumps([[os.path.abspath(path), args] for path, args in scripts]),
+        save=int(bool(save))
+    )
+
+
+def readTail(path, lines=DEFAULT_TAIL_LINES):
+    try:
+        with open(path) as f:
+            return "".join(deque(f, maxlen=lines)).rstrip("\n")
+    except (IOError, OSError):
+        return ""
+
+
+def runBatch(wasdir, scripts, save=False, connection=None, session=True, cacheDir=None,
+             idleTimeout=DEFAULT_IDLE_TIMEOUT, logDir=None, name="wsadmin.batch"):
+    """
+    Runs scripts one after the other in one wsadmin
+    :param wasdir: Path to the WAS installation or profile
+    :param scripts: list of (path, list of arguments)
+    :param save: Save the configuration once after the last script
+    :return: tuple of returncode, list of per script results, the save result (None if not saved), stdout, stderr and True if the session ran the batch
+    """
+    directory = getCacheDir(cacheDir, "wsadmin")
+    text = buildBatchScript(scripts, save)
+    path = os.path.join(directory, "batch-{0}.py".format(hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]))
+    if not os.path.exists(path):
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.rename(tmp, path)
+
+    outputDir = tempfile.mkdtemp(dir=directory, prefix="batch-")
+    try:
+        returncode, stdout_value, stderr_value, used = runWsadmin(
+            wasdir,
+            script=path,
+            args=[outputDir],
+            connection=connection,
+            session=session,
+            cacheDir=cacheDir,
+            idleTimeout=idleTimeout,
+            logDir=logDir,
+            name=name
+        )
+
+        finished = dict()
+        saved = None
+        try:
+            with open(os.path.join(outputDir, "results.txt")) as f:
+                for line in f:
+                    fields = line.rstrip("\r\n").split("\t")
+                    if fields[0] == "script" and len(fields) > 3:
+                        finished[int(fields[1])] = (int(fields[2]), float(fields[3]))
+                    elif fields[0] == "save" and len(fields) > 2:
+                        saved = dict(rc=int(fields[1]), elapsed=float(fields[2]), output=readTail(os.path.join(outputDir, "save.out")))
+        except (IOError, OSError):
+            pass
+
+        results = []
+        for index, (script, args) in enumerate(scripts):
+            rc, elapsed = finished.get(index, (None, None))
+            results.append(dict(
+                script=script,
+                params=args,
+                rc=rc,
+                status="skipped" if rc is None else "ok" if rc == 0 else "failed",
+                elapsed=elapsed,
+                output=readTail(os.path.join(outputDir, "{0}.out".format(index)))
+            ))
+    finally:
+        shutil.rmtree(outputDir, ignore_errors=True)
+    return returncode, results, saved, stdout_value, stderr_value, used
@@ -0,0 +1,502 @@
+#
+# Long lived wsadmin session shared by the modules.
+#
+# Starting wsadmin.sh costs a JVM, a SOAP connection and a security handshake,
+# 20-60 seconds before the first line of a script runs. A session keeps one
+# connected wsadmin running per host, WAS installation and connection. It runs
+# a small Jython driver which reads requests from stdin:
+#
+#   <token> TAB <path of the script> TAB <argument> TAB ...
+#
+# executes the script in the connected session and prints a marker line with
+# the return code when it is done:
+#
+#   @@WSADMIN-SESSION@@ done <token> 0
+#
+# The marker starts a new line, but is also found after output of the script
+# that did not end with a newline. A request that does not finish within its
+# timeout ends the session, because its wsadmin is still busy with it.
+#
+# The driver is owned by a background worker which listens on a Unix socket
+# below the cache directory. Modules send one JSON request per connection.
+# The worker runs the requests one after the other and exits with its wsadmin
+# after it has been idle for idleTimeout seconds. If no worker can be started,
+# runWsadmin() falls back to a one-shot wsadmin.sh.
+#
+
+import fcntl
+import hashlib
+import json
+import os
+import select
+import shlex
+import socket
+import subprocess
+import time
+import uuid
+from collections import deque
+
+from ansible.module_utils.six import string_types
+from ansible.module_utils.websphere_cache import getCacheDir
+from ansible.module_utils.websphere_command import DEFAULT_TAIL_LINES, RotatingLog, getLogFiles, runCommand
+
+# Seconds an idle session is kept running
+DEFAULT_IDLE_TIMEOUT = 600
+
+# Seconds to wait for wsadmin to connect
+DEFAULT_START_TIMEOUT = 300
+
+# Seconds a script may run in the session
+DEFAULT_REQUEST_TIMEOUT = 3600
+
+# Seconds to wait for a live worker whose socket does not accept connections
+BUSY_TIMEOUT = 30
+
+MARKER = "@@WSADMIN-SESSION@@"
+
+# Runs in wsadmin, so it must stay compatible with Jython 2.1
+DRIVER = """
+import sys
+import traceback
+
+MARKER = "%(marker)s"
+
+try:
+    runFile = execfile
+except NameError:
+    def runFile(path, namespace):
+        exec(compile(open(path).read(), path, "exec"), namespace)
+
+def emit(text):
+    sys.stdout.write(text + "\\n")
+    sys.stdout.flush()
+
+emit(MARKER + " ready")
+while 1:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    fields = line.rstrip("\\n").split("\\t")
+    if fields[0] == "exit":
+        break
+    token = fields[0]
+    # Like wsadmin.sh -f, sys.argv only holds the script arguments
+    sys.argv = fields[2:]
+    namespace = globals().copy()
+    namespace["__name__"] = "__main__"
+    rc = 0
+    try:
+        runFile(fields[1], namespace)
+    except SystemExit:
+        e = sys.exc_info()[1]
+        if e.code is None:
+            rc = 0
+        elif type(e.code) == type(0):
+            rc = e.code
+        else:
+            emit(str(e.code))
+            rc = 1
+    except:
+        traceback.print_exc(file=sys.stdout)
+        rc = 1
+    # The output of the script may not have ended with a newline
+    emit("\\n%%s done %%s %%d" %% (MARKER, token, rc))
+""" % dict(marker=MARKER)
+
+
+class SessionError(Exception):
+    pass
+
+
+class SessionUnavailable(SessionError):
+    """
+    Raised if no session could be reached. Nothing has been run, so a one-shot wsadmin is safe
+    """
+    pass
+
+
+def getWsadminCommand(wasdir, connection=None):
+    """
+    Returns the wsadmin.sh command line, without script or command
+    :param wasdir: Path to the WAS installation or profile
+    :param connection: dict with the optional keys conntype, host, port, username and password
+    """
+    connection = connection or {}
+    cmd = "{0}/bin/wsadmin.sh -lang jython".format(wasdir)
+    for key in ["conntype", "host", "port", "username", "password"]:
+        if connection.get(key) is not None:
+            cmd += " -{0} {1}".format(key, connection[key])
+    return cmd
+
+
+def isRunning(pid):
+    """
+    Checks if a process is running. Zombies are not running
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    try:
+        with open("/proc/{0}/stat".format(pid)) as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except (IOError, IndexError):
+        return True
+
+
+class LineReader(object):
+    """
+    Reads lines from a pipe, with a deadline
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.buffer = b""
+
+    def readline(self, deadline=None):
+        """
+        :param deadline: time.time() after which to give up, None waits forever
+        :return: the next line with its newline, b"" at the end of the output, or None if the deadline passed
+        """
+        while b"\n" not in self.buffer:
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not select.select([self.fd], [], [], remaining)[0]:
+                    return None
+            chunk = os.read(self.fd, 65536)
+            if not chunk:
+                line, self.buffer = self.buffer, b""
+                return line
+            self.buffer += chunk
+        line, self.buffer = self.buffer.split(b"\n", 1)
+        return line + b"\n"
+
+
+class WsadminSession():
+    """
+    Client of the session of one WAS installation and connection. Starts the worker if needed
+    """
+
+    def __init__(self, wasdir, connection=None, cacheDir=None, idleTimeout=DEFAULT_IDLE_TIMEOUT,
+                 startTimeout=DEFAULT_START_TIMEOUT, logFile=None):
+        self.wasdir = wasdir
+        self.connection = connection or {}
+        self.idleTimeout = idleTimeout
+        self.startTimeout = startTimeout
+        self.logFile = logFile
+        self.runtimeDir = getCacheDir(cacheDir, "wsadmin")
+
+        identity = [os.path.realpath(wasdir)] + [self.connection.get(key) for key in ["conntype", "host", "port", "username", "password"]]
+        self.key = hashlib.sha256(json.dumps(identity).encode("utf-8")).hexdigest()[:16]
+        base = os.path.join(self.runtimeDir, "session-{0}".format(self.key))
+        self.socketPath = base + ".sock"
+        self.pidPath = base + ".pid"
+        self.lockPath = base + ".lock"
+        self.driverPath = os.path.join(self.runtimeDir, "driver.py")
+
+    def writeSnippet(self, command):
+        """
+        Stores a Jython command as a script file the session can run
+        :return: path to the script
+        """
+        path = os.path.join(self.runtimeDir, "snippet-{0}.py".format(hashlib.sha256(command.encode("utf-8")).hexdigest()[:16]))
+        if not os.path.exists(path):
+            with open(path, "w") as f:
+                f.write(command + "\n")
+        return path
+
+    def isWorkerAlive(self):
+        try:
+            with open(self.pidPath) as f:
+                return isRunning(int(f.read()))
+        except (IOError, ValueError):
+            return False
+
+    def run(self, script, args=None, timeout=DEFAULT_REQUEST_TIMEOUT):
+        """
+        Runs a script in the session
+        :param script: Path to the Jython script
+        :param args: list of arguments, available in sys.argv as with wsadmin.sh -f
+        :param timeout: Seconds the script may run
+        :return: tuple of returncode and the tail of the output
+        """
+        request = json.dumps(dict(script=os.path.abspath(script), args=list(args or []), timeout=timeout)).encode("utf-8") + b"\n"
+        attempt = 0
+        busySince = None
+        while True:
+            if not os.path.exists(self.socketPath):
+                self.start()
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                conn.connect(self.socketPath)
+            except socket.error as e:
+                conn.close()
+                if self.isWorkerAlive():
+                    # A busy worker may not accept the connection yet, its socket stays
+                    busySince = busySince or time.time()
+                    if time.time() - busySince < BUSY_TIMEOUT:
+                        time.sleep(0.5)
+                        continue
+                    raise SessionUnavailable("wsadmin session at {0} does not accept connections: {1}".format(self.socketPath, e))
+                # The worker is gone and left its socket behind
+                try:
+                    os.remove(self.socketPath)
+                except OSError:
+                    pass
+                attempt += 1
+                if attempt > 1:
+                    raise SessionUnavailable("wsadmin session at {0} does not answer".format(self.socketPath))
+                continue
+            try:
+                # The worker gives up on the script after timeout, the extra time is for its answer
+                conn.settimeout(timeout + 60)
+                conn.sendall(request)
+                conn.shutdown(socket.SHUT_WR)
+                response = b""
+                for chunk in iter(lambda: conn.recv(65536), b""):
+                    response += chunk
+            except socket.timeout:
+                raise SessionError("wsadmin session did not answer within {0} seconds while running {1}".format(timeout + 60, script))
+            except socket.error as e:
+                raise SessionError("Lost the wsadmin session while running {0}: {1}".format(script, e))
+            finally:
+                conn.close()
+            try:
+                result = json.loads(response.decode("utf-8"))
+            except ValueError:
+                raise SessionError("wsadmin session ended while running {0}".format(script))
+            if result["rc"] is None:
+                raise SessionError("wsadmin session ended while running {0}:\n{1}".format(script, result["stdout"]))
+            return result["rc"], result["stdout"]
+
+    def start(self):
+        """
+        Starts the worker and waits until its wsadmin is connected
+        """
+        try:
+            self.spawn()
+        except (IOError, OSError) as e:
+            raise SessionUnavailable("wsadmin session failed to start: {0}".format(e))
+
+    def spawn(self):
+        with open(self.lockPath, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(self.socketPath):
+                return
+            if os.path.exists(self.pidPath):
+                os.remove(self.pidPath)
+            if not os.path.exists(self.driverPath) or open(self.driverPath).read() != DRIVER:
+                with open(self.driverPath, "w") as f:
+                    f.write(DRIVER)
+
+            pid = os.fork()
+            if pid == 0:
+                self.daemonize()
+            os.waitpid(pid, 0)
+
+            deadline = time.time() + self.startTimeout
+            while time.time() < deadline:
+                if os.path.exists(self.socketPath):
+                    return
+                try:
+                    with open(self.pidPath) as f:
+                        worker = int(f.read())
+                except (IOError, ValueError):
+                    worker = None
+                if worker and not isRunning(worker):
+                    raise SessionUnavailable("wsadmin session exited before it was connected, see {0}".format(self.logFile))
+                time.sleep(0.2)
+            raise SessionUnavailable("wsadmin session did not start within {0} seconds".format(self.startTimeout))
+
+    def daemonize(self):
+        """
+        Detaches the worker from the module, so Ansible does not wait for it
+        """
+        try:
+            os.setsid()
+            if os.fork():
+                os._exit(0)
+            os.umask(0o077)
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in (0, 1, 2):
+                os.dup2(devnull, fd)
+            os.closerange(3, 256)
+            self.serve()
+        finally:
+            os._exit(0)
+
+    def serve(self):
+        """
+        Worker: runs wsadmin with the driver and passes requests from the socket to it
+        """
+        with open(self.pidPath, "w") as f:
+            f.write(str(os.getpid()))
+        log = RotatingLog(self.logFile) if self.logFile else None
+        child = subprocess.Popen(
+            ["{0} -f {1}".format(getWsadminCommand(self.wasdir, self.connection), self.driverPath)],
+            shell=True,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT
+        )
+
+        # wsadmin prints its connection messages before the driver starts
+        reader = LineReader(child.stdout.fileno())
+        while True:
+            line = reader.readline()
+            if not line:
+                child.wait()
+                return
+            if log:
+                log.write(line)
+            if line.decode("utf-8", "replace").startswith(MARKER + " ready"):
+                break
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        tmp = "{0}.{1}".format(self.socketPath, os.getpid())
+        server.bind(tmp)
+        os.chmod(tmp, 0o600)
+        server.listen(8)
+        os.rename(tmp, self.socketPath)
+        self.server = server
+        self.inode = os.stat(self.socketPath).st_ino
+        server.settimeout(1.0)
+
+        try:
+            idleSince = time.time()
+            while child.poll() is None and time.time() - idleSince < self.idleTimeout:
+                try:
+                    conn, address = server.accept()
+                except socket.timeout:
+                    continue
+                try:
+                    conn.settimeout(None)
+                    if not self.handle(conn, child, reader, log):
+                        break
+                except (socket.error, IOError, ValueError):
+                    pass
+                finally:
+                    conn.close()
+                    idleSince = time.time()
+        finally:
+            self.unlisten()
+            try:
+                child.stdin.write(b"exit\n")
+                child.stdin.close()
+            except (IOError, OSError):
+                pass
+            for i in range(300):
+                if child.poll() is not None:
+                    break
+                time.sleep(0.1)
+            else:
+                child.kill()
+            if log:
+                log.close()
+
+    def unlisten(self):
+        # Only remove the socket if it has not been replaced by a newer worker
+        try:
+            if os.stat(self.socketPath).st_ino == self.inode:
+                os.remove(self.socketPath)
+        except OSError:
+            pass
+        self.server.close()
+
+    def handle(self, conn, child, reader, log):
+        """
+        Runs one request in the driver and answers with the return code and the tail of the output
+        :return: False if the session can not take more requests
+        """
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        request = json.loads(data.decode("utf-8"))
+
+        token = uuid.uuid4().hex
+        fields = [token, request["script"]] + [str(arg) for arg in request.get("args") or []]
+        child.stdin.write(("\t".join(fields) + "\n").encode("utf-8"))
+        child.stdin.flush()
+
+        done = "{0} done {1} ".format(MARKER, token)
+        timeout = float(request.get("timeout") or DEFAULT_REQUEST_TIMEOUT)
+        deadline = time.time() + timeout
+        tail = deque(maxlen=DEFAULT_TAIL_LINES)
+        rc = None
+        alive = True
+        while True:
+            line = reader.readline(deadline)
+            if line is None:
+                # wsadmin is still busy with the script and can not run another one
+                tail.append("The script did not finish within {0} seconds, the wsadmin session is ended".format(int(timeout)))
+                alive = False
+                break
+            if not line:
+                alive = False
+                break
+            if log:
+                log.write(line)
+            text = line.decode("utf-8", "replace").rstrip("\r\n")
+            index = text.find(done)
+            if index >= 0:
+                if index:
+                    tail.append(text[:index])
+                elif tail and tail[-1] == "":
+                    # The newline the driver writes before the marker
+                    tail.pop()
+                rc = int(text[index + len(done):])
+                break
+            tail.append(text)
+
+        if not alive:
+            # The next request must start a new session instead of connecting to this one
+            self.unlisten()
+        conn.sendall(json.dumps(dict(rc=rc, stdout="\n".join(tail))).encode("utf-8"))
+        return alive
+
+
+def runWsadmin(wasdir, script=None, command=None, args=None, connection=None, session=True, cacheDir=None,
+               idleTimeout=DEFAULT_IDLE_TIMEOUT, logDir=None, name="wsadmin", timeout=DEFAULT_REQUEST_TIMEOUT):
+    """
+    Runs a Jython script or command in the wsadmin session, or in a one-shot wsadmin.sh
+    if no session is available
+    :param wasdir: Path to the WAS installation or profile
+    :param script: Path to a Jython script
+    :param command: Jython command, used instead of script
+    :param args: list or space separated string of script arguments
+    :param connection: dict with the optional keys conntype, host, port, username and password
+    :param session: Try the session first. False always runs a one-shot wsadmin.sh
+    :param cacheDir: Root cache directory of the session socket
+    :param idleTimeout: Seconds a new session is kept running after its last request
+    :param logDir: Directory of the output logs
+    :param name: Name of the output log of a one-shot wsadmin.sh
+    :param timeout: Seconds the session waits for the script before it is ended
+    :return: tuple of returncode, stdout, stderr and True if the session ran the script
+    """
+    if session:
+        try:
+            ws = WsadminSession(wasdir, connection, cacheDir, idleTimeout)
+            ws.logFile = getLogFiles(logDir, "wsadmin-session." + ws.key)[0]
+            if command is not None:
+                script = ws.writeSnippet(command)
+            if isinstance(args, string_types):
+                args = shlex.split(args)
+            returncode, stdout_value = ws.run(script, args, timeout)
+            return returncode, stdout_value, "", True
+        except SessionUnavailable:
+            pass
+        except SessionError as e:
+            return 1, "", str(e), True
+
+    cmd = getWsadminCommand(wasdir, connection)
+    if command is not None:
+        cmd += " -c \"{0}\"".format(command)
+    else:
+        if not isinstance(args, string_types):
+            args = " ".join(args or [])
+        cmd += " -f {0} {1}".format(script, args)
+    returncode, stdout_value, stderr_value = runCommand(cmd, *getLogFiles(logDir, name))
+    return returncode, stdout_value, stderr_value, False